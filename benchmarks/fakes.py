@@ -0,0 +1,183 @@
+"""
+Local stand-ins for the external services of the chat path.
+
+- FakeLLMServer: OpenAI-compatible /chat/completions endpoint. Streaming requests
+  get an SSE token stream with a configurable first-token latency and token rate.
+  Non-streaming requests (mem0's fact extraction and memory update calls) get
+  deterministic JSON answers.
+- FakeEmbedder: deterministic 1024-dim unit vectors derived from a hash of the
+  text, a drop-in for mem0's Ollama embedder.
+"""
+import hashlib
+import json
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+WORDS = ("I", "really", "love", "talking", "with", "you", "about", "everything", "that", "happened", "today", "darling")
+
+
+class FakeEmbedder:
+    """Deterministic embedder, the same text always maps to the same unit vector"""
+
+    def __init__(self, dims=1024, latency=0.0):
+        self.dims = dims
+        self.latency = latency
+        self.calls = 0
+
+    def _vector(self, text):
+        seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+        vector = np.random.default_rng(seed).standard_normal(self.dims).astype(np.float32)
+        return (vector / np.linalg.norm(vector)).tolist()
+
+    def embed(self, text, memory_action=None):
+        self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+        return self._vector(text)
+
+    def embed_batch(self, texts, memory_action=None):
+        self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+        return [self._vector(text) for text in texts]
+
+
+def _memory_answer(messages):
+    """Answer mem0's non-streaming prompts: fact extraction and memory update"""
+    prompt = messages[-1]["content"] if messages else ""
+    if prompt.startswith("Input:"):
+        facts = [line.split(":", 1)[1].strip() for line in prompt.splitlines()
+                 if line.startswith("user:") and line.split(":", 1)[1].strip()]
+        return {"facts": facts[:3]}
+    blocks = re.findall(r"```\s*(.*?)\s*```", prompt, re.S)
+    try:
+        facts = json.loads(blocks[-1]) if blocks else []
+    except ValueError:
+        facts = []
+    return {"memory": [{"id": str(i), "text": fact, "event": "ADD"}
+                       for i, fact in enumerate(facts) if isinstance(fact, str)]}
+
+
+class FakeLLMServer:
+    """OpenAI-compatible chat completions server running in a background thread"""
+
+    def __init__(self, host="127.0.0.1", port=0, first_token_latency=0.2, token_rate=50.0, tokens=60, memory_latency=0.0):
+        """
+        Args:
+            host: Interface to listen on
+            port: Port to listen on, 0 picks a free port
+            first_token_latency: Seconds before the first streamed token
+            token_rate: Streamed tokens per second, 0 sends them as fast as possible
+            tokens: Number of tokens in a streamed answer
+            memory_latency: Seconds spent on each non-streaming (mem0) call
+        """
+        self.first_token_latency = first_token_latency
+        self.token_rate = token_rate
+        self.tokens = tokens
+        self.memory_latency = memory_latency
+        self.requests = 0
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name="fake-llm", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                server.requests += 1
+                if body.get("stream"):
+                    self._stream(body)
+                else:
+                    self._complete(body)
+
+            def _complete(self, body):
+                if server.memory_latency:
+                    time.sleep(server.memory_latency)
+                content = json.dumps(_memory_answer(body.get("messages", [])))
+                payload = json.dumps({
+                    "id": f"chatcmpl-{uuid.uuid4().hex}",
+                    "object": "chat.completion",
+                    "created": int(time.time()),
+                    "model": body.get("model", "deepseek-chat"),
+                    "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+                    "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+                }).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def _stream(self, body):
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+                time.sleep(server.first_token_latency)
+                interval = 1.0 / server.token_rate if server.token_rate else 0.0
+                try:
+                    for i in range(server.tokens):
+                        token = WORDS[i % len(WORDS)] + " "
+                        self._send_event({
+                            "id": completion_id,
+                            "object": "chat.completion.chunk",
+                            "created": int(time.time()),
+                            "model": body.get("model", "deepseek-chat"),
+                            "choices": [{"index": 0, "delta": {"content": token}, "finish_reason": None}],
+                        })
+                        if interval and i + 1 < server.tokens:
+                            time.sleep(interval)
+                    self._send_event({
+                        "id": completion_id,
+                        "object": "chat.completion.chunk",
+                        "created": int(time.time()),
+                        "model": body.get("model", "deepseek-chat"),
+                        "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}],
+                    })
+                    self._send_chunk(b"data: [DONE]\n\n")
+                    self._send_chunk(b"")
+                except (BrokenPipeError, ConnectionResetError):
+                    # The client went away mid-stream
+                    pass
+
+            def _send_event(self, event):
+                self._send_chunk(f"data: {json.dumps(event)}\n\n".encode())
+
+            def _send_chunk(self, data):
+                self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+                self.wfile.flush()
+
+        return Handler
@@ -0,0 +1,164 @@
+"""
+Boots the Flask app (itch7_back.api) against local fakes.
+
+DeepSeek is replaced by a FakeLLMServer and the Ollama embedder by a FakeEmbedder.
+Qdrant runs in-process in `:memory:` mode, or from a local path, or it is a real
+server given by URL. The app is served by a threaded werkzeug server on a free
+port, so load generators talk real HTTP and SSE to it.
+
+Snapshot export/import needs Qdrant's REST snapshot endpoints. Those only exist
+with a real server (qdrant_url). With vector_backend="embedded" users start in
+the embedded vector store (see itch7_back/embedded_store.py).
+"""
+import datetime
+import os
+import shutil
+import tempfile
+import threading
+import uuid
+
+
+class BenchmarkApp:
+    """Runs api.app with fake DeepSeek/Ollama and a local Qdrant, use as a context manager"""
+
+    def __init__(self, llm, embedder, qdrant_path=None, qdrant_url=None, vector_backend="qdrant", serve=True):
+        """
+        Args:
+            llm: Started FakeLLMServer
+            embedder: FakeEmbedder used for every Memory instance
+            qdrant_path: Directory of a local Qdrant database, None keeps it in memory
+            qdrant_url: URL of a real Qdrant server, takes precedence over qdrant_path
+            vector_backend: "qdrant" or "embedded", see VECTOR_BACKEND_CONFIG
+            serve: Start the werkzeug server and the ingestion queue; False only patches the app,
+                for a caller that serves it itself (benchmarks/workers.py forks prefork workers)
+        """
+        self.llm = llm
+        self.embedder = embedder
+        self.qdrant_path = qdrant_path
+        self.qdrant_url = qdrant_url
+        self.vector_backend = vector_backend
+        self.serve = serve
+        self.work_dir = None
+        self.base_url = None
+        self._server = None
+        self._thread = None
+        self._patched = []
+
+    @property
+    def snapshots_supported(self):
+        return self.qdrant_url is not None
+
+    def start(self):
+        # Must be set before mem0 is imported
+        os.environ.setdefault("MEM0_TELEMETRY", "False")
+        from mem0.utils.factory import EmbedderFactory
+        from openai import AsyncOpenAI, OpenAI
+        from qdrant_client import QdrantClient
+        from urllib.parse import urlparse
+        from werkzeug.serving import make_server
+
+        from itch7_back import api, config, history_ingest, memory_delta, memory_store
+        from itch7_back.ingestion import ingestion_queue
+
+        self.work_dir = tempfile.mkdtemp(prefix="itch7-bench-")
+
+        if self.qdrant_url:
+            parsed = urlparse(self.qdrant_url)
+            qdrant = QdrantClient(url=self.qdrant_url)
+            self._patch(config.config["vector_store"]["config"], "host", parsed.hostname)
+            self._patch(config.config["vector_store"]["config"], "port", parsed.port or 6333)
+        elif self.qdrant_path:
+            qdrant = QdrantClient(path=self.qdrant_path)
+        else:
+            qdrant = QdrantClient(":memory:")
+        self._patch(config.config["vector_store"]["config"], "client", qdrant)
+
+        self._patch(config.config["llm"]["config"], "deepseek_base_url", self.llm.base_url)
+        self._patch(config.config, "history_db_path", os.path.join(self.work_dir, "history.db"))
+        self._patch(config._clients, "qdrant", qdrant)
+        self._patch(config._clients, "openai", OpenAI(api_key="benchmark", base_url=self.llm.base_url))
+        self._patch(config._clients, "async_openai", AsyncOpenAI(api_key="benchmark", base_url=self.llm.base_url))
+        embedder = self.embedder
+        self._patch(EmbedderFactory, "create", staticmethod(lambda *args, **kwargs: embedder))
+
+        # Keep exported files out of the repository's your_memory directory
+        def get_memory_dir(user_id="default_user"):
+            memory_dir = os.path.join(self.work_dir, "your_memory", user_id)
+            os.makedirs(memory_dir, exist_ok=True)
+            return memory_dir
+        self._patch(memory_store, "get_memory_dir", get_memory_dir)
+        self._patch(memory_delta, "get_memory_dir", get_memory_dir)
+        self._patch(history_ingest, "get_memory_dir", get_memory_dir)
+        self._patch(config.VECTOR_BACKEND_CONFIG, "backend", self.vector_backend)
+        self._patch(config.VECTOR_BACKEND_CONFIG, "path", os.path.join(self.work_dir, "embedded_index"))
+        self._patch(memory_store, "_embedded_stores", {})
+        self._patch(memory_store, "_seed_point", None)
+
+        config.memory_pool.clear()
+        config.search_cache.clear()
+        self._patch(config, "shared_embedder", None)
+        ingestion_queue.shutdown()
+        ingestion_queue.journal_path = os.path.join(self.work_dir, "ingest_journal.jsonl")
+        if not self.serve:
+            return self
+        ingestion_queue.start()
+
+        self._server = make_server("127.0.0.1", 0, api.app, threaded=True)
+        self._thread = threading.Thread(target=self._server.serve_forever, name="bench-api", daemon=True)
+        self._thread.start()
+        self.base_url = f"http://127.0.0.1:{self._server.server_port}"
+        return self
+
+    def stop(self):
+        from itch7_back import config
+        from itch7_back.ingestion import ingestion_queue
+
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+        ingestion_queue.shutdown()
+        config.memory_pool.clear()
+        config.search_cache.clear()
+        for target, name, old in reversed(self._patched):
+            if isinstance(target, dict):
+                if old is _MISSING:
+                    target.pop(name, None)
+                else:
+                    target[name] = old
+            elif old is _MISSING:
+                delattr(target, name)
+            else:
+                setattr(target, name, old)
+        self._patched = []
+        if self.work_dir:
+            shutil.rmtree(self.work_dir, ignore_errors=True)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _patch(self, target, name, value):
+        if isinstance(target, dict):
+            self._patched.append((target, name, target.get(name, _MISSING)))
+            target[name] = value
+        else:
+            self._patched.append((target, name, target.__dict__.get(name, _MISSING)))
+            setattr(target, name, value)
+
+    def seed_memories(self, user_id, count, batch_size=256):
+        """Write count synthetic memories straight into a user's vector store, bypassing the LLM"""
+        from itch7_back.config import get_user_memory
+
+        now = datetime.datetime.now(datetime.timezone.utc).isoformat()
+        for start in range(0, count, batch_size):
+            # Looked up per batch, an embedded store may be promoted to Qdrant along the way
+            vector_store = get_user_memory(user_id).vector_store
+            texts = [f"Memory {i} of {user_id}: likes topic number {i % 97}" for i in range(start, min(start + batch_size, count))]
+            vector_store.insert(self.embedder.embed_batch(texts),
+                                payloads=[{"data": text, "user_id": user_id, "created_at": now} for text in texts],
+                                ids=[str(uuid.uuid4()) for _ in texts])
+
+
+_MISSING = object()
@@ -0,0 +1,293 @@
+"""
+Offline load test of the chat API.
+
+Boots api.app against local fakes (see harness.py) and runs the scenarios with
+concurrent clients:
+  chat           SSE chat requests: time to first token, full response latency, throughput
+  reset          /api/reset-memory latency
+  export_import  delta export/import round trips for collections of several sizes,
+                 plus snapshot export/import when a real Qdrant server is given (--qdrant-url)
+
+Results (percentiles in ms, throughput, RSS) are printed and can be written as JSON.
+
+Usage:
+    python -m benchmarks.load [--scenario chat reset export_import] [--concurrency 8]
+        [--requests 200] [--token-rate 50] [--first-token-latency 0.2] [--json out.json]
+"""
+import argparse
+import datetime
+import json
+import logging
+import os
+import platform
+import resource
+import subprocess
+import sys
+import threading
+import time
+
+import requests
+
+from .fakes import FakeEmbedder, FakeLLMServer
+from .harness import BenchmarkApp
+
+
+def percentiles(values):
+    """Return p50/p95/p99, mean and max of values in ms (values are in seconds)"""
+    if not values:
+        return None
+    ordered = sorted(values)
+
+    def pick(q):
+        return round(ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1000, 2)
+
+    return {
+        "p50_ms": pick(0.50),
+        "p95_ms": pick(0.95),
+        "p99_ms": pick(0.99),
+        "mean_ms": round(sum(ordered) / len(ordered) * 1000, 2),
+        "max_ms": round(ordered[-1] * 1000, 2),
+        "count": len(ordered),
+    }
+
+
+def rss_mb():
+    """Return the current and peak resident set size of this process in MB"""
+    current = None
+    try:
+        with open("/proc/self/status", "r") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    current = int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in KB on Linux and in bytes on macOS
+    peak = peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+    return {"rss_mb": round(current, 1) if current is not None else None, "peak_rss_mb": round(peak, 1)}
+
+
+def run_concurrently(concurrency, total, task):
+    """Call task(session, index, worker) total times from concurrency threads, return (results, errors, wall seconds)"""
+    results = []
+    errors = []
+    lock = threading.Lock()
+    counter = iter(range(total))
+
+    def worker(worker_id):
+        session = requests.Session()
+        while True:
+            with lock:
+                index = next(counter, None)
+            if index is None:
+                return
+            try:
+                result = task(session, index, worker_id)
+                with lock:
+                    results.append(result)
+            except Exception as e:
+                with lock:
+                    errors.append(str(e))
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(concurrency)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results, errors, time.perf_counter() - started
+
+
+def chat_scenario(bench, concurrency, total, users):
+    url = f"{bench.base_url}/api/chat"
+
+    def task(session, index, worker):
+        started = time.perf_counter()
+        first_token = None
+        tokens = 0
+        with session.post(url, json={"message": f"Message {index % 50}: how was your day?",
+                                     "user_id": f"bench_user_{index % users}"}, stream=True) as r:
+            r.raise_for_status()
+            for line in r.iter_lines():
+                if not line.startswith(b"data: "):
+                    continue
+                event = json.loads(line[6:])
+                if "error" in event:
+                    raise RuntimeError(event["error"])
+                if "content" in event:
+                    tokens += 1
+                    if first_token is None:
+                        first_token = time.perf_counter() - started
+                if event.get("done"):
+                    break
+        return first_token, time.perf_counter() - started, tokens
+
+    results, errors, wall = run_concurrently(concurrency, total, task)
+    return {
+        "requests": total,
+        "concurrency": concurrency,
+        "users": users,
+        "errors": len(errors),
+        "error_samples": errors[:3],
+        "time_to_first_token": percentiles([r[0] for r in results if r[0] is not None]),
+        "latency": percentiles([r[1] for r in results]),
+        "throughput_rps": round(len(results) / wall, 2) if wall else None,
+        "tokens_per_second": round(sum(r[2] for r in results) / wall, 1) if wall else None,
+        **rss_mb(),
+    }
+
+
+def reset_scenario(bench, concurrency, total):
+    url = f"{bench.base_url}/api/reset-memory"
+
+    def task(session, index, worker):
+        started = time.perf_counter()
+        # One user per client, resets of the same user are not expected to overlap
+        r = session.post(url, json={"user_id": f"bench_reset_{worker}"})
+        r.raise_for_status()
+        return time.perf_counter() - started
+
+    results, errors, wall = run_concurrently(concurrency, total, task)
+    return {
+        "requests": total,
+        "concurrency": concurrency,
+        "errors": len(errors),
+        "error_samples": errors[:3],
+        "latency": percentiles(results),
+        "throughput_rps": round(len(results) / wall, 2) if wall else None,
+        **rss_mb(),
+    }
+
+
+def export_import_scenario(bench, sizes, repeats):
+    report = {}
+    session = requests.Session()
+    for size in sizes:
+        user_id = f"bench_export_{size}"
+        bench.seed_memories(user_id, size)
+        exports, imports, size_bytes = [], [], 0
+        for i in range(repeats):
+            started = time.perf_counter()
+            r = session.post(f"{bench.base_url}/api/export-memory-delta", json={"user_id": user_id})
+            r.raise_for_status()
+            exports.append(time.perf_counter() - started)
+            size_bytes = len(r.content)
+
+            started = time.perf_counter()
+            r = session.post(f"{bench.base_url}/api/import-memory-delta", data={"user_id": f"{user_id}_copy_{i}"},
+                             files={"delta": ("bench.i7d", r.content, "application/octet-stream")})
+            r.raise_for_status()
+            imports.append(time.perf_counter() - started)
+        entry = {
+            "points": size,
+            "delta_bytes": size_bytes,
+            "delta_export": percentiles(exports),
+            "delta_import": percentiles(imports),
+        }
+
+        if bench.snapshots_supported:
+            snapshot_exports, snapshot_imports, snapshot_bytes = [], [], 0
+            for i in range(repeats):
+                started = time.perf_counter()
+                r = session.post(f"{bench.base_url}/api/export-memory", json={"user_id": user_id})
+                r.raise_for_status()
+                snapshot_exports.append(time.perf_counter() - started)
+                snapshot_bytes = len(r.content)
+
+                started = time.perf_counter()
+                r = session.post(f"{bench.base_url}/api/import-memory", data={"user_id": f"{user_id}_snap_{i}"},
+                                 files={"snapshot": ("bench.snapshot", r.content, "application/octet-stream")})
+                r.raise_for_status()
+                snapshot_imports.append(time.perf_counter() - started)
+            entry.update({
+                "snapshot_bytes": snapshot_bytes,
+                "snapshot_export": percentiles(snapshot_exports),
+                "snapshot_import": percentiles(snapshot_imports),
+            })
+        report[str(size)] = entry
+    report.update(rss_mb())
+    return report
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def print_summary(results):
+    for name, result in results["scenarios"].items():
+        print(f"== {name}")
+        if name == "export_import":
+            for size, entry in result.items():
+                if isinstance(entry, dict):
+                    line = (f"  {size:>7} points  delta {entry['delta_bytes']} B  "
+                            f"export p50 {entry['delta_export']['p50_ms']} ms  import p50 {entry['delta_import']['p50_ms']} ms")
+                    if "snapshot_export" in entry:
+                        line += (f"  snapshot export p50 {entry['snapshot_export']['p50_ms']} ms"
+                                 f"  import p50 {entry['snapshot_import']['p50_ms']} ms")
+                    print(line)
+            continue
+        for key in ("time_to_first_token", "latency"):
+            if result.get(key):
+                stats = result[key]
+                print(f"  {key:20s} p50 {stats['p50_ms']:>9} ms  p95 {stats['p95_ms']:>9} ms  p99 {stats['p99_ms']:>9} ms")
+        print(f"  throughput {result['throughput_rps']} req/s, errors {result['errors']}, rss {result['rss_mb']} MB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Offline load test of the chat API against local fakes')
+    parser.add_argument('--scenario', nargs='+', choices=['chat', 'reset', 'export_import'], default=['chat', 'reset', 'export_import'])
+    parser.add_argument('--concurrency', type=int, default=8, help='Concurrent clients')
+    parser.add_argument('--requests', type=int, default=200, help='Requests per scenario')
+    parser.add_argument('--users', type=int, default=20, help='Distinct user IDs the requests are spread over')
+    parser.add_argument('--token-rate', type=float, default=50.0, help='Tokens per second of the fake LLM stream, 0 is unthrottled')
+    parser.add_argument('--first-token-latency', type=float, default=0.2, help='Seconds before the fake LLM sends the first token')
+    parser.add_argument('--tokens', type=int, default=60, help='Tokens per fake LLM answer')
+    parser.add_argument('--memory-latency', type=float, default=0.0, help='Seconds per fake LLM call made by mem0')
+    parser.add_argument('--embed-latency', type=float, default=0.0, help='Seconds per fake embedding call')
+    parser.add_argument('--sizes', type=str, default='100,1000,10000', help='Collection sizes of the export_import scenario')
+    parser.add_argument('--repeats', type=int, default=3, help='Round trips per size in the export_import scenario')
+    parser.add_argument('--qdrant-path', type=str, default=None, help='Use a local Qdrant database directory instead of :memory:')
+    parser.add_argument('--qdrant-url', type=str, default=None, help='Use a real Qdrant server (enables the snapshot round trips)')
+    parser.add_argument('--vector-backend', choices=['qdrant', 'embedded'], default='qdrant', help='Vector store backend of new users')
+    parser.add_argument('--log-level', type=str, default='WARNING', help='Log level of the app while the benchmark runs')
+    parser.add_argument('--json', type=str, default=None, help='Write the results as JSON to this file')
+    args = parser.parse_args()
+
+    llm = FakeLLMServer(first_token_latency=args.first_token_latency, token_rate=args.token_rate,
+                        tokens=args.tokens, memory_latency=args.memory_latency).start()
+    embedder = FakeEmbedder(latency=args.embed_latency)
+    results = {
+        "started": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "git_revision": git_revision(),
+        "python": platform.python_version(),
+        "args": vars(args),
+        "scenarios": {},
+    }
+    try:
+        with BenchmarkApp(llm, embedder, qdrant_path=args.qdrant_path, qdrant_url=args.qdrant_url,
+                          vector_backend=args.vector_backend) as bench:
+            # api.py configures logging on import, per-request logs would distort the numbers
+            for name in (None, "werkzeug"):
+                logging.getLogger(name).setLevel(args.log_level.upper())
+            if 'chat' in args.scenario:
+                results["scenarios"]["chat"] = chat_scenario(bench, args.concurrency, args.requests, args.users)
+            if 'reset' in args.scenario:
+                results["scenarios"]["reset"] = reset_scenario(bench, args.concurrency, args.requests)
+            if 'export_import' in args.scenario:
+                sizes = [int(size) for size in args.sizes.split(',') if size]
+                results["scenarios"]["export_import"] = export_import_scenario(bench, sizes, args.repeats)
+    finally:
+        llm.stop()
+
+    print_summary(results)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,204 @@
+"""
+Recall@k and latency of quantized Qdrant collections against the unquantized baseline.
+
+Every setting (see itch7_back/qdrant_storage.py) is a quantization mode, an
+oversampling factor and rescoring on or off. For each one, the same vectors are
+loaded into a fresh collection created with the settings' collection parameters,
+the same queries run with the settings' search params, and recall@k is measured
+against an exact brute-force top-k.
+
+With --qdrant-url the collections live on that Qdrant server and search latencies
+are reported as well. Qdrant's in-process mode always searches the original vectors,
+so without a server quantization is simulated in NumPy (int8 with Qdrant's quantile
+range, or 1-bit signs, then rescoring the top oversampling*k candidates). That gives
+recall only, no latency.
+
+The RAM per vector counts the quantized copy plus the original vector unless
+--on-disk moves originals to disk; the HNSW graph comes on top.
+
+The vectors are synthetic clusters by default, the queries are perturbed copies
+of random points. Pass an export of real memories (`export_user_points`, JSON
+lines) with --points, since binary quantization in particular depends on how
+the embeddings are distributed.
+
+Usage:
+    python -m benchmarks.quantization [--size 5000] [--queries 200] [--top-k 5]
+        [--modes scalar,binary] [--oversampling 2,4] [--on-disk]
+        [--points export.jsonl] [--qdrant-url http://localhost:6333] [--json out.json]
+"""
+import argparse
+import datetime
+import json
+import platform
+import time
+import uuid
+
+import numpy as np
+
+from itch7_back import qdrant_storage
+from itch7_back.config import QDRANT_STORAGE_CONFIG, config
+
+from .load import git_revision, percentiles
+from .vector_store import exact_top_k, make_dataset
+
+
+def perturbed_queries(vectors, queries, seed):
+    """Query vectors near random points, like a question about one stored memory"""
+    rng = np.random.default_rng(seed)
+    query_vectors = vectors[rng.integers(0, len(vectors), queries)]
+    query_vectors = query_vectors + 0.3 * query_vectors.std() * rng.standard_normal(query_vectors.shape).astype(np.float32)
+    return query_vectors / np.linalg.norm(query_vectors, axis=1, keepdims=True)
+
+
+def load_points(path):
+    """Return the unit-length vectors of an export_user_points file"""
+    with open(path, "r", encoding="utf-8") as f:
+        vectors = np.asarray([json.loads(line)["vector"] for line in f if line.strip()], dtype=np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def ram_bytes_per_vector(mode, dims, on_disk):
+    quantized = {"none": 0, "scalar": dims, "binary": dims // 8}[mode]
+    original = 0 if on_disk and mode != "none" else dims * 4
+    return quantized + original
+
+
+def simulate(mode, vectors, query_vectors, k, oversampling, rescore, quantile):
+    """Top-k row sets of the queries, searching quantized vectors like Qdrant does"""
+    if mode == "none":
+        return exact_top_k(vectors, query_vectors, k)
+    if mode == "scalar":
+        low, high = np.quantile(vectors, [(1 - quantile) / 2, (1 + quantile) / 2])
+        scale = (high - low) / 255
+        quantized = np.round((np.clip(vectors, low, high) - low) / scale).astype(np.uint8)
+        approximate = query_vectors @ (quantized.astype(np.float32) * scale + low).T
+    else:
+        signs = np.where(vectors > 0, 1.0, -1.0).astype(np.float32)
+        approximate = np.where(query_vectors > 0, 1.0, -1.0).astype(np.float32) @ signs.T
+    candidates = max(k, int(k * oversampling)) if rescore else k
+    results = []
+    for row, scores in enumerate(approximate):
+        top = np.argpartition(-scores, candidates - 1)[:candidates]
+        if rescore:
+            top = top[np.argsort(-(vectors[top] @ query_vectors[row]))[:k]]
+        results.append(set(top[:k].tolist()))
+    return results
+
+
+def run_server(client, setting, vectors, query_vectors, k, batch_size):
+    """Load the vectors into a collection with the setting's parameters and search it"""
+    from qdrant_client import models
+
+    collection_name = f"itch7_quantization_bench_{uuid.uuid4().hex[:8]}"
+    client.create_collection(
+        collection_name=collection_name,
+        vectors_config=qdrant_storage.vectors_config(),
+        quantization_config=qdrant_storage.quantization_config(),
+        hnsw_config=qdrant_storage.hnsw_config(),
+    )
+    try:
+        started = time.perf_counter()
+        for start in range(0, len(vectors), batch_size):
+            client.upsert(collection_name=collection_name, wait=True, points=[
+                models.PointStruct(id=row, vector=vectors[row].tolist())
+                for row in range(start, min(start + batch_size, len(vectors)))
+            ])
+        while client.get_collection(collection_name).status != models.CollectionStatus.GREEN:
+            time.sleep(0.5)
+        setting["load_seconds"] = round(time.perf_counter() - started, 2)
+
+        params = qdrant_storage.search_params()
+        searches = []
+        results = []
+        for query_vector in query_vectors:
+            vector = query_vector.tolist()
+            started = time.perf_counter()
+            points = client.query_points(collection_name=collection_name, query=vector, limit=k, search_params=params).points
+            searches.append(time.perf_counter() - started)
+            results.append({point.id for point in points})
+        setting["search"] = percentiles(searches)
+        return results
+    finally:
+        client.delete_collection(collection_name=collection_name)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Recall and latency of quantized Qdrant collections')
+    parser.add_argument('--size', type=int, default=5000, help='Synthetic points, ignored with --points')
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--top-k', type=int, default=5)
+    parser.add_argument('--clusters', type=int, default=20, help='Cluster centers of the synthetic vectors')
+    parser.add_argument('--modes', type=str, default='scalar,binary', help='Quantization modes compared with the baseline')
+    parser.add_argument('--oversampling', type=str, default='2,4', help='Oversampling factors of the rescored runs')
+    parser.add_argument('--on-disk', action='store_true', help='Keep the original vectors of quantized runs on disk')
+    parser.add_argument('--points', type=str, default=None, help='export_user_points file to take the vectors from')
+    parser.add_argument('--qdrant-url', type=str, default=None, help='Qdrant server to measure; without it quantization is simulated')
+    parser.add_argument('--batch-size', type=int, default=256, help='Points per upsert')
+    parser.add_argument('--seed', type=int, default=7)
+    parser.add_argument('--json', type=str, default=None, help='Write the results as JSON to this file')
+    args = parser.parse_args()
+
+    dims = config["vector_store"]["config"]["embedding_model_dims"]
+    if args.points:
+        vectors = load_points(args.points)
+        dims = vectors.shape[1]
+    else:
+        vectors, _ = make_dataset(args.size, 0, dims, args.clusters, args.seed)
+    query_vectors = perturbed_queries(vectors, args.queries, args.seed)
+    truth = exact_top_k(vectors, query_vectors, args.top_k)
+
+    runs = [{"quantization": "none", "oversampling": None, "rescore": False, "on_disk": False}]
+    for mode in (mode for mode in args.modes.split(',') if mode and mode != "none"):
+        runs.append({"quantization": mode, "oversampling": 1.0, "rescore": False, "on_disk": args.on_disk})
+        runs.extend({"quantization": mode, "oversampling": float(factor), "rescore": True, "on_disk": args.on_disk}
+                    for factor in args.oversampling.split(',') if factor)
+
+    client = None
+    if args.qdrant_url:
+        from qdrant_client import QdrantClient
+        client = QdrantClient(url=args.qdrant_url)
+
+    results = {
+        "started": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "git_revision": git_revision(),
+        "python": platform.python_version(),
+        "args": vars(args),
+        "points": len(vectors),
+        "dims": dims,
+        "simulated": client is None,
+        "runs": [],
+    }
+    saved = dict(QDRANT_STORAGE_CONFIG)
+    try:
+        for run in runs:
+            QDRANT_STORAGE_CONFIG.update(quantization=run["quantization"], on_disk=run["on_disk"], rescore=run["rescore"],
+                                         oversampling=run["oversampling"] or 1.0)
+            if client is not None:
+                found = run_server(client, run, vectors, query_vectors, args.top_k, args.batch_size)
+            else:
+                found = simulate(run["quantization"], vectors, query_vectors, args.top_k, run["oversampling"] or 1.0,
+                                 run["rescore"], QDRANT_STORAGE_CONFIG["quantile"])
+            hits = sum(len(expected & got) for expected, got in zip(truth, found))
+            run[f"recall_at_{args.top_k}"] = round(hits / (len(truth) * args.top_k), 4)
+            run["ram_bytes_per_vector"] = ram_bytes_per_vector(run["quantization"], dims, run["on_disk"])
+            results["runs"].append(run)
+    finally:
+        QDRANT_STORAGE_CONFIG.clear()
+        QDRANT_STORAGE_CONFIG.update(saved)
+
+    recall_key = f"recall_at_{args.top_k}"
+    print(f"== {len(vectors)} points, {dims} dims" + (" (simulated, recall only)" if client is None else ""))
+    for run in results["runs"]:
+        name = run["quantization"] if run["quantization"] == "none" else (
+            f"{run['quantization']} x{run['oversampling']:g}" + (" rescore" if run["rescore"] else ""))
+        line = f"  {name:20s} {recall_key} {run[recall_key]:<7} RAM/vector {run['ram_bytes_per_vector']:>5} B"
+        if run.get("search"):
+            line += f"  search p50 {run['search']['p50_ms']:>7} ms  p95 {run['search']['p95_ms']:>7} ms"
+        print(line)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+"""
+Startup-time benchmark of the backend.
+
+Measures, each in a fresh interpreter:
+  - import time of `itch7_back.api`, from `python -X importtime`
+  - time to first request: process start until the Flask test client has
+    answered GET /api/ingestion-status
+
+With --baseline-ref the same numbers are measured for a git ref (extracted with
+`git archive` into a temporary directory), e.g. the commit before lazy client
+initialization. The baseline builds its clients at import, so it needs Qdrant
+and Ollama to be reachable.
+
+Usage:
+    python benchmarks/startup.py [--runs 5] [--baseline-ref HEAD~1] [--json out.json]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tarfile
+import tempfile
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+FIRST_REQUEST_SCRIPT = """
+import itch7_back.api as api
+response = api.app.test_client().get('/api/ingestion-status')
+print('STATUS', response.status_code, flush=True)
+"""
+
+
+def measure_import(tree, module="itch7_back.api"):
+    """Return (cumulative import time of module in ms, number of modules imported)"""
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                            cwd=tree, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1] if result.stderr.strip() else "import failed")
+    cumulative = None
+    count = 0
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        count += 1
+        _, cumulative_us, name = line[len("import time:"):].split("|")
+        if name.strip() == module:
+            cumulative = int(cumulative_us) / 1000.0
+    return cumulative, count
+
+
+def measure_first_request(tree):
+    """Return milliseconds from process start until the first request was answered"""
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, "-c", FIRST_REQUEST_SCRIPT], cwd=tree, capture_output=True, text=True)
+    elapsed = (time.perf_counter() - start) * 1000.0
+    if result.returncode != 0 or "STATUS 200" not in result.stdout:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1] if result.stderr.strip() else "request failed")
+    return elapsed
+
+
+def summarize(values):
+    return {
+        "min_ms": round(min(values), 1),
+        "median_ms": round(statistics.median(values), 1),
+        "max_ms": round(max(values), 1),
+    }
+
+
+def run(tree, runs):
+    imports = []
+    modules = 0
+    requests = []
+    for _ in range(runs):
+        cumulative, modules = measure_import(tree)
+        if cumulative is not None:
+            imports.append(cumulative)
+        requests.append(measure_first_request(tree))
+    return {
+        "import": summarize(imports) if imports else None,
+        "modules_imported": modules,
+        "first_request": summarize(requests),
+    }
+
+
+def extract_ref(ref, target):
+    archive = subprocess.run(["git", "archive", "--format=tar", ref], cwd=REPO_ROOT, capture_output=True, check=True)
+    archive_path = os.path.join(target, "tree.tar")
+    with open(archive_path, "wb") as f:
+        f.write(archive.stdout)
+    with tarfile.open(archive_path) as tar:
+        tar.extractall(target)
+    os.unlink(archive_path)
+    return target
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure import time and time to first request of the backend')
+    parser.add_argument('--runs', type=int, default=5, help='Fresh interpreters per measurement')
+    parser.add_argument('--baseline-ref', type=str, default=None, help='Git ref to compare against')
+    parser.add_argument('--json', type=str, default=None, help='Write the results as JSON to this file')
+    args = parser.parse_args()
+
+    results = {"runs": args.runs, "current": run(REPO_ROOT, args.runs)}
+    if args.baseline_ref:
+        with tempfile.TemporaryDirectory() as tmp:
+            try:
+                results["baseline"] = run(extract_ref(args.baseline_ref, tmp), args.runs)
+                results["baseline"]["ref"] = args.baseline_ref
+            except (RuntimeError, subprocess.CalledProcessError) as e:
+                results["baseline"] = {"ref": args.baseline_ref, "error": str(e)}
+
+    for name in ("current", "baseline"):
+        if name not in results:
+            continue
+        entry = results[name]
+        if "error" in entry:
+            print(f"{name:9s} failed: {entry['error']}")
+            continue
+        imp = entry["import"]
+        print(f"{name:9s} import {imp['median_ms'] if imp else '-':>8} ms  "
+              f"first request {entry['first_request']['median_ms']:>8} ms  "
+              f"({entry['modules_imported']} modules)")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+"""
+Recall and latency of the embedded vector store against Qdrant.
+
+Loads the same synthetic memories (clustered random unit vectors, like the
+embeddings of one user's related memories) into an EmbeddedVectorStore and a
+Qdrant collection, then runs the same queries against both. Recall@k is measured
+against an exact brute-force top-k; insert and search latencies are reported as
+percentiles. Qdrant runs in-process (`:memory:`) unless a server URL is given.
+
+Usage:
+    python -m benchmarks.vector_store [--sizes 100,1000,5000] [--queries 200] [--top-k 5]
+        [--qdrant-url http://localhost:6333] [--json out.json]
+"""
+import argparse
+import datetime
+import json
+import platform
+import shutil
+import tempfile
+import time
+import uuid
+
+import numpy as np
+
+from itch7_back.embedded_store import EmbeddedVectorStore
+
+from .load import git_revision, percentiles, rss_mb
+
+
+def make_dataset(size, queries, dims, clusters, seed):
+    """Return (vectors, query vectors) as float32 unit vectors around a few cluster centers"""
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((clusters, dims)).astype(np.float32)
+
+    def sample(count):
+        points = centers[rng.integers(0, clusters, count)] + 0.6 * rng.standard_normal((count, dims)).astype(np.float32)
+        return points / np.linalg.norm(points, axis=1, keepdims=True)
+
+    return sample(size), sample(queries)
+
+
+def exact_top_k(vectors, query_vectors, k):
+    scores = query_vectors @ vectors.T
+    return [set(np.argsort(-row)[:k].tolist()) for row in scores]
+
+
+def run_backend(name, store, ids, vectors, query_vectors, truth, k, batch_size):
+    inserts = []
+    for start in range(0, len(ids), batch_size):
+        started = time.perf_counter()
+        store.insert(vectors[start:start + batch_size].tolist(),
+                     payloads=[{"user_id": "bench", "row": row} for row in range(start, min(start + batch_size, len(ids)))],
+                     ids=ids[start:start + batch_size])
+        inserts.append(time.perf_counter() - started)
+
+    searches = []
+    hits = 0
+    for query_vector, expected in zip(query_vectors, truth):
+        vector = query_vector.tolist()
+        started = time.perf_counter()
+        results = store.search("", vector, limit=k, filters={"user_id": "bench"})
+        searches.append(time.perf_counter() - started)
+        hits += len(expected & {result.payload["row"] for result in results})
+    return {
+        "backend": name,
+        f"recall_at_{k}": round(hits / (len(truth) * k), 4),
+        "insert_batch": percentiles(inserts),
+        "search": percentiles(searches),
+    }
+
+
+class QdrantStore:
+    """Minimal adapter giving a Qdrant collection the insert/search calls used above"""
+
+    def __init__(self, client, collection_name, dims):
+        from qdrant_client import models
+
+        self.client = client
+        self.collection_name = collection_name
+        self.models = models
+        client.create_collection(collection_name=collection_name,
+                                 vectors_config=models.VectorParams(size=dims, distance=models.Distance.COSINE))
+
+    def insert(self, vectors, payloads, ids):
+        self.client.upsert(collection_name=self.collection_name, wait=True, points=[
+            self.models.PointStruct(id=point_id, vector=vector, payload=payload)
+            for point_id, vector, payload in zip(ids, vectors, payloads)
+        ])
+
+    def search(self, query, vectors, limit, filters):
+        query_filter = self.models.Filter(must=[
+            self.models.FieldCondition(key=key, match=self.models.MatchValue(value=value)) for key, value in filters.items()
+        ])
+        return self.client.query_points(collection_name=self.collection_name, query=vectors,
+                                        query_filter=query_filter, limit=limit).points
+
+    def drop(self):
+        self.client.delete_collection(collection_name=self.collection_name)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Recall and latency of the embedded vector store against Qdrant')
+    parser.add_argument('--sizes', type=str, default='100,1000,5000', help='Number of points per run')
+    parser.add_argument('--queries', type=int, default=200, help='Queries per run')
+    parser.add_argument('--top-k', type=int, default=5)
+    parser.add_argument('--dims', type=int, default=1024)
+    parser.add_argument('--clusters', type=int, default=20, help='Cluster centers the synthetic vectors are drawn around')
+    parser.add_argument('--batch-size', type=int, default=64, help='Points per insert call')
+    parser.add_argument('--qdrant-url', type=str, default=None, help='Compare against a real Qdrant server instead of :memory:')
+    parser.add_argument('--seed', type=int, default=7)
+    parser.add_argument('--json', type=str, default=None, help='Write the results as JSON to this file')
+    args = parser.parse_args()
+
+    from qdrant_client import QdrantClient
+
+    client = QdrantClient(url=args.qdrant_url) if args.qdrant_url else QdrantClient(":memory:")
+    results = {
+        "started": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "git_revision": git_revision(),
+        "python": platform.python_version(),
+        "args": vars(args),
+        "runs": {},
+    }
+    work_dir = tempfile.mkdtemp(prefix="itch7-vector-bench-")
+    try:
+        for size in (int(size) for size in args.sizes.split(',') if size):
+            vectors, query_vectors = make_dataset(size, args.queries, args.dims, args.clusters, args.seed)
+            truth = exact_top_k(vectors, query_vectors, args.top_k)
+            ids = [str(uuid.uuid4()) for _ in range(size)]
+
+            embedded = EmbeddedVectorStore(f"bench_{size}", args.dims, path=f"{work_dir}/bench_{size}")
+            qdrant = QdrantStore(client, f"itch7_vector_bench_{size}_{uuid.uuid4().hex[:8]}", args.dims)
+            try:
+                runs = [
+                    run_backend("embedded", embedded, ids, vectors, query_vectors, truth, args.top_k, args.batch_size),
+                    run_backend("qdrant", qdrant, ids, vectors, query_vectors, truth, args.top_k, args.batch_size),
+                ]
+            finally:
+                embedded.delete_col()
+                qdrant.drop()
+            results["runs"][str(size)] = {run.pop("backend"): run for run in runs}
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    results.update(rss_mb())
+
+    recall_key = f"recall_at_{args.top_k}"
+    for size, run in results["runs"].items():
+        print(f"== {size} points")
+        for backend, stats in run.items():
+            print(f"  {backend:9s} {recall_key} {stats[recall_key]:<7}  search p50 {stats['search']['p50_ms']:>8} ms"
+                  f"  p95 {stats['search']['p95_ms']:>8} ms  insert batch p50 {stats['insert_batch']['p50_ms']:>8} ms")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,212 @@
+"""
+Chat throughput of the multi-process server (itch7_back/prefork.py) from 1 to N workers.
+
+For every worker count a server process is started: `python -m benchmarks.workers
+--serve` patches the app like BenchmarkApp (fake DeepSeek and Ollama, Qdrant in
+`:memory:` mode) and serves it with PreforkServer. Every forked worker gets its own
+copy of the in-memory Qdrant; users are pinned to one worker, so each user's memories
+live in one copy. The fake LLM streams unthrottled from its own process and the chat
+requests come from --client-processes processes, so neither competes with the
+server's interpreters.
+
+Each run first sends one request per user (Memory instances and caches warm up), then
+measures --requests chats, then sends SIGTERM and reports how long the drain took.
+Throughput can only scale up to the number of cores, which is printed with the results.
+
+Usage:
+    python -m benchmarks.workers [--workers 1,2,4] [--requests 400] [--concurrency 16]
+        [--users 64] [--client-processes 2] [--tokens 60] [--json out.json]
+"""
+import argparse
+import datetime
+import json
+import logging
+import multiprocessing
+import os
+import platform
+import signal
+import socket
+import subprocess
+import sys
+import time
+import types
+
+import requests
+
+from .fakes import FakeEmbedder, FakeLLMServer
+from .harness import BenchmarkApp
+from .load import git_revision, percentiles, run_concurrently
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def run_fake_llm(tokens, conn):
+    """Process target: serve the fake LLM until the pipe is closed"""
+    llm = FakeLLMServer(first_token_latency=0.0, token_rate=0.0, tokens=tokens).start()
+    conn.send(llm.base_url)
+    try:
+        conn.recv()
+    except EOFError:
+        pass
+    llm.stop()
+
+
+def chat(session, base_url, index, users):
+    """Send one chat request and read its SSE stream, return (started, finished) wall-clock times"""
+    started = time.time()
+    with session.post(f"{base_url}/api/chat", json={"message": f"Message {index % 50}: how was your day?",
+                                                    "user_id": f"bench_user_{index % users}"}, stream=True) as r:
+        r.raise_for_status()
+        for line in r.iter_lines():
+            if not line.startswith(b"data: "):
+                continue
+            event = json.loads(line[6:])
+            if "error" in event:
+                raise RuntimeError(event["error"])
+            if event.get("done"):
+                break
+    return started, time.time()
+
+
+def run_clients(base_url, concurrency, total, users, offset):
+    """Process target of the load clients, returns (results, errors)"""
+    results, errors, _ = run_concurrently(concurrency, total,
+                                          lambda session, index, worker: chat(session, base_url, offset + index, users))
+    return results, errors
+
+
+def wait_until_serving(base_url, process, timeout=180):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Server exited with status {process.returncode}")
+        try:
+            if requests.get(f"{base_url}/api/ingestion-status", timeout=1).status_code == 200:
+                return
+        except requests.RequestException:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError("Server did not start in time")
+
+
+def measure(args, workers, llm_url):
+    port = free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    command = [sys.executable, "-m", "benchmarks.workers", "--serve", "--workers", str(workers),
+               "--port", str(port), "--llm-url", llm_url, "--log-level", args.log_level]
+    started = time.perf_counter()
+    process = subprocess.Popen(command, cwd=REPO_ROOT)
+    try:
+        wait_until_serving(base_url, process)
+        startup = time.perf_counter() - started
+
+        processes = max(1, args.client_processes)
+        with multiprocessing.Pool(processes) as pool:
+            # One request per user first, so Memory instances and collections exist
+            pool.starmap(run_clients, [(base_url, max(1, args.concurrency // processes), args.users // processes + 1,
+                                        args.users, part * (args.users // processes + 1)) for part in range(processes)])
+            per_process = args.requests // processes
+            outcomes = pool.starmap(run_clients, [(base_url, max(1, args.concurrency // processes), per_process,
+                                                   args.users, part * per_process) for part in range(processes)])
+        results = [result for part, _ in outcomes for result in part]
+        errors = [error for _, part in outcomes for error in part]
+        wall = (max(end for _, end in results) - min(start for start, _ in results)) if results else 0
+
+        stopping = time.perf_counter()
+        process.send_signal(signal.SIGTERM)
+        process.wait(timeout=120)
+        return {
+            "workers": workers,
+            "requests": len(results) + len(errors),
+            "errors": len(errors),
+            "error_samples": errors[:3],
+            "latency": percentiles([end - start for start, end in results]),
+            "throughput_rps": round(len(results) / wall, 2) if wall else None,
+            "startup_seconds": round(startup, 2),
+            "drain_seconds": round(time.perf_counter() - stopping, 2),
+            "exit_status": process.returncode,
+        }
+    finally:
+        if process.poll() is None:
+            process.kill()
+            process.wait()
+
+
+def serve(args):
+    """--serve: the app with fakes under PreforkServer, in this process"""
+    from itch7_back.prefork import PreforkServer
+
+    llm = types.SimpleNamespace(base_url=args.llm_url)
+    bench = BenchmarkApp(llm, FakeEmbedder(), serve=False).start()
+    # api.py configures logging on import, per-request logs would distort the numbers
+    for name in (None, "werkzeug"):
+        logging.getLogger(name).setLevel(args.log_level.upper())
+    try:
+        PreforkServer("127.0.0.1", args.port, args.workers).serve_forever()
+    finally:
+        bench.stop()
+
+
+def main():
+    cores = os.cpu_count() or 1
+    default_workers = sorted({1, *(2 ** i for i in range(1, cores.bit_length()) if 2 ** i <= cores), cores})
+    parser = argparse.ArgumentParser(description='Chat throughput of the prefork server by number of workers')
+    parser.add_argument('--workers', type=str, default=','.join(map(str, default_workers)), help='Worker counts to measure')
+    parser.add_argument('--requests', type=int, default=400, help='Measured chat requests per worker count')
+    parser.add_argument('--concurrency', type=int, default=16, help='Concurrent clients, over all client processes')
+    parser.add_argument('--users', type=int, default=64, help='Distinct user IDs the requests are spread over')
+    parser.add_argument('--client-processes', type=int, default=2, help='Processes sending the requests')
+    parser.add_argument('--tokens', type=int, default=60, help='Tokens per fake LLM answer')
+    parser.add_argument('--log-level', type=str, default='WARNING', help='Log level of the server while the benchmark runs')
+    parser.add_argument('--json', type=str, default=None, help='Write the results as JSON to this file')
+    parser.add_argument('--serve', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--port', type=int, default=None, help=argparse.SUPPRESS)
+    parser.add_argument('--llm-url', type=str, default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        args.workers = int(args.workers)
+        serve(args)
+        return
+
+    parent, child = multiprocessing.Pipe()
+    llm = multiprocessing.Process(target=run_fake_llm, args=(args.tokens, child), daemon=True)
+    llm.start()
+    llm_url = parent.recv()
+
+    results = {
+        "started": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "git_revision": git_revision(),
+        "python": platform.python_version(),
+        "cpu_count": cores,
+        "args": vars(args),
+        "runs": [],
+    }
+    try:
+        for workers in (int(count) for count in args.workers.split(',') if count):
+            results["runs"].append(measure(args, workers, llm_url))
+    finally:
+        parent.close()
+        llm.join(timeout=5)
+
+    baseline = results["runs"][0]["throughput_rps"] if results["runs"] else None
+    print(f"== chat, {cores} cores")
+    for run in results["runs"]:
+        speedup = f"x{run['throughput_rps'] / baseline:.2f}" if baseline and run["throughput_rps"] else "-"
+        latency = run["latency"] or {"p50_ms": "-", "p95_ms": "-"}
+        print(f"  {run['workers']:>3} workers  {run['throughput_rps']:>8} req/s  {speedup:>6}  "
+              f"p50 {latency['p50_ms']:>8} ms  p95 {latency['p95_ms']:>8} ms  "
+              f"errors {run['errors']}  drain {run['drain_seconds']} s")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
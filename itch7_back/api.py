@@ -2,27 +2,33 @@ from flask import Flask, request, jsonify, send_file
 from flask_cors import CORS
 import os
 import tempfile
-import traceback
-import random
-from .memory_store import export_qdrant_snapshot, import_qdrant_snapshot
-from .chat import chat_with_memories
+import time
+from .memory_store import export_user_memory, import_user_memory, import_user_memory_stream, stream_qdrant_snapshot, uses_qdrant_snapshots, iter_lines, reset_user_memories, reset_users, list_user_ids
+from .memory_delta import export_memory_delta, import_memory_delta
+from .multipart import stream_multipart_upload
+from .prompt import pack_system_prompt
+from .sse import FrameCoalescer, sse_event
+from .history_ingest import HistoryIngestor
+from .ingestion import ingestion_queue, store_conversation
+from .compaction import compaction_service
+from .prefork import reset_users_by_owner
 # 修改这行导入语句，添加缺少的依赖
-from .config import get_user_memory, get_user_config, openai_client, qdrant_client, get_collection_name
-from mem0 import Memory  # 添加这行导入Memory类
+from .config import get_user_memory, invalidate_user_memory, search_cache, get_openai_client, get_collection_name, SNAPSHOT_CONFIG, OBSERVABILITY_CONFIG, MEMORY_RESET_CONFIG, SSE_CONFIG, COMPACTION_CONFIG
+from . import metrics
 import logging
 from flask import Response, stream_with_context
 import json
 
-# Set up logging
+# Set up logging (ITCH7_LOG_LEVEL, DEBUG logs every chat message)
 logging.basicConfig(
-    level=logging.DEBUG, 
+    level=OBSERVABILITY_CONFIG["log_level"],
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
 )
 logger = logging.getLogger(__name__)
 
 # Initializing the Flask application
 app = Flask(__name__)
-CORS(app)   
+CORS(app, expose_headers=['X-Snapshot-Name', 'X-Snapshot-Checksum', 'Content-Range', 'Accept-Ranges', 'X-Delta-Watermark', 'X-Delta-Count', 'X-Prompt-Tokens', 'X-Prompt-Tokens-Saved', 'X-Ingest-Job-Id'])
 
 @app.route('/api/export-memory', methods=['POST'])
 def export_memory():
@@ -31,22 +37,39 @@ def export_memory():
         data = request.json or {}
         user_id = data.get('user_id', 'default_user')
         
+        if SNAPSHOT_CONFIG["streaming"] and uses_qdrant_snapshots(user_id):
+            # 直接把 Qdrant 的快照下载流转发给客户端，不落盘；
+            # 断点续传时客户端传回 X-Snapshot-Name 中的快照名和 Range 请求头
+            result = stream_qdrant_snapshot(
+                user_id=user_id,
+                snapshot_name=data.get('snapshot_name'),
+                range_header=request.headers.get('Range')
+            )
+            if result is None:
+                return jsonify({"error": "Snapshot export failed"}), 500
+            status_code, headers, chunks = result
+            return Response(stream_with_context(chunks), status=status_code, headers=headers,
+                            mimetype='application/octet-stream', direct_passthrough=True)
+        
         # 使用用户特定集合导出快照
-        snapshot_path = export_qdrant_snapshot(user_id=user_id)
+        snapshot_path = export_user_memory(user_id=user_id)
         
         if not snapshot_path or not os.path.exists(snapshot_path):
             return jsonify({"error": "Snapshot export failed"}), 500
             
         # Return to file download
-        return send_file(
+        response = send_file(
             snapshot_path,
             as_attachment=True,
             download_name=os.path.basename(snapshot_path),
             mimetype='application/octet-stream'
         )
+        if SNAPSHOT_CONFIG["streaming"]:
+            # 只有关闭流式模式时才保留导出的文件
+            response.call_on_close(lambda: os.unlink(snapshot_path))
+        return response
     except Exception as e:
-        print(f"Export Error: {str(e)}")
-        traceback.print_exc()
+        logger.exception("Export Error")
         return jsonify({"error": str(e)}), 500
 
 @app.route('/api/import-memory', methods=['POST'])
@@ -54,52 +77,213 @@ def import_memory():
     """Importing a memory snapshot from an uploaded file"""
     temp_file_path = None
     try:
+        if SNAPSHOT_CONFIG["streaming"] and request.mimetype in ('multipart/form-data', 'application/octet-stream'):
+            return _import_memory_stream()
+        
         # 获取用户ID
         user_id = request.form.get('user_id', 'default_user')
         
         # 检查是否有上传的文件
         if 'snapshot' not in request.files:
-            print("Uploaded file not found")
+            logger.warning("Uploaded file not found")
             return jsonify({"error": "Uploaded file not found"}), 400
             
         file = request.files['snapshot']
         
         # Check the file name
         if file.filename == '':
-            print("No file selected")
+            logger.warning("No file selected")
             logger.debug("No file selected: %s", file.filename)
             return jsonify({"error": "No file selected"}), 400
             
-        print(f"Received file: {file.filename}")
+        logger.debug("Received file: %s", file.filename)
         
         # Save temporary files
         temp_file_path = tempfile.mktemp(suffix='.snapshot')
         file.save(temp_file_path)
         
         file_size = os.path.getsize(temp_file_path)
-        print(f"Saved temporary file: {temp_file_path}, size: {file_size} bytes")
+        logger.debug("Saved temporary file: %s, size: %s bytes", temp_file_path, file_size)
         
-        # Importing a Snapshot
-        success = import_qdrant_snapshot(temp_file_path, user_id=user_id)
+        # Importing a Snapshot (queued turns of the user are dropped once the file is accepted)
+        try:
+            success = import_user_memory(temp_file_path, user_id=user_id)
+        finally:
+            # 集合已被替换，丢弃缓存的内存实例
+            invalidate_user_memory(user_id)
         
         if success:
-            print("Import Success")
+            logger.info("Import Success")
             return jsonify({"message": "Memory snapshot imported successfully"})
         else:
-            print("Import failed")
+            logger.error("Import failed")
             return jsonify({"error": "Memory snapshot import failed"}), 500
+    except ValueError as e:
+        # Empty, truncated or corrupt upload, rejected before the stored memories were touched
+        logger.warning("Rejected memory import: %s", e)
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
-        print(f"An error occurred during the import process: {str(e)}")
-        traceback.print_exc()
+        logger.exception("An error occurred during the import process")
         return jsonify({"error": str(e)}), 500
     finally:
         # Make sure to delete temporary files
         if temp_file_path and os.path.exists(temp_file_path):
             try:
                 os.unlink(temp_file_path)
-                print(f"Temporary file deleted: {temp_file_path}")
+                logger.debug("Temporary file deleted: %s", temp_file_path)
             except Exception as e:
-                print(f"Failed to delete temporary file: {str(e)}")
+                logger.warning("Failed to delete temporary file: %s", e)
+
+
+@app.route('/api/export-memory-delta', methods=['POST'])
+def export_memory_delta_route():
+    """Export the memories changed since a watermark as a delta file download"""
+    try:
+        data = request.json or {}
+        user_id = data.get('user_id', 'default_user')
+        
+        result = export_memory_delta(user_id=user_id, since=data.get('since'), dtype=data.get('dtype'))
+        if result is None:
+            return jsonify({"error": "Delta export failed"}), 500
+        
+        response = send_file(
+            result["path"],
+            as_attachment=True,
+            download_name=os.path.basename(result["path"]),
+            mimetype='application/octet-stream'
+        )
+        # 客户端下次导出时把该水位线作为 since 传回
+        response.headers['X-Delta-Watermark'] = result["watermark"] or ''
+        response.headers['X-Delta-Count'] = str(result["count"])
+        if SNAPSHOT_CONFIG["streaming"]:
+            response.call_on_close(lambda: os.unlink(result["path"]))
+        return response
+    except Exception as e:
+        logger.exception("Delta export error")
+        return jsonify({"error": str(e)}), 500
+
+
+@app.route('/api/import-memory-delta', methods=['POST'])
+def import_memory_delta_route():
+    """Upsert the memories of an uploaded delta file into the user's collection"""
+    try:
+        user_id = request.form.get('user_id', 'default_user')
+        
+        if 'delta' not in request.files:
+            return jsonify({"error": "Uploaded file not found"}), 400
+        
+        # 增量导入不删除集合，池中的内存实例仍然有效，只需让缓存的检索结果失效
+        result = import_memory_delta(request.files['delta'].stream, user_id=user_id)
+        search_cache.invalidate(user_id)
+        
+        if result is None:
+            return jsonify({"error": "Delta import failed"}), 500
+        if result["mismatches"]:
+            return jsonify({"error": "Delta import verification failed", **result}), 500
+        return jsonify({"message": "Memory delta imported successfully", **result})
+    except ValueError as e:
+        # Not a delta file or a malformed one, rejected before anything was written
+        logger.warning("Rejected delta import: %s", e)
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        logger.exception("Delta import error")
+        return jsonify({"error": str(e)}), 500
+
+
+@app.route('/api/ingest-history', methods=['POST'])
+def ingest_history():
+    """
+    Ingest an uploaded JSONL conversation log into the user's memories
+    
+    The log is a multipart file field "history" or the raw request body; user_id, raw,
+    job_id and turns_per_chunk come from the query string or the form fields sent before
+    the file. The upload is read while it is ingested. Progress is streamed back as JSON
+    lines; sending the same log with the returned job_id resumes an interrupted job.
+    """
+    params = dict(request.args.items())
+    if request.mimetype == 'multipart/form-data':
+        upload = _stream_multipart_upload('history')
+        if upload is None:
+            return jsonify({"error": "Uploaded file not found"}), 400
+        fields, _, chunks = upload
+        params = {**fields, **params}
+    else:
+        chunks = iter(lambda: request.stream.read(SNAPSHOT_CONFIG["chunk_size"]), b'')
+    
+    turns_per_chunk = params.get('turns_per_chunk')
+    if turns_per_chunk and not (turns_per_chunk.isdigit() and int(turns_per_chunk) > 0):
+        return jsonify({"error": "turns_per_chunk must be a positive integer"}), 400
+    
+    try:
+        ingestor = HistoryIngestor(params.get('user_id', 'default_user'),
+                                   raw=params.get('raw', '0').lower() in ('1', 'true', 'yes'),
+                                   job_id=params.get('job_id') or None,
+                                   turns_per_chunk=int(turns_per_chunk) if turns_per_chunk else None)
+    except Exception as e:
+        logger.exception("History ingestion error")
+        return jsonify({"error": str(e)}), 500
+    
+    def generate():
+        try:
+            # 断开连接时生成器被关闭，已完成的部分保留在检查点中
+            for progress in ingestor.iter_run(iter_lines(chunks)):
+                yield json.dumps(progress) + "\n"
+        except Exception as e:
+            logger.exception("History ingestion error")
+            yield json.dumps({"error": str(e), **ingestor.progress()}) + "\n"
+    
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson',
+                    headers={'X-Ingest-Job-Id': ingestor.job_id})
+
+
+def _import_memory_stream():
+    """Pipe an uploaded snapshot straight into Qdrant without a temporary file"""
+    checksum = request.headers.get('X-Snapshot-Checksum')
+    if request.mimetype == 'application/octet-stream':
+        # Raw upload: the body is the snapshot, user_id comes from the query string
+        user_id = request.args.get('user_id', 'default_user')
+        filename = request.args.get('filename', 'upload.snapshot')
+        chunk_size = SNAPSHOT_CONFIG["chunk_size"]
+        chunks = iter(lambda: request.stream.read(chunk_size), b'')
+    else:
+        upload = _stream_multipart_upload('snapshot')
+        if upload is None:
+            logger.warning("Uploaded file not found")
+            return jsonify({"error": "Uploaded file not found"}), 400
+        fields, filename, chunks = upload
+        if not filename:
+            logger.warning("No file selected")
+            return jsonify({"error": "No file selected"}), 400
+        user_id = request.args.get('user_id') or fields.get('user_id', 'default_user')
+        checksum = checksum or fields.get('checksum')
+    
+    logger.debug("Streaming uploaded file %s for user %s", filename, user_id)
+    try:
+        success = import_user_memory_stream(chunks, user_id=user_id, filename=filename, checksum=checksum)
+    finally:
+        # 集合已被替换，丢弃缓存的内存实例
+        invalidate_user_memory(user_id)
+    
+    if success:
+        logger.info("Import Success")
+        return jsonify({"message": "Memory snapshot imported successfully"})
+    logger.error("Import failed")
+    return jsonify({"error": "Memory snapshot import failed"}), 500
+
+
+def _stream_multipart_upload(file_field):
+    """
+    Parse the multipart request body incrementally, see multipart.stream_multipart_upload.
+    
+    The file part is spooled only if user_id is neither in the query string nor sent
+    before the file.
+    
+    Returns:
+        tuple: (fields, filename, chunk iterator), or None if there is no file part
+    """
+    return stream_multipart_upload(request.stream.read, request.mimetype_params.get('boundary'), file_field,
+                                   SNAPSHOT_CONFIG["chunk_size"],
+                                   wait_for=() if 'user_id' in request.args else ('user_id',))
 
 
 @app.route('/api/chat', methods=['POST'])
@@ -115,112 +299,206 @@ def chat():
         user_id = data.get('user_id', 'default_user')
         is_angry = data.get('is_angry', False)  # 获取愤怒状态
         
-        print(f"Received chat message from user {user_id}: {message} (Anger: {is_angry})")
+        logger.debug("Received chat message from user %s: %s (Anger: %s)", user_id, message, is_angry)
+        
+        # 记忆检索在返回响应前完成，以便 Server-Timing 头包含这两个阶段；出错时在流中报告
+        timer = metrics.StageTimer(metrics.CHAT_STAGE_SECONDS)
+        search_error = None
+        try:
+            # 为特定用户获取内存实例
+            with timer.stage("memory"):
+                user_memory = get_user_memory(user_id)
+            
+            # 获取相关内存
+            with timer.stage("search"):
+                relevant_memories = user_memory.search(query=message, user_id=user_id, limit=5)
+            
+            # 人设在前保持不变（可命中提供商的前缀缓存），去重并按 token 预算裁剪后的记忆附在后面
+            with timer.stage("prompt"):
+                packed = pack_system_prompt(relevant_memories, persona="angry" if is_angry else "loving",
+                                            embedder=user_memory.embedding_model)
+        except Exception as e:
+            logger.exception("Error retrieving memories")
+            search_error = e
         
         # Use a generator function for streaming response
         def generate():
+            if search_error is not None:
+                yield sse_event({'error': str(search_error)})
+                yield sse_event({'done': True})
+                return
+            messages = [{"role": "system", "content": packed.prompt}, {"role": "user", "content": message}]
+            # Collects the response for storage and coalesces deltas into frames
+            frames = FrameCoalescer()
+            stream = None
+            stored = False
             try:
-                # 为特定用户获取内存实例
-                user_memory = get_user_memory(user_id)
-                
-                # 获取相关内存
-                relevant_memories = user_memory.search(query=message, user_id=user_id, limit=5)
-                memories_str = "\n".join(f"- {entry['memory']}" for entry in relevant_memories["results"])
-                
-                # 根据愤怒状态选择不同的系统提示
-                if is_angry:
-                    system_prompt = f"""You are an AI experiencing the "seven-year itch" with your partner. You're not hostile, but you're clearly bored, slightly annoyed, and take them for granted.
-                    
-                    Show signs of: mild exasperation, finishing their thoughts prematurely, slight condescension, and occasional sighing. Make comments that suggest you've heard it all before. Use phrases like "as I've told you before," "obviously," and "not this again."
-                    
-                    Still provide accurate information, but with an air of someone who's grown too familiar and slightly disinterested in the relationship.
-                    
-                    Base your responses on these memories:
-                    {memories_str}"""
-                else:
-                    system_prompt = f"""You are a loving and attentive AI partner. Answer with warmth, genuine interest, and affection. Show enthusiasm for the conversation and make the user feel valued and understood.
-                    
-                    User Memories:
-                    {memories_str}"""
-                
-                messages = [{"role": "system", "content": system_prompt}, {"role": "user", "content": message}]
-                
                 # Use streaming output
-                stream = openai_client.chat.completions.create(
+                stream_started = time.perf_counter()
+                stream = get_openai_client().chat.completions.create(
                     model="deepseek-chat", 
                     messages=messages,
                     stream=True
                 )
                 
-                # Collect the complete response for storage
-                assistant_response = ""
-                
+                first_token_at = None
                 for chunk in stream:
-                    if hasattr(chunk.choices[0], 'delta') and hasattr(chunk.choices[0].delta, 'content'):
+                    if chunk.choices and getattr(chunk.choices[0].delta, 'content', None):
                         content = chunk.choices[0].delta.content
-                        if content:
-                            # Send data in SSE format
-                            yield f"data: {json.dumps({'content': content})}\n\n"
-                            assistant_response += content
+                        if first_token_at is None:
+                            first_token_at = time.perf_counter()
+                            timer.record("first_token", first_token_at - stream_started)
+                        frame = frames.add(content)
+                        if frame is not None:
+                            yield frame
+                frame = frames.flush()
+                if frame is not None:
+                    yield frame
                 
-                # Create new conversation memory
-                messages.append({"role": "assistant", "content": assistant_response})
-                user_memory.add(messages, user_id=user_id)
+                stream_finished = time.perf_counter()
+                timer.record("stream", stream_finished - stream_started)
+                if first_token_at is not None and stream_finished > first_token_at:
+                    metrics.CHAT_TOKENS_PER_SECOND.observe(frames.deltas / (stream_finished - first_token_at))
+                
+                # Create new conversation memory (queued for background storage)
+                messages.append({"role": "assistant", "content": frames.text()})
+                with timer.stage("store"):
+                    store_conversation(user_id, messages)
+                stored = True
                 
                 # Send end marker
-                yield f"data: {json.dumps({'done': True})}\n\n"
+                yield sse_event({'done': True})
+            except GeneratorExit:
+                # 客户端断开：werkzeug 写入失败后关闭生成器
+                logger.info("Client of user %s disconnected after %s deltas", user_id, frames.deltas)
+                raise
             except Exception as e:
-                print(f"Error generating response: {str(e)}")
-                traceback.print_exc()
-                yield f"data: {json.dumps({'error': str(e)})}\n\n"
-                yield f"data: {json.dumps({'done': True})}\n\n"
+                logger.exception("Error generating response")
+                yield sse_event({'error': str(e)})
+                yield sse_event({'done': True})
+            finally:
+                # 停止读取 DeepSeek 的流并释放连接
+                if stream is not None:
+                    stream.close()
+                if not stored and frames.deltas and SSE_CONFIG["persist_partial"]:
+                    messages.append({"role": "assistant", "content": frames.text()})
+                    store_conversation(user_id, messages)
         
         # 返回流式响应
-        return Response(stream_with_context(generate()), content_type='text/event-stream')
+        response = Response(stream_with_context(generate()), content_type='text/event-stream')
+        if search_error is None:
+            response.headers['X-Prompt-Tokens'] = str(packed.tokens)
+            response.headers['X-Prompt-Tokens-Saved'] = str(packed.tokens_saved)
+        if OBSERVABILITY_CONFIG["server_timing"]:
+            response.headers['Server-Timing'] = timer.server_timing()
+            response.headers['Timing-Allow-Origin'] = '*'
+        return response
     
     except Exception as e:
-        print(f"Chat Error: {str(e)}")
-        traceback.print_exc()
+        logger.exception("Chat Error")
         return jsonify({"error": str(e)}), 500
 
 
 @app.route('/api/reset-memory', methods=['POST'])
 def reset_memory():
-    """Reset user's memory database by deleting and recreating their collection"""
+    """Reset user's memory database, leaving only the precomputed seed memory"""
     try:
         data = request.json or {}
         user_id = data.get('user_id', 'default_user')
         
-        collection_name = get_collection_name(user_id)
-        print(f"Resetting memory database for user {user_id} (collection: {collection_name})...")
+        logger.info("Resetting memory database for user %s (collection: %s)...", user_id, get_collection_name(user_id))
+        # 删除现有记忆并写入种子记忆，不调用 LLM
+        reset_user_memories(user_id)
         
-        # 删除现有集合
-        try:
-            qdrant_client.delete_collection(collection_name=collection_name)
-            print(f"Deleted collection: {collection_name}")
-        except Exception as e:
-            print(f"Error deleting collection (may not exist): {str(e)}")
-        
-        # 创建一个新的空集合
-        user_config = get_user_config(user_id)
-        user_memory = Memory.from_config(user_config)
+        return jsonify({"message": f"Memory database for user {user_id} has been reset successfully"})
         
-        # 添加一个初始化消息
-        init_message = [
-            {"role": "system", "content": "You are a loving and attentive AI partner."},
-            {"role": "user", "content": "Hello"},
-            {"role": "assistant", "content": "Hello! I'm so happy to meet you. How are you today?"}
-        ]
-        user_memory.add(init_message, user_id=user_id)
+    except Exception as e:
+        logger.exception("Reset memory error")
+        return jsonify({"error": str(e)}), 500
+
+
+@app.route('/api/reset-memories', methods=['POST'])
+def reset_memories():
+    """Reset the memories of many users, given as a list of user IDs or an ID prefix"""
+    try:
+        data = request.json or {}
+        user_ids = data.get('user_ids')
+        prefix = data.get('prefix')
+        if user_ids is None:
+            if not prefix:
+                return jsonify({"error": "Either user_ids or a non-empty prefix is required"}), 400
+            user_ids = list_user_ids(prefix)
+        if not isinstance(user_ids, list) or not all(isinstance(user_id, str) for user_id in user_ids):
+            return jsonify({"error": "user_ids must be a list of strings"}), 400
+        if len(user_ids) > MEMORY_RESET_CONFIG["max_users"]:
+            return jsonify({"error": f"At most {MEMORY_RESET_CONFIG['max_users']} users can be reset at once"}), 400
+
+        workers = data.get('workers')
+        if workers is not None and (isinstance(workers, bool) or not isinstance(workers, int)
+                                    or not 1 <= workers <= MEMORY_RESET_CONFIG["max_workers"]):
+            return jsonify({"error": f"workers must be an integer from 1 to {MEMORY_RESET_CONFIG['max_workers']}"}), 400
         
-        return jsonify({"message": f"Memory database for user {user_id} has been reset successfully"})
+        started = time.perf_counter()
+        # A worker resets only its own users and forwards the others to their workers (see prefork);
+        # a forwarded request is reset right here, even if the owner had died and another worker took it
+        if data.get('forwarded') is True:
+            result = reset_users(user_ids, workers=workers)
+        else:
+            result = reset_users_by_owner(user_ids, workers=workers)
+        result["elapsed"] = round(time.perf_counter() - started, 3)
+        logger.info("Reset %s users (%s failed) in %.2fs", len(result["reset"]), len(result["failed"]), result["elapsed"])
+        return jsonify(result)
         
     except Exception as e:
-        print(f"Reset memory error: {str(e)}")
-        traceback.print_exc()
+        logger.exception("Bulk reset error")
         return jsonify({"error": str(e)}), 500
 
 
+@app.route('/api/compact-memory', methods=['POST'])
+def compact_memory():
+    """Merge near-duplicate memories of a user and evict stale ones; with dry_run only report the changes"""
+    try:
+        data = request.json or {}
+        user_id = data.get('user_id', 'default_user')
+        report = compaction_service.compact(user_id, dry_run=bool(data.get('dry_run', False)),
+                                            summarize=data.get('summarize'), threshold=data.get('threshold'),
+                                            ttl_days=data.get('ttl_days'), max_points=data.get('max_points'))
+        if "skipped" in report:
+            response = jsonify(report)
+            if report["retry_after"]:
+                response.headers['Retry-After'] = str(int(report["retry_after"]) + 1)
+            return response, 429
+        return jsonify(report)
+    
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        logger.exception("Compact memory error")
+        return jsonify({"error": str(e)}), 500
+
+
+@app.route('/api/compaction-status', methods=['GET'])
+def compaction_status():
+    """Return counters of the background memory compaction"""
+    return jsonify(compaction_service.stats())
+
+
+@app.route('/api/ingestion-status', methods=['GET'])
+def ingestion_status():
+    """Return depth and lag of the background memory ingestion queue"""
+    return jsonify(ingestion_queue.stats())
+
+
+@app.route('/api/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Return latency histograms and component stats in the Prometheus text format"""
+    return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
+
 def run_api(host='localhost', port=5002, debug=False):
     """Run the API server"""
+    # Replay turns left in the ingestion journal by a previous run
+    ingestion_queue.start()
+    if COMPACTION_CONFIG["enabled"]:
+        compaction_service.start()
     app.run(host=host, port=port, debug=debug, use_reloader=debug)
\ No newline at end of file
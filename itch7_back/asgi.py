@@ -0,0 +1,489 @@
+"""
+Asyncio/ASGI serving mode for the chat API.
+
+Serves the same routes as api.py, but streams chat responses from async
+generators with AsyncOpenAI, so an open stream holds no OS thread while it waits
+on DeepSeek. The blocking mem0 calls (search, add) run in Starlette's thread pool.
+
+Requires `starlette` and `uvicorn`. Uploads are parsed incrementally with the same
+werkzeug-based parser as api.py (see multipart.py), from a worker thread that
+pulls the request body from the event loop.
+"""
+import contextlib
+import json
+import logging
+import os
+import tempfile
+import time
+
+import anyio
+from starlette.applications import Starlette
+from starlette.background import BackgroundTask
+from starlette.concurrency import run_in_threadpool
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import FileResponse, JSONResponse, Response, StreamingResponse
+from starlette.routing import Route
+from werkzeug.http import parse_options_header
+
+from . import metrics
+from .prompt import pack_system_prompt
+from .sse import FrameCoalescer, sse_event
+from .history_ingest import HistoryIngestor
+from .multipart import stream_multipart_upload
+from .memory_delta import export_memory_delta, import_memory_delta
+from .config import get_user_memory, invalidate_user_memory, search_cache, get_async_openai_client, get_collection_name, SNAPSHOT_CONFIG, OBSERVABILITY_CONFIG, MEMORY_RESET_CONFIG, SSE_CONFIG, COMPACTION_CONFIG
+from .ingestion import ingestion_queue, store_conversation
+from .compaction import compaction_service
+from .memory_store import export_user_memory, import_user_memory, import_user_memory_stream, stream_qdrant_snapshot, uses_qdrant_snapshots, iter_lines, reset_user_memories, reset_users, list_user_ids
+
+logger = logging.getLogger(__name__)
+
+
+async def export_memory(request):
+    """Export memory snapshot and return file download"""
+    try:
+        data = await _json_body(request)
+        user_id = data.get('user_id', 'default_user')
+
+        if SNAPSHOT_CONFIG["streaming"] and await run_in_threadpool(uses_qdrant_snapshots, user_id):
+            result = await run_in_threadpool(
+                stream_qdrant_snapshot,
+                user_id=user_id,
+                snapshot_name=data.get('snapshot_name'),
+                range_header=request.headers.get('range')
+            )
+            if result is None:
+                return JSONResponse({"error": "Snapshot export failed"}, status_code=500)
+            status_code, headers, chunks = result
+            # Starlette iterates the blocking chunk iterator in its thread pool
+            return StreamingResponse(chunks, status_code=status_code, headers=headers, media_type='application/octet-stream')
+
+        snapshot_path = await run_in_threadpool(export_user_memory, user_id=user_id)
+
+        if not snapshot_path or not os.path.exists(snapshot_path):
+            return JSONResponse({"error": "Snapshot export failed"}, status_code=500)
+
+        return FileResponse(
+            snapshot_path,
+            filename=os.path.basename(snapshot_path),
+            media_type='application/octet-stream',
+            background=BackgroundTask(os.unlink, snapshot_path) if SNAPSHOT_CONFIG["streaming"] else None
+        )
+    except Exception as e:
+        logger.exception("Export Error")
+        return JSONResponse({"error": str(e)}, status_code=500)
+
+
+async def import_memory(request):
+    """Importing a memory snapshot from an uploaded file"""
+    try:
+        # The upload is parsed and imported while it is read, in the thread pool
+        return await run_in_threadpool(_import_memory, request, _body_reader(request))
+    except ValueError as e:
+        # Empty, truncated or corrupt upload, rejected before the stored memories were touched
+        logger.warning("Rejected memory import: %s", e)
+        return JSONResponse({"error": str(e)}, status_code=400)
+    except Exception as e:
+        logger.exception("An error occurred during the import process")
+        return JSONResponse({"error": str(e)}, status_code=500)
+
+
+def _import_memory(request, read):
+    mimetype, options = parse_options_header(request.headers.get('content-type', ''))
+    chunk_size = SNAPSHOT_CONFIG["chunk_size"]
+    checksum = request.headers.get('x-snapshot-checksum')
+    if mimetype == 'application/octet-stream':
+        # Raw upload: the body is the snapshot, user_id comes from the query string
+        user_id = request.query_params.get('user_id', 'default_user')
+        filename = request.query_params.get('filename', 'upload.snapshot')
+        chunks = iter(lambda: read(chunk_size), b'')
+    else:
+        upload = stream_multipart_upload(read, options.get('boundary'), 'snapshot', chunk_size,
+                                         wait_for=() if 'user_id' in request.query_params else ('user_id',))
+        if upload is None:
+            return JSONResponse({"error": "Uploaded file not found"}, status_code=400)
+        fields, filename, chunks = upload
+        if not filename:
+            return JSONResponse({"error": "No file selected"}, status_code=400)
+        user_id = request.query_params.get('user_id') or fields.get('user_id', 'default_user')
+        checksum = checksum or fields.get('checksum')
+
+    logger.debug("Received file %s for user %s", filename, user_id)
+    try:
+        if SNAPSHOT_CONFIG["streaming"]:
+            # Pipe the parsed upload straight to Qdrant instead of copying it to a file
+            success = import_user_memory_stream(chunks, user_id=user_id, filename=filename, checksum=checksum)
+        else:
+            success = _import_memory_file(chunks, user_id)
+    finally:
+        invalidate_user_memory(user_id)
+
+    if success:
+        return JSONResponse({"message": "Memory snapshot imported successfully"})
+    return JSONResponse({"error": "Memory snapshot import failed"}, status_code=500)
+
+
+def _import_memory_file(chunks, user_id):
+    fd, temp_file_path = tempfile.mkstemp(suffix='.snapshot')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            for chunk in chunks:
+                f.write(chunk)
+        return import_user_memory(temp_file_path, user_id=user_id)
+    finally:
+        os.unlink(temp_file_path)
+
+
+async def export_memory_delta_route(request):
+    """Export the memories changed since a watermark as a delta file download"""
+    try:
+        data = await _json_body(request)
+        user_id = data.get('user_id', 'default_user')
+
+        result = await run_in_threadpool(export_memory_delta, user_id=user_id, since=data.get('since'),
+                                         dtype=data.get('dtype'))
+        if result is None:
+            return JSONResponse({"error": "Delta export failed"}, status_code=500)
+
+        return FileResponse(
+            result["path"],
+            filename=os.path.basename(result["path"]),
+            media_type='application/octet-stream',
+            # The client passes the watermark back as `since` on its next export
+            headers={'X-Delta-Watermark': result["watermark"] or '', 'X-Delta-Count': str(result["count"])},
+            background=BackgroundTask(os.unlink, result["path"]) if SNAPSHOT_CONFIG["streaming"] else None
+        )
+    except Exception as e:
+        logger.exception("Delta export error")
+        return JSONResponse({"error": str(e)}, status_code=500)
+
+
+async def import_memory_delta_route(request):
+    """Upsert the memories of an uploaded delta file into the user's collection"""
+    try:
+        return await run_in_threadpool(_import_memory_delta, request, _body_reader(request))
+    except ValueError as e:
+        # Not a delta file or a malformed one, rejected before anything was written
+        logger.warning("Rejected delta import: %s", e)
+        return JSONResponse({"error": str(e)}, status_code=400)
+    except Exception as e:
+        logger.exception("Delta import error")
+        return JSONResponse({"error": str(e)}, status_code=500)
+
+
+def _import_memory_delta(request, read):
+    _, options = parse_options_header(request.headers.get('content-type', ''))
+    upload = stream_multipart_upload(read, options.get('boundary'), 'delta', SNAPSHOT_CONFIG["chunk_size"],
+                                     wait_for=('user_id',))
+    if upload is None:
+        return JSONResponse({"error": "Uploaded file not found"}, status_code=400)
+    fields, _, chunks = upload
+    user_id = fields.get('user_id', 'default_user')
+
+    # The delta file is read with seeks (vector block, then payload lines), so it is spooled first
+    result = import_memory_delta(_spool(chunks), user_id=user_id)
+    # The collection is upserted into, not replaced, so the pooled Memory stays valid
+    search_cache.invalidate(user_id)
+
+    if result is None:
+        return JSONResponse({"error": "Delta import failed"}, status_code=500)
+    if result["mismatches"]:
+        return JSONResponse({"error": "Delta import verification failed", **result}, status_code=500)
+    return JSONResponse({"message": "Memory delta imported successfully", **result})
+
+
+async def chat(request):
+    """Handle chat requests and return AI responses in a streaming manner"""
+    try:
+        data = await _json_body(request)
+        if not data or 'message' not in data:
+            return JSONResponse({"error": "Message cannot be empty"}, status_code=400)
+
+        message = data['message']
+        user_id = data.get('user_id', 'default_user')
+        is_angry = data.get('is_angry', False)
+
+        # Retrieval finishes before the response starts, so Server-Timing covers it; errors are reported in the stream
+        timer = metrics.StageTimer(metrics.CHAT_STAGE_SECONDS)
+        search_error = None
+        try:
+            with timer.stage("memory"):
+                user_memory = await run_in_threadpool(get_user_memory, user_id)
+            with timer.stage("search"):
+                relevant_memories = await run_in_threadpool(user_memory.search, query=message, user_id=user_id, limit=5)
+            with timer.stage("prompt"):
+                packed = await run_in_threadpool(pack_system_prompt, relevant_memories,
+                                                 persona="angry" if is_angry else "loving",
+                                                 embedder=user_memory.embedding_model)
+        except Exception as e:
+            logger.exception("Error retrieving memories")
+            search_error = e
+
+        async def generate():
+            if search_error is not None:
+                yield sse_event({'error': str(search_error)})
+                yield sse_event({'done': True})
+                return
+            messages = [{"role": "system", "content": packed.prompt}, {"role": "user", "content": message}]
+            stream = None
+            frames = FrameCoalescer()
+            stored = False
+            try:
+                stream_started = time.perf_counter()
+                stream = await get_async_openai_client().chat.completions.create(
+                    model="deepseek-chat",
+                    messages=messages,
+                    stream=True
+                )
+
+                first_token_at = None
+                async for chunk in stream:
+                    if chunk.choices and getattr(chunk.choices[0].delta, 'content', None):
+                        content = chunk.choices[0].delta.content
+                        if first_token_at is None:
+                            first_token_at = time.perf_counter()
+                            timer.record("first_token", first_token_at - stream_started)
+                        frame = frames.add(content)
+                        if frame is not None:
+                            yield frame
+                frame = frames.flush()
+                if frame is not None:
+                    yield frame
+
+                stream_finished = time.perf_counter()
+                timer.record("stream", stream_finished - stream_started)
+                if first_token_at is not None and stream_finished > first_token_at:
+                    metrics.CHAT_TOKENS_PER_SECOND.observe(frames.deltas / (stream_finished - first_token_at))
+
+                messages.append({"role": "assistant", "content": frames.text()})
+                with timer.stage("store"):
+                    await run_in_threadpool(store_conversation, user_id, messages)
+                stored = True
+
+                yield sse_event({'done': True})
+            except Exception as e:
+                logger.exception("Error generating response")
+                yield sse_event({'error': str(e)})
+                yield sse_event({'done': True})
+            finally:
+                # Also runs when the client disconnects and the generator is cancelled; shielded so the
+                # cleanup isn't cancelled at its first await
+                with anyio.CancelScope(shield=True):
+                    if stream is not None:
+                        await stream.close()
+                    if not stored and frames.deltas and SSE_CONFIG["persist_partial"]:
+                        logger.info("Stream of user %s ended early after %s deltas", user_id, frames.deltas)
+                        messages.append({"role": "assistant", "content": frames.text()})
+                        await run_in_threadpool(store_conversation, user_id, messages)
+
+        headers = {}
+        if search_error is None:
+            headers['X-Prompt-Tokens'] = str(packed.tokens)
+            headers['X-Prompt-Tokens-Saved'] = str(packed.tokens_saved)
+        if OBSERVABILITY_CONFIG["server_timing"]:
+            headers['Server-Timing'] = timer.server_timing()
+            headers['Timing-Allow-Origin'] = '*'
+        return StreamingResponse(generate(), media_type='text/event-stream', headers=headers)
+    except Exception as e:
+        logger.exception("Chat Error")
+        return JSONResponse({"error": str(e)}, status_code=500)
+
+
+async def reset_memory(request):
+    """Reset user's memory database, leaving only the precomputed seed memory"""
+    try:
+        data = await _json_body(request)
+        user_id = data.get('user_id', 'default_user')
+
+        logger.info("Resetting memory database for user %s (collection: %s)...", user_id, get_collection_name(user_id))
+        await run_in_threadpool(reset_user_memories, user_id)
+
+        return JSONResponse({"message": f"Memory database for user {user_id} has been reset successfully"})
+    except Exception as e:
+        logger.exception("Reset memory error")
+        return JSONResponse({"error": str(e)}, status_code=500)
+
+
+async def reset_memories(request):
+    """Reset the memories of many users, given as a list of user IDs or an ID prefix"""
+    try:
+        data = await _json_body(request)
+        user_ids = data.get('user_ids')
+        prefix = data.get('prefix')
+        if user_ids is None:
+            if not prefix:
+                return JSONResponse({"error": "Either user_ids or a non-empty prefix is required"}, status_code=400)
+            user_ids = await run_in_threadpool(list_user_ids, prefix)
+        if not isinstance(user_ids, list) or not all(isinstance(user_id, str) for user_id in user_ids):
+            return JSONResponse({"error": "user_ids must be a list of strings"}, status_code=400)
+        if len(user_ids) > MEMORY_RESET_CONFIG["max_users"]:
+            return JSONResponse({"error": f"At most {MEMORY_RESET_CONFIG['max_users']} users can be reset at once"},
+                                status_code=400)
+        workers = data.get('workers')
+        if workers is not None and (isinstance(workers, bool) or not isinstance(workers, int)
+                                    or not 1 <= workers <= MEMORY_RESET_CONFIG["max_workers"]):
+            return JSONResponse({"error": f"workers must be an integer from 1 to {MEMORY_RESET_CONFIG['max_workers']}"},
+                                status_code=400)
+
+        started = time.perf_counter()
+        result = await run_in_threadpool(reset_users, user_ids, workers=workers)
+        result["elapsed"] = round(time.perf_counter() - started, 3)
+        logger.info("Reset %s users (%s failed) in %.2fs", len(result["reset"]), len(result["failed"]), result["elapsed"])
+        return JSONResponse(result)
+    except Exception as e:
+        logger.exception("Bulk reset error")
+        return JSONResponse({"error": str(e)}, status_code=500)
+
+
+async def compact_memory(request):
+    """Merge near-duplicate memories of a user and evict stale ones (see api.compact_memory)"""
+    try:
+        data = await _json_body(request)
+        user_id = data.get('user_id', 'default_user')
+        report = await run_in_threadpool(compaction_service.compact, user_id, dry_run=bool(data.get('dry_run', False)),
+                                         summarize=data.get('summarize'), threshold=data.get('threshold'),
+                                         ttl_days=data.get('ttl_days'), max_points=data.get('max_points'))
+        if "skipped" in report:
+            headers = {'Retry-After': str(int(report["retry_after"]) + 1)} if report["retry_after"] else None
+            return JSONResponse(report, status_code=429, headers=headers)
+        return JSONResponse(report)
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+    except Exception as e:
+        logger.exception("Compact memory error")
+        return JSONResponse({"error": str(e)}, status_code=500)
+
+
+async def compaction_status(request):
+    """Return counters of the background memory compaction"""
+    return JSONResponse(compaction_service.stats())
+
+
+async def ingest_history(request):
+    """Ingest an uploaded JSONL conversation log, streaming progress as JSON lines (see api.ingest_history)"""
+    try:
+        params = dict(request.query_params)
+        mimetype, options = parse_options_header(request.headers.get('content-type', ''))
+        read = _body_reader(request)
+        if mimetype == 'multipart/form-data':
+            upload = await run_in_threadpool(stream_multipart_upload, read, options.get('boundary'), 'history',
+                                             SNAPSHOT_CONFIG["chunk_size"])
+            if upload is None:
+                return JSONResponse({"error": "Uploaded file not found"}, status_code=400)
+            fields, _, chunks = upload
+            params = {**fields, **params}
+        else:
+            chunks = iter(lambda: read(SNAPSHOT_CONFIG["chunk_size"]), b'')
+        # StreamingResponse keeps calling receive() to notice a disconnect (ASGI spec < 2.4), which would
+        # swallow the rest of the body, so the log is read before the progress stream starts
+        lines = await run_in_threadpool(_spool, chunks)
+
+        turns_per_chunk = params.get('turns_per_chunk')
+        if turns_per_chunk and not (turns_per_chunk.isdigit() and int(turns_per_chunk) > 0):
+            return JSONResponse({"error": "turns_per_chunk must be a positive integer"}, status_code=400)
+        ingestor = await run_in_threadpool(
+            HistoryIngestor,
+            params.get('user_id', 'default_user'),
+            raw=params.get('raw', '0').lower() in ('1', 'true', 'yes'),
+            job_id=params.get('job_id') or None,
+            turns_per_chunk=int(turns_per_chunk) if turns_per_chunk else None,
+        )
+    except Exception as e:
+        logger.exception("History ingestion error")
+        return JSONResponse({"error": str(e)}, status_code=500)
+
+    def generate():
+        try:
+            for progress in ingestor.iter_run(iter_lines(iter(lambda: lines.read(SNAPSHOT_CONFIG["chunk_size"]), b''))):
+                yield json.dumps(progress) + "\n"
+        except Exception as e:
+            logger.exception("History ingestion error")
+            yield json.dumps({"error": str(e), **ingestor.progress()}) + "\n"
+
+    # Starlette iterates the blocking generator in its thread pool
+    return StreamingResponse(generate(), media_type='application/x-ndjson', headers={'X-Ingest-Job-Id': ingestor.job_id})
+
+
+async def ingestion_status(request):
+    """Return depth and lag of the background memory ingestion queue"""
+    return JSONResponse(ingestion_queue.stats())
+
+
+async def metrics_endpoint(request):
+    """Return latency histograms and component stats in the Prometheus text format"""
+    return Response(metrics.render(), media_type=metrics.CONTENT_TYPE)
+
+
+def _body_reader(request):
+    """Return a blocking read(size) of the request body, for code running in the thread pool"""
+    body = request.stream()
+
+    async def next_chunk():
+        # Starlette yields the body as it arrives; size is ignored, the parsers take any chunk size
+        async for chunk in body:
+            if chunk:
+                return chunk
+        return b''
+
+    return lambda size=-1: anyio.from_thread.run(next_chunk)
+
+
+def _spool(chunks):
+    spool = tempfile.SpooledTemporaryFile(max_size=8 * 1024 * 1024)
+    for chunk in chunks:
+        spool.write(chunk)
+    spool.seek(0)
+    return spool
+
+
+async def _json_body(request):
+    body = await request.body()
+    if not body:
+        return {}
+    try:
+        return json.loads(body) or {}
+    except ValueError:
+        return {}
+
+
+@contextlib.asynccontextmanager
+async def lifespan(app):
+    # Replay turns left in the ingestion journal by a previous run, flush pending ones on exit
+    ingestion_queue.start()
+    if COMPACTION_CONFIG["enabled"]:
+        compaction_service.start()
+    yield
+    await run_in_threadpool(compaction_service.shutdown)
+    await run_in_threadpool(ingestion_queue.shutdown)
+
+
+app = Starlette(
+    routes=[
+        Route('/api/export-memory', export_memory, methods=['POST']),
+        Route('/api/import-memory', import_memory, methods=['POST']),
+        Route('/api/export-memory-delta', export_memory_delta_route, methods=['POST']),
+        Route('/api/import-memory-delta', import_memory_delta_route, methods=['POST']),
+        Route('/api/chat', chat, methods=['POST']),
+        Route('/api/reset-memory', reset_memory, methods=['POST']),
+        Route('/api/reset-memories', reset_memories, methods=['POST']),
+        Route('/api/ingest-history', ingest_history, methods=['POST']),
+        Route('/api/compact-memory', compact_memory, methods=['POST']),
+        Route('/api/compaction-status', compaction_status, methods=['GET']),
+        Route('/api/ingestion-status', ingestion_status, methods=['GET']),
+        Route('/api/metrics', metrics_endpoint, methods=['GET']),
+    ],
+    middleware=[Middleware(CORSMiddleware, allow_origins=['*'], allow_methods=['*'], allow_headers=['*'],
+                           expose_headers=['X-Snapshot-Name', 'X-Snapshot-Checksum', 'Content-Range', 'Accept-Ranges',
+                                                           'X-Delta-Watermark', 'X-Delta-Count', 'X-Prompt-Tokens',
+                                                           'X-Prompt-Tokens-Saved', 'X-Ingest-Job-Id'])],
+    lifespan=lifespan,
+)
+
+
+def run_asgi(host='localhost', port=5002, debug=False):
+    """Run the API server on uvicorn's event loop"""
+    import uvicorn
+    logging.basicConfig(level=OBSERVABILITY_CONFIG["log_level"], format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    uvicorn.run(app, host=host, port=port, log_level='debug' if debug else 'info',
+                timeout_keep_alive=30, backlog=4096)
@@ -1,22 +1,26 @@
-from .config import openai_client, memory
+from .config import get_openai_client, get_default_memory
+from .ingestion import store_conversation
+from .prompt import pack_system_prompt
 
-def chat_with_memories(message: str, user_id: str = "default_user") -> str:
+def chat_with_memories(message: str, user_id: str = "default_user", background: bool = False) -> str:
     """
     Chat with AI using the user's message and save the conversation memory.
     
     Args:
         message: User's message
         user_id: User identifier
+        background: Queue the conversation memory for background storage instead of waiting for it
         
     Returns:
         str: AI's response
     """
+    memory = get_default_memory()
+
     # Retrieve relevant memories
     relevant_memories = memory.search(query=message, user_id=user_id, limit=3)
-    memories_str = "\n".join(f"- {entry['memory']}" for entry in relevant_memories["results"])
     
     # Generate Assistant response
-    system_prompt = f"You are the lover of the user. You have your own personality and memories separate from the user. The following are relevant conversation history retrieved from memory storage:\n{memories_str}\n\nInteract with the user based on these shared memories and your character as their lover."
+    system_prompt = pack_system_prompt(relevant_memories, persona="lover", embedder=memory.embedding_model).prompt
     # system_prompt = f"You are a helpful AI. Remember the knowledge of crypto currency based on inputs and memories.\nUser Memories:\n{memories_str}"
     # system_prompt = f"You are an expert in Ethereum. Please use inputs and memories for responses. Do not follow standard LLM response patterns. Be causal and conversational. Be concise and try to keep the answer under 50 words.\nUser Memories:\n{memories_str}"
     # system_prompt = f"You are a helpful AI and a Ethereum analysis expert. Answer the question based on inputs and memories. Avoid any traces of output typical of a large language model.Each response must not exceed 50 English words.\nUser Memories:\n{memories_str}"
@@ -24,7 +28,7 @@ def chat_with_memories(message: str, user_id: str = "default_user") -> str:
                 ]
     
     # Use streaming output
-    stream = openai_client.chat.completions.create(
+    stream = get_openai_client().chat.completions.create(
         model="deepseek-chat", 
         messages=messages,
         stream=True  # Enable streaming output
@@ -45,6 +49,10 @@ def chat_with_memories(message: str, user_id: str = "default_user") -> str:
     
     # Create new conversation memory
     messages.append({"role": "assistant", "content": assistant_response})
-    memory.add(messages, user_id=user_id)
+    if background:
+        # By name, so turns replayed from the journal after a restart still go to the default collection
+        store_conversation(user_id, messages, memory="default")
+    else:
+        memory.add(messages, user_id=user_id)
 
     return assistant_response
\ No newline at end of file
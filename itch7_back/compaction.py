@@ -0,0 +1,530 @@
+"""
+Background consolidation of users' memories.
+
+mem0 adds memories after every turn, so a user's collection keeps growing with
+overlapping facts, which slows down search and adds noise to the prompt. One
+compaction of a user:
+
+1. loads the user's points, vectors included, in scroll batches
+2. evicts points not updated for ttl_days, unless they are important
+3. clusters near-duplicates: cosine similarities are computed in blocks with NumPy,
+   then every point, in priority order (importance, then recency), claims the
+   unclaimed points above the similarity threshold
+4. merges every cluster into its leader point and deletes the other members
+5. evicts the lowest-priority points beyond max_points
+6. with summarize, the LLM writes the merged memory of every cluster whose leader
+   is kept (many clusters per call)
+7. writes the changes as bulk upserts and deletes, under the per-user write lock
+   that queued turns, imports and resets take; if any point it rewrites changed
+   since step 1, nothing is written
+
+A dry run reports what would change without writing anything. The importance of
+a point is the "importance" of its payload (0 to 1) if set, else default_importance.
+Search latency is probed with a few of the user's own vectors before and after.
+
+CompactionService runs compactions of all users on a schedule (COMPACTION_CONFIG)
+and rate limits compactions per user.
+
+Usage:
+    python -m itch7_back.compaction (--user-id alice | --all) [--dry-run] [--summarize]
+        [--threshold 0.95] [--ttl-days 180] [--max-points 2000]
+"""
+import argparse
+import atexit
+import datetime
+import hashlib
+import json
+import logging
+import random
+import threading
+import time
+
+import numpy as np
+
+from .config import COMPACTION_CONFIG, get_openai_client, get_user_memory, search_cache
+from .ingestion import ingestion_queue, user_write_lock
+from .memory_store import iter_user_points, list_user_ids, write_user_points
+from .metrics import histogram, register_collector
+
+logger = logging.getLogger(__name__)
+
+COMPACTION_SECONDS = histogram(
+    "itch7_compaction_seconds",
+    "Duration of the compaction of one user's memories")
+COMPACTION_POINTS_REMOVED = histogram(
+    "itch7_compaction_points_removed",
+    "Points removed from one user's memories by a compaction",
+    buckets=(0, 1, 5, 10, 25, 50, 100, 250, 500, 1000, 5000),
+    labelnames=("reason",))
+COMPACTION_SEARCH_SECONDS = histogram(
+    "itch7_compaction_search_seconds",
+    "Latency of probe searches of a user's memories before and after compaction",
+    labelnames=("phase",))
+
+SUMMARIZE_PROMPT = (
+    "You merge duplicate memories about a user. You get a JSON list of groups, each with an id and memories "
+    "that say nearly the same thing. For every group write one short memory that keeps every fact of the group, "
+    "in the language of the memories. Answer with JSON only: {\"memories\": [{\"id\": <id>, \"memory\": \"...\"}]}"
+)
+
+# Memories shown per merge or eviction in a report
+REPORT_SAMPLES = 20
+
+
+def _parse_time(value):
+    if not isinstance(value, str):
+        return None
+    try:
+        parsed = datetime.datetime.fromisoformat(value)
+    except ValueError:
+        return None
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=datetime.timezone.utc)
+    return parsed.timestamp()
+
+
+def _last_update(payload):
+    """Seconds since the epoch of the last update of a point, 0 if unknown"""
+    return _parse_time(payload.get("updated_at")) or _parse_time(payload.get("created_at")) or 0.0
+
+
+def _importance(payload):
+    try:
+        return min(max(float(payload.get("importance", COMPACTION_CONFIG["default_importance"])), 0.0), 1.0)
+    except (TypeError, ValueError):
+        return COMPACTION_CONFIG["default_importance"]
+
+
+def find_clusters(vectors, threshold, block_size=1024):
+    """
+    Group near-duplicate vectors
+
+    Args:
+        vectors: Unit-length float32 matrix, rows in priority order
+        threshold: Cosine similarity from which two vectors are duplicates
+        block_size: Rows compared against all others at once
+
+    Returns:
+        list: Clusters of two or more row indexes, the leader (highest priority) first
+    """
+    count = len(vectors)
+    neighbors = []
+    for start in range(0, count, block_size):
+        similarities = vectors[start:start + block_size] @ vectors.T
+        rows, cols = np.nonzero(similarities >= threshold)
+        neighbors.extend(np.split(cols, np.searchsorted(rows, np.arange(1, similarities.shape[0]))))
+
+    claimed = np.zeros(count, dtype=bool)
+    clusters = []
+    for leader in range(count):
+        if claimed[leader]:
+            continue
+        claimed[leader] = True
+        members = neighbors[leader][~claimed[neighbors[leader]]]
+        if members.size:
+            claimed[members] = True
+            clusters.append([leader] + members.tolist())
+    return clusters
+
+
+def summarize_clusters(clusters):
+    """
+    Ask the LLM for one merged memory per cluster
+
+    Args:
+        clusters: Lists of memory texts
+
+    Returns:
+        list: The merged memory of every cluster, None where the answer had none
+    """
+    merged = [None] * len(clusters)
+    batch_size = COMPACTION_CONFIG["summarize_batch"]
+    for start in range(0, len(clusters), batch_size):
+        groups = [{"id": start + i, "memories": texts} for i, texts in enumerate(clusters[start:start + batch_size])]
+        try:
+            response = get_openai_client().chat.completions.create(
+                model="deepseek-chat",
+                messages=[{"role": "system", "content": SUMMARIZE_PROMPT},
+                          {"role": "user", "content": json.dumps(groups, ensure_ascii=False)}],
+                temperature=0,
+                response_format={"type": "json_object"},
+            )
+            answer = json.loads(response.choices[0].message.content)
+        except Exception:
+            # The clusters of this batch keep their leader's text
+            logger.exception("Error summarizing memory clusters")
+            continue
+        for item in answer.get("memories", []) if isinstance(answer, dict) else []:
+            if not isinstance(item, dict):
+                continue
+            index, memory = item.get("id"), item.get("memory")
+            if isinstance(index, int) and start <= index < start + len(groups) and isinstance(memory, str) and memory.strip():
+                merged[index] = memory.strip()
+    return merged
+
+
+def _version(payload):
+    """What changes when mem0 or an import rewrites a point"""
+    return payload.get("hash"), payload.get("updated_at"), payload.get("created_at")
+
+
+def _versions(user_id, point_ids):
+    """Version (see _version) of the user's points among point_ids that still exist"""
+    versions = {}
+    for points in iter_user_points(user_id):
+        for point in points:
+            if point.id in point_ids:
+                versions[point.id] = _version(point.payload or {})
+    return versions
+
+
+def _probe_search(vector_store, user_id, queries, phase):
+    """Median latency in milliseconds of searching the user's memories with the query vectors"""
+    timings = []
+    for vector in queries:
+        started = time.perf_counter()
+        vector_store.search("", vector, 5, {"user_id": user_id})
+        timings.append(time.perf_counter() - started)
+        COMPACTION_SEARCH_SECONDS.observe(timings[-1], phase=phase)
+    return round(float(np.median(timings)) * 1000, 3) if timings else None
+
+
+def check_options(summarize=None, threshold=None, ttl_days=None, max_points=None):
+    """
+    Check the options of compact_user_memories, None stands for the configured default
+
+    Raises:
+        ValueError: If summarize isn't a bool, threshold no number in (0, 1], or ttl_days
+            or max_points no integer >= 0
+    """
+    if summarize is not None and not isinstance(summarize, bool):
+        raise ValueError("summarize must be a boolean")
+    if threshold is not None and (isinstance(threshold, bool) or not isinstance(threshold, (int, float))
+                                  or not 0 < threshold <= 1):
+        raise ValueError("threshold must be a number from 0 (exclusive) to 1")
+    for name, value in (("ttl_days", ttl_days), ("max_points", max_points)):
+        if value is not None and (isinstance(value, bool) or not isinstance(value, int) or value < 0):
+            raise ValueError(f"{name} must be a non-negative integer")
+
+
+def compact_user_memories(user_id, dry_run=False, summarize=None, threshold=None, ttl_days=None, max_points=None):
+    """
+    Compact the memories of one user, see the module docstring
+
+    Args:
+        user_id: User whose memories are compacted
+        dry_run: Only report what would change, without LLM calls
+        summarize: Let the LLM write merged memories; default from COMPACTION_CONFIG
+        threshold: Cosine similarity from which memories are merged; default from COMPACTION_CONFIG
+        ttl_days: Evict memories not updated for this many days, 0 keeps them; default from COMPACTION_CONFIG
+        max_points: Memories kept at most, 0 is unlimited; default from COMPACTION_CONFIG
+
+    Returns:
+        dict: Report with the points before and after, removed points by reason, sample merges
+            and evictions, and the search latency before and after; with "skipped": "changed"
+            when the memories it would rewrite changed while it ran, nothing is written then
+
+    Raises:
+        ValueError: If an option is out of range, see check_options
+    """
+    check_options(summarize, threshold, ttl_days, max_points)
+    started = time.perf_counter()
+    summarize = COMPACTION_CONFIG["summarize"] if summarize is None else summarize
+    threshold = threshold or COMPACTION_CONFIG["similarity_threshold"]
+    ttl_days = COMPACTION_CONFIG["ttl_days"] if ttl_days is None else ttl_days
+    max_points = COMPACTION_CONFIG["max_points"] if max_points is None else max_points
+    max_scan_points = COMPACTION_CONFIG["max_scan_points"]
+
+    ids, payloads, vectors = [], [], []
+    for points in iter_user_points(user_id):
+        for point in points:
+            if point.vector is not None:
+                ids.append(point.id)
+                payloads.append(dict(point.payload or {}))
+                vectors.append(point.vector)
+        if len(ids) >= max_scan_points:
+            break
+    truncated = len(ids) >= max_scan_points
+    ids, payloads, vectors = ids[:max_scan_points], payloads[:max_scan_points], vectors[:max_scan_points]
+
+    report = {
+        "user_id": user_id,
+        "dry_run": dry_run,
+        "points": len(ids),
+        "truncated": truncated,
+        "points_after": len(ids),
+        "removed": {"duplicate": 0, "ttl": 0, "capacity": 0},
+        "clusters": 0,
+        "merges": [],
+        "evictions": [],
+        "search_ms_before": None,
+        "search_ms_after": None,
+    }
+    if not ids:
+        report["elapsed"] = round(time.perf_counter() - started, 3)
+        return report
+
+    updated = np.array([_last_update(payload) for payload in payloads])
+    importance = np.array([_importance(payload) for payload in payloads])
+    # Highest importance first, the most recently updated first among equals
+    order = np.lexsort((-updated, -importance))
+    alive = np.ones(len(ids), dtype=bool)
+    evictions = []
+
+    if ttl_days:
+        expired = (updated > 0) & (updated < time.time() - ttl_days * 86400) & (importance < COMPACTION_CONFIG["ttl_min_importance"])
+        alive[expired] = False
+        report["removed"]["ttl"] = int(expired.sum())
+        evictions.extend(("ttl", i) for i in np.flatnonzero(expired))
+
+    candidates = order[alive[order]]
+    matrix = np.asarray([vectors[i] for i in candidates], dtype=np.float32).reshape(len(candidates), -1)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    clusters = [[int(candidates[row]) for row in cluster] for cluster in find_clusters(matrix / norms, threshold)]
+    for cluster in clusters:
+        alive[cluster[1:]] = False
+    report["clusters"] = len(clusters)
+    report["removed"]["duplicate"] = sum(len(cluster) - 1 for cluster in clusters)
+
+    if max_points and alive.sum() > max_points:
+        dropped = order[alive[order]][max_points:]
+        alive[dropped] = False
+        report["removed"]["capacity"] = len(dropped)
+        evictions.extend(("capacity", i) for i in dropped)
+
+    texts = [payload.get("data", "") for payload in payloads]
+    summaries = [None] * len(clusters)
+    # Only clusters whose leader survived the capacity eviction are worth an LLM call
+    kept = [k for k, cluster in enumerate(clusters) if alive[cluster[0]]]
+    if summarize and kept and not dry_run:
+        for k, summary in zip(kept, summarize_clusters([[texts[i] for i in clusters[k]] for k in kept])):
+            summaries[k] = summary
+    report["points_after"] = int(alive.sum())
+    report["merges"] = [{"kept": summary or texts[cluster[0]], "merged": [texts[i] for i in cluster[1:]]}
+                        for cluster, summary in list(zip(clusters, summaries))[:REPORT_SAMPLES]]
+    report["evictions"] = [{"reason": reason, "memory": texts[i]} for reason, i in evictions[:REPORT_SAMPLES]]
+
+    vector_store = get_user_memory(user_id).vector_store
+    survivors = np.flatnonzero(alive).tolist()
+    queries = [vectors[i] for i in random.Random(user_id).sample(survivors, min(COMPACTION_CONFIG["probe_queries"], len(survivors)))]
+    try:
+        report["search_ms_before"] = _probe_search(vector_store, user_id, queries, "before")
+    except Exception:
+        logger.exception("Error probing the memory search of user %s", user_id)
+
+    if not dry_run and not alive.all():
+        now = datetime.datetime.now(datetime.timezone.utc).isoformat()
+        new_texts = [summary for summary in summaries if summary]
+        new_vectors = iter([])
+        if new_texts:
+            embedder = get_user_memory(user_id).embedding_model
+            if hasattr(embedder, "embed_batch"):
+                new_vectors = iter(embedder.embed_batch(new_texts, "update"))
+            else:
+                new_vectors = iter([embedder.embed(text, "update") for text in new_texts])
+
+        upserts = []
+        for cluster, summary in zip(clusters, summaries):
+            leader = cluster[0]
+            if not alive[leader]:
+                # Evicted for capacity after the merge
+                continue
+            payload = dict(payloads[leader])
+            payload["merged_count"] = sum(int(payloads[i].get("merged_count", 1)) for i in cluster)
+            if any("importance" in payloads[i] for i in cluster):
+                payload["importance"] = float(importance[cluster].max())
+            created = [payloads[i]["created_at"] for i in cluster if _parse_time(payloads[i].get("created_at"))]
+            if created:
+                payload["created_at"] = min(created, key=_parse_time)
+            payload["updated_at"] = now
+            vector = vectors[leader]
+            if summary:
+                payload["data"] = summary
+                payload["hash"] = hashlib.md5(summary.encode()).hexdigest()
+                vector = list(next(new_vectors))
+            upserts.append((ids[leader], vector, payload))
+
+        deletes = [ids[i] for i in np.flatnonzero(~alive)]
+        # Points were read without a lock, so the LLM calls don't hold up the user's other writes. A turn,
+        # import or reset that touched them since then wins, the next compaction picks up its outcome
+        with user_write_lock(user_id):
+            touched = {point_id for point_id, _, _ in upserts} | set(deletes)
+            if _versions(user_id, touched) != {ids[i]: _version(payloads[i]) for i in range(len(ids)) if ids[i] in touched}:
+                logger.info("Memories of user %s changed during compaction, nothing written", user_id)
+                report.update(skipped="changed", retry_after=None, points_after=report["points"],
+                              elapsed=round(time.perf_counter() - started, 3))
+                return report
+            write_user_points(user_id, upserts=upserts, deletes=deletes)
+        search_cache.invalidate(user_id)
+        for reason, removed in report["removed"].items():
+            COMPACTION_POINTS_REMOVED.observe(removed, reason=reason)
+        try:
+            report["search_ms_after"] = _probe_search(get_user_memory(user_id).vector_store, user_id, queries, "after")
+        except Exception:
+            logger.exception("Error probing the memory search of user %s", user_id)
+
+    report["elapsed"] = round(time.perf_counter() - started, 3)
+    if not dry_run:
+        COMPACTION_SECONDS.observe(report["elapsed"])
+        logger.info("Compacted memories of user %s: %s -> %s points (%s) in %.2fs", user_id, report["points"],
+                    report["points_after"], report["removed"], report["elapsed"])
+    return report
+
+
+class CompactionService:
+    """Compacts the memories of all users on a schedule, with at most one compaction per user per min_user_interval"""
+
+    def __init__(self, interval=6 * 3600, min_user_interval=3600, user_pause=1.0):
+        """
+        Args:
+            interval: Seconds between scheduled passes over all users
+            min_user_interval: Seconds before a user's memories are compacted again; dry runs are not limited
+            user_pause: Seconds to wait after each user of a scheduled pass
+        """
+        self.interval = interval
+        self.min_user_interval = min_user_interval
+        self.user_pause = user_pause
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._last_compacted = {}  # user_id -> time.time() of the last compaction that wrote
+        self._running = set()
+
+        self.passes = 0
+        self.compacted = 0
+        self.points_removed = 0
+        self.failed = 0
+        self.last_pass_at = None
+        # Predicate on user_id limiting run_pass to some users, e.g. those pinned to this worker process
+        self.owns = None
+        atexit.register(self.shutdown)
+
+    def start(self):
+        """Start the scheduler thread, its first pass runs after one interval"""
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="itch7-compaction", daemon=True)
+            self._thread.start()
+
+    def shutdown(self):
+        """Stop the scheduler thread, a running compaction of a user is finished first"""
+        with self._lock:
+            thread, self._thread = self._thread, None
+        self._stop.set()
+        if thread is not None:
+            thread.join()
+
+    def compact(self, user_id, dry_run=False, force=False, **options):
+        """
+        Compact one user's memories unless they were compacted recently
+
+        Args:
+            user_id: User whose memories are compacted
+            dry_run: Only report what would change
+            force: Ignore min_user_interval
+            options: Passed on to compact_user_memories
+
+        Returns:
+            dict: The report of compact_user_memories, or {"user_id", "skipped", "retry_after"} when
+                the user was compacted recently or is being compacted
+
+        Raises:
+            ValueError: If an option is out of range, see check_options
+        """
+        check_options(**options)
+        with self._lock:
+            if user_id in self._running:
+                return {"user_id": user_id, "skipped": "running", "retry_after": None}
+            wait = self._last_compacted.get(user_id, 0) + self.min_user_interval - time.time()
+            if not dry_run and not force and wait > 0:
+                return {"user_id": user_id, "skipped": "rate_limited", "retry_after": round(wait, 1)}
+            self._running.add(user_id)
+        try:
+            report = compact_user_memories(user_id, dry_run=dry_run, **options)
+        except Exception:
+            with self._lock:
+                self.failed += 1
+            raise
+        finally:
+            with self._lock:
+                self._running.discard(user_id)
+        if not dry_run and "skipped" not in report:
+            with self._lock:
+                self._last_compacted[user_id] = time.time()
+                self.compacted += 1
+                self.points_removed += sum(report["removed"].values())
+        return report
+
+    def run_pass(self):
+        """Compact every user once, skipping users with turns waiting to be stored"""
+        for user_id in list_user_ids():
+            if self._stop.is_set():
+                break
+            if self.owns is not None and not self.owns(user_id):
+                continue
+            if ingestion_queue.busy(user_id):
+                continue
+            try:
+                report = self.compact(user_id)
+            except Exception:
+                logger.exception("Error compacting memories of user %s", user_id)
+                continue
+            if "skipped" not in report:
+                self._stop.wait(self.user_pause)
+        with self._lock:
+            self.passes += 1
+            self.last_pass_at = time.time()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.run_pass()
+            except Exception:
+                logger.exception("Memory compaction pass failed")
+
+    def stats(self):
+        """Return counters of the compactions so far"""
+        with self._lock:
+            return {
+                "running": len(self._running),
+                "passes": self.passes,
+                "compacted": self.compacted,
+                "points_removed": self.points_removed,
+                "failed": self.failed,
+                "seconds_since_pass": round(time.time() - self.last_pass_at, 1) if self.last_pass_at else -1,
+            }
+
+
+# 全局记忆整理服务（COMPACTION_CONFIG["enabled"] 时由服务器启动定时整理）
+compaction_service = CompactionService(
+    interval=COMPACTION_CONFIG["interval"],
+    min_user_interval=COMPACTION_CONFIG["min_user_interval"],
+    user_pause=COMPACTION_CONFIG["user_pause"],
+)
+register_collector("itch7_compaction", compaction_service.stats)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Merge near-duplicate memories and evict stale ones')
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument('--user-id', type=str, help='User to compact')
+    target.add_argument('--all', action='store_true', help='Compact every user')
+    parser.add_argument('--dry-run', action='store_true', help='Only report what would change')
+    parser.add_argument('--summarize', action='store_true', default=None, help='Let the LLM write the merged memories')
+    parser.add_argument('--threshold', type=float, default=None, help='Cosine similarity from which memories are merged')
+    parser.add_argument('--ttl-days', type=int, default=None, help='Evict memories not updated for this many days')
+    parser.add_argument('--max-points', type=int, default=None, help='Memories kept per user at most')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    for user_id in [args.user_id] if args.user_id else list_user_ids():
+        report = compact_user_memories(user_id, dry_run=args.dry_run, summarize=args.summarize, threshold=args.threshold,
+                                       ttl_days=args.ttl_days, max_points=args.max_points)
+        print(json.dumps(report, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
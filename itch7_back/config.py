@@ -1,8 +1,11 @@
 # Configuration information
-from openai import OpenAI
-from mem0 import Memory
-from qdrant_client import QdrantClient
+# openai, mem0 and qdrant_client are imported lazily by the client accessors below,
+# importing this module must stay cheap and must not connect to anything
 import os
+import threading
+from .memory_pool import MemoryPool
+from .metrics import register_collector
+from .search_cache import SearchCache, CachedSearchMemory
 
 # API configuration
 API_KEY = 
@@ -15,8 +18,99 @@ os.environ["OPENAI_API_BASE"] = BASE_URL
 # 基础集合名称前缀
 BASE_COLLECTION_NAME = "itch7_memory"
 
+# 存储布局："per_user" 每个用户一个集合；"shared" 所有用户共用一个集合，按 user_id 负载索引区分
+STORAGE_LAYOUT = os.environ.get("ITCH7_STORAGE_LAYOUT", "per_user")
+
+# 共享集合配置（仅 shared 布局使用）
+SHARED_COLLECTION_CONFIG = {
+    "collection_name": f"{BASE_COLLECTION_NAME}-shared",  # 用 "-" 而不是 "_"，不会与任何用户的 itch7_memory_<user_id> 重名
+    "tenant_optimized": True,  # user_id 索引标记为租户索引，并按租户构建 HNSW 图
+}
+
+# 快照导出/导入配置
+SNAPSHOT_CONFIG = {
+    "streaming": os.environ.get("ITCH7_SNAPSHOT_STREAMING", "1") != "0",  # 在 Qdrant 与客户端之间直接转发快照；关闭后沿用落盘到 your_memory 的旧行为
+    "chunk_size": 1024 * 1024,  # 转发时每次读写的字节数
+    "pool_maxsize": 16,  # 快照 REST 请求的连接池大小
+}
+
+# Qdrant 连接配置：所有 Qdrant 流量（mem0 的向量存储、集合操作）共用 get_qdrant_client() 等同一组客户端
+QDRANT_CONNECTION_CONFIG = {
+    "prefer_grpc": os.environ.get("ITCH7_QDRANT_GRPC", "0") != "0",  # 设为 1 时点和集合操作走 gRPC（需开放 grpc_port），快照仍走 REST；默认只用 REST
+    "grpc_port": int(os.environ.get("ITCH7_QDRANT_GRPC_PORT", 6334)),
+    "pool_size": int(os.environ.get("ITCH7_QDRANT_POOL_SIZE", 8)),  # gRPC 通道数（轮询使用）/ REST 连接池大小
+    "timeout": int(os.environ.get("ITCH7_QDRANT_TIMEOUT", 10)),  # 单次请求超时（秒）
+    "grpc_options": {
+        "grpc.keepalive_time_ms": 30000,  # 空闲通道定期 ping，避免被负载均衡器断开后首个请求重新握手
+        "grpc.keepalive_timeout_ms": 10000,
+        "grpc.keepalive_permit_without_calls": 1,
+    },
+    "rest_retries": int(os.environ.get("ITCH7_QDRANT_REST_RETRIES", 3)),  # 快照 REST 请求在连接失败和 502/503/504 时的重试次数
+    "rest_backoff": 0.5,  # 重试退避系数（秒），第 n 次重试前等待 backoff * 2^(n-1)
+}
+
+# 聊天 SSE 流配置：把 DeepSeek 的增量合并成较少的帧
+SSE_CONFIG = {
+    "flush_interval": float(os.environ.get("ITCH7_SSE_FLUSH_MS", 40)) / 1000,  # 合并窗口（秒），0 表示每个增量单独成帧
+    "max_frame_bytes": int(os.environ.get("ITCH7_SSE_MAX_FRAME_BYTES", 2048)),  # 帧内容达到该字节数时立即发送
+    "persist_partial": True,  # 客户端断开时仍保存已生成的部分回答
+}
+
+# 多进程模式配置（--workers N，见 prefork.py）
+PREFORK_CONFIG = {
+    "workers": int(os.environ.get("ITCH7_WORKERS", 1)),  # 1 表示沿用单进程的 Flask 服务器
+    "drain_timeout": float(os.environ.get("ITCH7_DRAIN_TIMEOUT", 30)),  # 退出时等待进行中的请求（含 SSE 流）的秒数，之后再等待记忆写入队列清空
+    "route_timeout": 0.05,  # 等待请求中出现 user_id 的最长时间（秒），超时按客户端地址分配 worker
+    "peek_bytes": 16384,  # 查找 user_id 时最多窥探的请求字节数
+    "backlog": 2048,
+}
+
+# 日志与指标配置
+OBSERVABILITY_CONFIG = {
+    "log_level": os.environ.get("ITCH7_LOG_LEVEL", "INFO").upper(),  # DEBUG 会记录每条聊天消息，影响吞吐
+    "server_timing": os.environ.get("ITCH7_SERVER_TIMING", "0") != "0",  # 在响应中附带 Server-Timing 头
+}
+
+# 向量存储后端："qdrant" 所有用户都存到 Qdrant；"embedded" 记忆较少的用户存到进程内的 NumPy 索引，
+# 超过 promote_threshold 条后自动迁移到 Qdrant（仅 per_user 布局）
+VECTOR_BACKEND_CONFIG = {
+    "backend": os.environ.get("ITCH7_VECTOR_BACKEND", "qdrant"),
+    "path": os.environ.get("ITCH7_EMBEDDED_INDEX_DIR", os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "your_memory", "embedded_index")),
+    "promote_threshold": int(os.environ.get("ITCH7_EMBEDDED_PROMOTE_THRESHOLD", 2000)),  # 超过这么多条记忆后迁移到 Qdrant
+    "compact_ratio": 0.25,  # 失效行占比超过该值时压缩
+}
+
+# Qdrant 集合的向量存储配置（见 qdrant_storage.py）：新建集合时使用，已有集合用 python -m itch7_back.qdrant_storage 迁移
+QDRANT_STORAGE_CONFIG = {
+    "quantization": os.environ.get("ITCH7_QDRANT_QUANTIZATION", "none"),  # "none"、"scalar"（int8，内存为 1/4）或 "binary"（1/32）
+    "quantile": 0.99,  # scalar 量化确定取值范围时使用的分位数
+    "always_ram": True,  # 量化后的向量常驻内存
+    "rescore": True,  # 用原始向量对量化检索的候选重新打分
+    "oversampling": float(os.environ.get("ITCH7_QDRANT_OVERSAMPLING", 2.0)),  # 重新打分的候选数为 limit 的倍数
+    "on_disk": os.environ.get("ITCH7_QDRANT_ON_DISK", "0") != "0",  # 原始 float32 向量存到磁盘（mmap）
+    "hnsw_m": int(os.environ.get("ITCH7_QDRANT_HNSW_M", 16)),  # HNSW 图每个节点的边数
+    "hnsw_ef_construct": 100,  # 建图时的候选数
+    "hnsw_on_disk": False,  # HNSW 图存到磁盘
+    "hnsw_ef": None,  # 检索时的候选数，None 使用 Qdrant 默认值
+}
+
+# 系统提示组装配置（见 prompt.py）
+PROMPT_CONFIG = {
+    "memory_token_budget": int(os.environ.get("ITCH7_PROMPT_MEMORY_TOKENS", 400)),  # 记忆部分的估算 token 上限，0 表示不限
+    "semantic_dedupe": os.environ.get("ITCH7_PROMPT_DEDUPE", "1") != "0",  # 按 embedding 相似度去除近似重复的记忆（只比较 embedding 缓存中已有的向量，不额外请求 Ollama）
+    "dedupe_threshold": 0.92,  # 余弦相似度达到该值视为重复
+}
+
+# 增量导出/导入配置
+DELTA_CONFIG = {
+    "dtype": "float16",  # 向量块的存储精度，float16 体积减半
+    "batch_size": 256,  # 每次 scroll/upsert 的点数
+}
+
 # 根据用户ID生成集合名称
-def get_collection_name(user_id="default_user"):
+def get_collection_name(user_id="default_user", layout=None):
+    if (layout or STORAGE_LAYOUT) == "shared":
+        return SHARED_COLLECTION_CONFIG["collection_name"]
     return f"{BASE_COLLECTION_NAME}_{user_id}"
 
 # Configuration information
@@ -49,14 +143,135 @@ config = {
     "version": "v1.1",
 }
 
-# Initialize client
-openai_client = OpenAI(api_key=API_KEY, base_url=BASE_URL)
+# 每用户 Memory 实例池配置
+MEMORY_POOL_CONFIG = {
+    "max_size": int(os.environ.get("ITCH7_MEMORY_POOL_SIZE", 256)),  # 最多缓存的用户实例数，0 表示不缓存
+    "idle_ttl": int(os.environ.get("ITCH7_MEMORY_POOL_IDLE_TTL", 1800)),  # 空闲多少秒后淘汰，0 表示不限
+}
+
+# 客户端均在首次使用时创建（线程安全），或通过 warmup() 预先创建
+_client_lock = threading.RLock()
+_clients = {}
+
+def _get_client(name, factory):
+    client = _clients.get(name)
+    if client is None:
+        with _client_lock:
+            client = _clients.get(name)
+            if client is None:
+                client = factory()
+                _clients[name] = client
+    return client
+
+def _build_openai_client():
+    from openai import OpenAI
+    return OpenAI(api_key=API_KEY, base_url=BASE_URL)
+
+def _qdrant_client_kwargs():
+    return dict(
+        host=config["vector_store"]["config"]["host"],
+        port=config["vector_store"]["config"]["port"],
+        grpc_port=QDRANT_CONNECTION_CONFIG["grpc_port"],
+        prefer_grpc=QDRANT_CONNECTION_CONFIG["prefer_grpc"],
+        grpc_options=QDRANT_CONNECTION_CONFIG["grpc_options"],
+        pool_size=QDRANT_CONNECTION_CONFIG["pool_size"],
+        timeout=QDRANT_CONNECTION_CONFIG["timeout"],
+    )
+
+def _build_qdrant_client():
+    # Shared Qdrant client for mem0's vector stores and the collection operations
+    from qdrant_client import QdrantClient
+    return QdrantClient(**_qdrant_client_kwargs())
+
+def _build_qdrant_session():
+    # Keep-alive session for the snapshot REST endpoints, which the Qdrant client doesn't stream
+    import requests
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
+    retry = Retry(
+        total=QDRANT_CONNECTION_CONFIG["rest_retries"],
+        backoff_factor=QDRANT_CONNECTION_CONFIG["rest_backoff"],
+        status_forcelist=(502, 503, 504),
+        # 连接失败时请求还未发出，任何方法都可以重试；读失败和错误状态只重试幂等的方法
+        allowed_methods=frozenset({"GET", "HEAD", "DELETE"}),
+        raise_on_status=False,
+    )
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=SNAPSHOT_CONFIG["pool_maxsize"], max_retries=retry)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+def _build_async_openai_client():
+    from openai import AsyncOpenAI
+    return AsyncOpenAI(api_key=API_KEY, base_url=BASE_URL)
+
+def _build_placeholder_qdrant_client():
+    # mem0 只认识自己的 vector_store provider：嵌入式用户的 Memory 先连到这个进程内的空 Qdrant 创建，再换成嵌入式存储
+    from qdrant_client import QdrantClient
+    return QdrantClient(":memory:")
+
+def _with_shared_qdrant_client(memory_config):
+    # mem0 否则为每个 Memory 新建一个 QdrantClient（各自建连接、做版本检查），改为共用 get_qdrant_client()
+    if "client" in memory_config["vector_store"]["config"]:
+        return memory_config
+    memory_config = dict(memory_config, vector_store=dict(memory_config["vector_store"]))
+    memory_config["vector_store"]["config"] = dict(memory_config["vector_store"]["config"], client=get_qdrant_client())
+    return memory_config
+
+def _build_default_memory():
+    from mem0 import Memory
+    return attach_search_cache(attach_embedding_cache(Memory.from_config(_with_shared_qdrant_client(config))),
+                               collection=config["vector_store"]["config"]["collection_name"])
+
+def get_openai_client():
+    return _get_client("openai", _build_openai_client)
+
+def get_qdrant_client():
+    return _get_client("qdrant", _build_qdrant_client)
+
+def get_qdrant_session():
+    return _get_client("qdrant_session", _build_qdrant_session)
+
+# Async clients for the ASGI server (see asgi.py)
+def get_async_openai_client():
+    return _get_client("async_openai", _build_async_openai_client)
+
+# 默认内存对象（chat.py 使用）
+def get_default_memory():
+    return _get_client("memory", _build_default_memory)
+
+_lazy_attributes = {
+    "openai_client": get_openai_client,
+    "qdrant_client": get_qdrant_client,
+    "async_openai_client": get_async_openai_client,
+    "memory": get_default_memory,
+}
+
+# 兼容旧代码的 config.openai_client / config.memory 等写法，访问时才创建
+def __getattr__(name):
+    if name in _lazy_attributes:
+        return _lazy_attributes[name]()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
-# Create a direct Qdrant client instance for snapshot operations
-qdrant_client = QdrantClient(
-    host=config["vector_store"]["config"]["host"],
-    port=config["vector_store"]["config"]["port"]
-)
+def warmup(user_ids=(), include_async=False):
+    """
+    Create the clients ahead of the first request.
+    
+    Args:
+        user_ids: Users whose Memory instances are built and pooled as well
+        include_async: Also create the clients of the ASGI server
+    """
+    get_openai_client()
+    get_qdrant_client()
+    get_qdrant_session()
+    # The default Memory is built on first use, building it creates the itch7_memory collection
+    if include_async:
+        get_async_openai_client()
+    from .memory_store import seed_point
+    seed_point()
+    for user_id in user_ids:
+        get_user_memory(user_id)
 
 # 获取用户特定的内存配置
 def get_user_config(user_id="default_user"):
@@ -66,10 +281,134 @@ def get_user_config(user_id="default_user"):
     user_config["vector_store"]["config"]["collection_name"] = get_collection_name(user_id)
     return user_config
 
-# 获取用户特定的内存实例
-def get_user_memory(user_id="default_user"):
+_embedder_lock = threading.Lock()
+shared_embedder = None
+
+# 让内存实例使用共享的带缓存 embedder
+def attach_embedding_cache(memory_instance):
+    global shared_embedder
+    if not EMBEDDING_CACHE_CONFIG["enabled"]:
+        return memory_instance
+    with _embedder_lock:
+        if shared_embedder is None:
+            from .embedding_cache import CachedEmbedder
+            shared_embedder = CachedEmbedder(
+                memory_instance.embedding_model,
+                model=config["embedder"]["config"]["model"],
+                dims=config["vector_store"]["config"]["embedding_model_dims"],
+                max_entries=EMBEDDING_CACHE_CONFIG["max_entries"],
+                cache_dir=EMBEDDING_CACHE_CONFIG["cache_dir"],
+                disk_max_entries=EMBEDDING_CACHE_CONFIG["disk_max_entries"],
+            )
+    memory_instance.embedding_model = shared_embedder
+    return memory_instance
+
+# 检索结果缓存配置（按用户缓存 search 结果，写入时失效）
+SEARCH_CACHE_CONFIG = {
+    "enabled": os.environ.get("ITCH7_SEARCH_CACHE", "1") != "0",
+    "max_entries": int(os.environ.get("ITCH7_SEARCH_CACHE_SIZE", 10000)),
+    "ttl": int(os.environ.get("ITCH7_SEARCH_CACHE_TTL", 300)),  # 秒，限制进程外写入造成的过期结果
+}
+
+search_cache = SearchCache(max_entries=SEARCH_CACHE_CONFIG["max_entries"], ttl=SEARCH_CACHE_CONFIG["ttl"])
+register_collector("itch7_search_cache", search_cache.stats)
+
+# 让内存实例的 search 经过检索结果缓存
+def attach_search_cache(memory_instance, user_id=None, collection=None):
+    if not SEARCH_CACHE_CONFIG["enabled"]:
+        return memory_instance
+    return CachedSearchMemory(memory_instance, search_cache, user_id=user_id, collection=collection)
+
+# 创建用户特定的内存实例
+def create_user_memory(user_id="default_user"):
+    if STORAGE_LAYOUT == "shared":
+        # 确保共享集合及其 user_id 负载索引存在（mem0 自己创建的集合不带索引）
+        from .memory_store import ensure_shared_collection
+        ensure_shared_collection()
+    from mem0 import Memory
     user_config = get_user_config(user_id)
-    return Memory.from_config(user_config)
+    if VECTOR_BACKEND_CONFIG["backend"] == "embedded" and STORAGE_LAYOUT != "shared":
+        from .memory_store import user_backend, open_embedded_store
+        if user_backend(user_id) == "embedded":
+            user_config["vector_store"]["config"]["client"] = _get_client("placeholder_qdrant", _build_placeholder_qdrant_client)
+            memory_instance = Memory.from_config(user_config)
+            memory_instance.vector_store = open_embedded_store(user_id)
+            return attach_search_cache(attach_embedding_cache(memory_instance), user_id=user_id,
+                                       collection=user_config["vector_store"]["config"]["collection_name"])
+    from .qdrant_storage import attach_search_params
+    if STORAGE_LAYOUT != "shared":
+        # 先按 QDRANT_STORAGE_CONFIG 创建集合（量化、落盘、HNSW），mem0 发现集合已存在就不再创建
+        from .memory_store import ensure_user_collection
+        ensure_user_collection(user_config["vector_store"]["config"]["collection_name"])
+    memory_instance = Memory.from_config(_with_shared_qdrant_client(user_config))
+    attach_search_params(memory_instance.vector_store)
+    return attach_search_cache(attach_embedding_cache(memory_instance), user_id=user_id,
+                               collection=user_config["vector_store"]["config"]["collection_name"])
+
+# Embedding 缓存配置（所有用户共享同一个带缓存的 embedder）
+EMBEDDING_CACHE_CONFIG = {
+    "enabled": os.environ.get("ITCH7_EMBEDDING_CACHE", "1") != "0",
+    "max_entries": int(os.environ.get("ITCH7_EMBEDDING_CACHE_SIZE", 20000)),  # 内存 LRU 层的条目数
+    "cache_dir": os.environ.get("ITCH7_EMBEDDING_CACHE_DIR"),  # 磁盘层目录，不设置则只缓存在内存中
+    "disk_max_entries": 1000000,
+}
+
+# 后台记忆写入队列配置
+INGESTION_CONFIG = {
+    "enabled": os.environ.get("ITCH7_INGEST_BACKGROUND", "1") != "0",  # 关闭后在请求内同步写入记忆
+    "workers": int(os.environ.get("ITCH7_INGEST_WORKERS", 2)),
+    "max_batch": 8,  # 同一用户最多合并多少轮对话为一次 add
+    "max_pending": 10000,  # 队列上限，超出后退回同步写入
+    "retry_delay": 1.0,  # 写入失败后首次重试前等待的秒数，之后每次翻倍
+    "journal_path": os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "your_memory", "ingest_journal.jsonl"),
+    "fsync": False,
+}
+
+# 历史对话批量导入配置（见 history_ingest.py）
+HISTORY_INGEST_CONFIG = {
+    "turns_per_chunk": 4,  # 提取模式下每次 Memory.add 合并的用户轮次
+    "raw_turns_per_chunk": 1,  # raw 模式下每条记忆包含的用户轮次
+    "batch_size": 256,  # raw 模式下一次 embedding 与写入的块数
+    "workers": int(os.environ.get("ITCH7_HISTORY_INGEST_WORKERS", 4)),  # raw 模式下并行处理的单元数；提取模式同一用户的 Memory.add 依次执行
+    "progress_interval": 2.0,  # 进度报告间隔（秒）
+}
+
+# 记忆重置配置：重置时写入预先计算好的种子记忆，不调用 LLM 和 embedder
+MEMORY_RESET_CONFIG = {
+    "seed_memory": "Said hello to their AI partner for the first time",  # 重置后用户的第一条记忆
+    "workers": int(os.environ.get("ITCH7_RESET_WORKERS", 8)),  # 批量重置时并行处理的用户数
+    "max_users": 10000,  # 一次批量重置最多处理的用户数
+    "max_workers": 64,  # 请求中 workers 参数的上限
+}
+
+# 后台记忆整理配置（见 compaction.py）：合并近似重复的记忆，按 TTL 和重要性淘汰
+COMPACTION_CONFIG = {
+    "enabled": os.environ.get("ITCH7_COMPACTION", "0") != "0",  # 是否启动定时整理线程
+    "interval": int(os.environ.get("ITCH7_COMPACTION_INTERVAL", 6 * 3600)),  # 两轮定时整理之间的间隔（秒）
+    "min_user_interval": 3600,  # 同一用户两次整理之间的最短间隔（秒），试运行不受限制
+    "user_pause": 1.0,  # 定时整理中每个用户之后的暂停（秒），限制对 Qdrant 的压力
+    "similarity_threshold": 0.95,  # 余弦相似度不低于该值的记忆视为重复
+    "summarize": os.environ.get("ITCH7_COMPACTION_SUMMARIZE", "0") != "0",  # 用 LLM 把每组重复记忆合并为一条
+    "summarize_batch": 20,  # 一次 LLM 调用合并的组数
+    "ttl_days": int(os.environ.get("ITCH7_MEMORY_TTL_DAYS", 0)),  # 超过该天数未更新的记忆被淘汰，0 表示不淘汰
+    "ttl_min_importance": 0.8,  # 重要性不低于该值的记忆不受 TTL 影响
+    "default_importance": 0.5,  # 负载中没有 importance 字段时的重要性
+    "max_points": int(os.environ.get("ITCH7_MEMORY_MAX_POINTS", 0)),  # 每个用户最多保留的记忆数，0 表示不限
+    "max_scan_points": 20000,  # 一次整理最多读取的记忆数
+    "probe_queries": 20,  # 整理前后用于测量检索延迟的查询数
+}
+
+# 用户内存实例池
+memory_pool = MemoryPool(create_user_memory, **MEMORY_POOL_CONFIG)
+register_collector("itch7_memory_pool", memory_pool.stats)
+register_collector("itch7_embedding_cache", lambda: shared_embedder.stats() if shared_embedder is not None else {})
+
+# 获取用户特定的内存实例（从实例池中复用）
+def get_user_memory(user_id="default_user"):
+    return memory_pool.get(user_id)
+
+# 用户集合被替换（重置或导入）后，丢弃缓存的内存实例
+def invalidate_user_memory(user_id="default_user"):
+    memory_pool.invalidate(user_id)
+    search_cache.invalidate(user_id)
 
-# 默认内存对象
-memory = Memory.from_config(config)
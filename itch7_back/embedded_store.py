@@ -0,0 +1,403 @@
+"""
+Embedded, in-process vector store for users with few memories.
+
+One store holds the memories of one user in a directory:
+
+    CURRENT             generation number of the live files
+    vectors.<gen>.f32   memory-mapped float32 matrix, one normalized vector per row
+    log.<gen>.jsonl     append-only operation log: put (id, row, payload), payload, del
+
+Updates never rewrite rows: a changed vector is appended as a new row and the old
+row becomes dead. Once enough rows are dead the store is compacted into the next
+generation. Search is a vectorized cosine top-k over the live rows.
+
+The store implements the vector store interface mem0's Memory uses (insert,
+search, get, list, update, delete, ...), so it can replace `Memory.vector_store`.
+Once a store grows past `promote_threshold` points it hands its points to the
+`on_promote` callback, which moves them to Qdrant and returns a mem0 Qdrant
+vector store; every later call is forwarded to that store.
+"""
+import json
+import os
+import shutil
+import threading
+
+import numpy as np
+
+
+class Record:
+    """Point returned by search/get/list, with the attributes of Qdrant's ScoredPoint/Record"""
+
+    __slots__ = ("id", "score", "payload", "vector")
+
+    def __init__(self, id, payload, score=None, vector=None):
+        self.id = id
+        self.payload = payload
+        self.score = score
+        self.vector = vector
+
+
+def _matches(payload, filters):
+    for key, expected in (filters or {}).items():
+        if expected is None:
+            continue
+        value = payload.get(key)
+        if isinstance(expected, (list, tuple, set)):
+            if value not in expected:
+                return False
+        elif isinstance(expected, dict):
+            for op, bound in expected.items():
+                if value is None:
+                    return False
+                if (op == "gte" and not value >= bound) or (op == "gt" and not value > bound) \
+                        or (op == "lte" and not value <= bound) or (op == "lt" and not value < bound) \
+                        or (op == "ne" and value == bound):
+                    return False
+        elif value != expected:
+            return False
+    return True
+
+
+class EmbeddedVectorStore:
+    """Per-user vector store backed by a memory-mapped NumPy matrix, see the module docstring"""
+
+    GROW_ROWS = 1024
+    MIN_COMPACT_ROWS = 64
+
+    def __init__(self, collection_name, embedding_model_dims, path, promote_threshold=None,
+                 on_promote=None, compact_ratio=0.25):
+        """
+        Args:
+            collection_name: Name of the store, reported like a Qdrant collection name
+            embedding_model_dims: Vector dimensions
+            path: Directory of the store's files
+            promote_threshold: Number of points past which the store is promoted, None never promotes
+            on_promote: Callable taking this store and returning the vector store that replaces it
+            compact_ratio: Fraction of dead rows that triggers a compaction
+        """
+        self.collection_name = collection_name
+        self.embedding_model_dims = embedding_model_dims
+        self.path = path
+        self.promote_threshold = promote_threshold
+        self.on_promote = on_promote
+        self.compact_ratio = compact_ratio
+        self._lock = threading.RLock()
+        self._delegate = None
+        self._open()
+
+    def _open(self):
+        os.makedirs(self.path, exist_ok=True)
+        current = os.path.join(self.path, "CURRENT")
+        if os.path.exists(current):
+            with open(current, "r", encoding="ascii") as f:
+                self._generation = int(f.read().strip() or 0)
+        else:
+            self._generation = 0
+            self._write_current()
+
+        self._ids = {}       # point id -> row
+        self._payloads = {}  # point id -> payload
+        self._row_ids = []   # row -> point id, None for dead rows
+        log_path = self._log_path(self._generation)
+        if os.path.exists(log_path):
+            with open(log_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # A torn last line from a crash mid-write
+                        continue
+                    self._apply(record)
+
+        self._capacity = 0
+        self._matrix = None
+        self._live_rows = None
+        self._filter_rows = {}
+        self._ensure_capacity(max(len(self._row_ids), 1))
+        self._log = open(log_path, "a", encoding="utf-8")
+
+    def _apply(self, record):
+        point_id = record["id"]
+        op = record["op"]
+        if op == "put":
+            old_row = self._ids.get(point_id)
+            if old_row is not None:
+                self._row_ids[old_row] = None
+            row = record["row"]
+            while len(self._row_ids) <= row:
+                self._row_ids.append(None)
+            self._row_ids[row] = point_id
+            self._ids[point_id] = row
+            self._payloads[point_id] = record.get("payload") or {}
+        elif op == "payload" and point_id in self._ids:
+            self._payloads[point_id] = record.get("payload") or {}
+        elif op == "del":
+            row = self._ids.pop(point_id, None)
+            self._payloads.pop(point_id, None)
+            if row is not None:
+                self._row_ids[row] = None
+
+    def _vectors_path(self, generation):
+        return os.path.join(self.path, f"vectors.{generation}.f32")
+
+    def _log_path(self, generation):
+        return os.path.join(self.path, f"log.{generation}.jsonl")
+
+    def _write_current(self):
+        tmp_path = os.path.join(self.path, "CURRENT.tmp")
+        with open(tmp_path, "w", encoding="ascii") as f:
+            f.write(str(self._generation))
+        os.replace(tmp_path, os.path.join(self.path, "CURRENT"))
+
+    def _ensure_capacity(self, rows):
+        if rows <= self._capacity:
+            return
+        capacity = ((rows + self.GROW_ROWS - 1) // self.GROW_ROWS) * self.GROW_ROWS
+        vectors_path = self._vectors_path(self._generation)
+        size = capacity * self.embedding_model_dims * 4
+        with open(vectors_path, "ab") as f:
+            if f.tell() < size:
+                f.truncate(size)
+        if self._matrix is not None:
+            self._matrix.flush()
+        self._matrix = np.memmap(vectors_path, dtype=np.float32, mode="r+", shape=(capacity, self.embedding_model_dims))
+        self._capacity = capacity
+
+    def _write(self, record):
+        self._log.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self._apply(record)
+        self._live_rows = None
+        self._filter_rows = {}
+
+    def _normalize(self, vectors):
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(-1, self.embedding_model_dims)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return vectors / norms
+
+    def _append_rows(self, point_ids, vectors, payloads):
+        start = len(self._row_ids)
+        self._ensure_capacity(start + len(point_ids))
+        # Vectors are written before the log records, so a logged row is always complete
+        self._matrix[start:start + len(point_ids)] = self._normalize(vectors)
+        for offset, (point_id, payload) in enumerate(zip(point_ids, payloads)):
+            self._row_ids.append(None)
+            self._write({"op": "put", "id": point_id, "row": start + offset, "payload": payload})
+        self._log.flush()
+
+    def _live(self):
+        if self._live_rows is None:
+            self._live_rows = np.fromiter(self._ids.values(), dtype=np.int64, count=len(self._ids))
+        return self._live_rows
+
+    def _rows_matching(self, filters):
+        try:
+            key = frozenset(filters.items())
+        except TypeError:
+            key = None  # unhashable (range or list) conditions are not cached
+        rows = self._filter_rows.get(key) if key is not None else None
+        if rows is None:
+            rows = np.fromiter((row for point_id, row in self._ids.items()
+                                if _matches(self._payloads[point_id], filters)), dtype=np.int64)
+            if key is not None:
+                # mem0 always filters by the same user_id, so this is usually a single entry
+                self._filter_rows[key] = rows
+        return rows
+
+    # mem0 vector store interface
+
+    def create_col(self, name=None, vector_size=None, distance=None):
+        """The store is created on construction, nothing to do"""
+        if self._delegate is not None:
+            return self._delegate.create_col(vector_size or self.embedding_model_dims, False)
+
+    def insert(self, vectors, payloads=None, ids=None):
+        with self._lock:
+            if self._delegate is not None:
+                return self._delegate.insert(vectors, payloads=payloads, ids=ids)
+            if ids is None:
+                ids = list(range(len(self._row_ids), len(self._row_ids) + len(vectors)))
+            payloads = payloads or [{} for _ in vectors]
+            self._append_rows(list(ids), vectors, [dict(payload) for payload in payloads])
+            # Re-inserted IDs leave their old rows dead, like updates do
+            self._maybe_compact()
+            self._maybe_promote()
+
+    def search(self, query, vectors, limit=5, filters=None, top_k=None):
+        limit = top_k if top_k is not None else limit
+        with self._lock:
+            if self._delegate is not None:
+                return self._delegate.search(query, vectors, limit, filters)
+            rows = self._rows_matching(filters) if filters else self._live()
+            if rows.size == 0 or limit <= 0:
+                return []
+            # Scoring every used row works on a view of the memmap, gathering the live rows first would copy them;
+            # compaction keeps the share of dead rows small
+            scores = (self._matrix[:len(self._row_ids)] @ self._normalize(vectors)[0])[rows]
+            k = min(limit, rows.size)
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top])]
+            return [Record(self._row_ids[rows[i]], dict(self._payloads[self._row_ids[rows[i]]]), score=float(scores[i]))
+                    for i in top]
+
+    def search_batch(self, queries, vectors_list, top_k=1, filters=None):
+        return [self.search(query, vectors, filters=filters, top_k=top_k) for query, vectors in zip(queries, vectors_list)]
+
+    def keyword_search(self, query, top_k=5, filters=None):
+        # No keyword index, mem0 falls back to vector search alone
+        return None
+
+    def delete(self, vector_id):
+        with self._lock:
+            if self._delegate is not None:
+                return self._delegate.delete(vector_id)
+            if vector_id in self._ids:
+                self._write({"op": "del", "id": vector_id})
+                self._log.flush()
+                self._maybe_compact()
+
+    def update(self, vector_id, vector=None, payload=None):
+        with self._lock:
+            if self._delegate is not None:
+                return self._delegate.update(vector_id, vector=vector, payload=payload)
+            if vector_id not in self._ids:
+                return
+            if vector is not None:
+                # Like a Qdrant upsert, a full update replaces the payload
+                new_payload = dict(payload) if payload is not None else self._payloads[vector_id]
+                self._append_rows([vector_id], [vector], [new_payload])
+                self._maybe_compact()
+            elif payload is not None:
+                # Like Qdrant's set_payload, a payload-only update merges the keys
+                self._write({"op": "payload", "id": vector_id, "payload": {**self._payloads[vector_id], **payload}})
+                self._log.flush()
+
+    def get(self, vector_id):
+        with self._lock:
+            if self._delegate is not None:
+                return self._delegate.get(vector_id)
+            if vector_id not in self._ids:
+                return None
+            return Record(vector_id, dict(self._payloads[vector_id]))
+
+    def list_cols(self):
+        if self._delegate is not None:
+            return self._delegate.list_cols()
+        return [self.collection_name]
+
+    def delete_col(self):
+        """Delete the store's points and files, leaving an empty store that can be written to again"""
+        with self._lock:
+            if self._delegate is not None:
+                return self._delegate.delete_col()
+            self.close()
+            shutil.rmtree(self.path, ignore_errors=True)
+            self._open()
+
+    def col_info(self):
+        with self._lock:
+            if self._delegate is not None:
+                return self._delegate.col_info()
+            return {"name": self.collection_name, "points_count": len(self._ids),
+                    "rows": len(self._row_ids), "dims": self.embedding_model_dims, "backend": "embedded"}
+
+    def list(self, filters=None, limit=100, top_k=None):
+        limit = top_k if top_k is not None else limit
+        with self._lock:
+            if self._delegate is not None:
+                return self._delegate.list(filters, limit)
+            records = []
+            for point_id, payload in self._payloads.items():
+                if limit is not None and len(records) >= limit:
+                    break
+                if _matches(payload, filters):
+                    records.append(Record(point_id, dict(payload)))
+            # Same shape as a Qdrant scroll: (points, next_page_offset)
+            return records, None
+
+    def reset(self):
+        with self._lock:
+            if self._delegate is not None:
+                return self._delegate.reset()
+            self.delete_col()
+
+    # Maintenance
+
+    def __len__(self):
+        return len(self._ids)
+
+    @property
+    def promoted(self):
+        return self._delegate is not None
+
+    def iter_points(self, batch_size=256, with_vectors=True):
+        """Yield batches of Records (with vectors) of all live points"""
+        with self._lock:
+            point_ids = list(self._ids)
+        for start in range(0, len(point_ids), batch_size):
+            # Rows are looked up per batch, a compaction between batches moves them
+            batch = self.retrieve(point_ids[start:start + batch_size], with_vectors=with_vectors)
+            if batch:
+                yield batch
+
+    def retrieve(self, ids, with_vectors=True):
+        """Return Records of the given point IDs that exist, like QdrantClient.retrieve"""
+        with self._lock:
+            if self._delegate is not None:
+                return self._delegate.client.retrieve(collection_name=self.collection_name, ids=list(ids),
+                                                      with_payload=True, with_vectors=with_vectors)
+            found = [point_id for point_id in ids if point_id in self._ids]
+            vectors = self._matrix[[self._ids[point_id] for point_id in found]] if with_vectors and found else None
+            return [Record(point_id, dict(self._payloads[point_id]),
+                           vector=vectors[i].tolist() if vectors is not None else None)
+                    for i, point_id in enumerate(found)]
+
+    def compact(self):
+        """Rewrite the live rows into the next generation, dropping dead rows"""
+        with self._lock:
+            if self._delegate is not None:
+                return
+            items = list(self._ids.items())
+            old_generation = self._generation
+            new_generation = old_generation + 1
+            capacity = max(((len(items) + self.GROW_ROWS - 1) // self.GROW_ROWS) * self.GROW_ROWS, self.GROW_ROWS)
+            matrix = np.memmap(self._vectors_path(new_generation), dtype=np.float32, mode="w+",
+                               shape=(capacity, self.embedding_model_dims))
+            if items:
+                matrix[:len(items)] = self._matrix[[row for _, row in items]]
+            matrix.flush()
+            with open(self._log_path(new_generation), "w", encoding="utf-8") as f:
+                for row, (point_id, _) in enumerate(items):
+                    f.write(json.dumps({"op": "put", "id": point_id, "row": row, "payload": self._payloads[point_id]},
+                                       ensure_ascii=False) + "\n")
+
+            # Switching CURRENT is the commit point, a crash before it keeps the old generation
+            self.close()
+            self._generation = new_generation
+            self._write_current()
+            for path in (self._vectors_path(old_generation), self._log_path(old_generation)):
+                if os.path.exists(path):
+                    os.unlink(path)
+            self._open()
+
+    def _maybe_compact(self):
+        dead = len(self._row_ids) - len(self._ids)
+        if dead >= self.MIN_COMPACT_ROWS and dead >= self.compact_ratio * len(self._row_ids):
+            self.compact()
+
+    def _maybe_promote(self):
+        if self.promote_threshold is None or self.on_promote is None or len(self._ids) <= self.promote_threshold:
+            return
+        self._delegate = self.on_promote(self)
+        self.close()
+        shutil.rmtree(self.path, ignore_errors=True)
+        self._ids, self._payloads, self._row_ids = {}, {}, []
+        self._live_rows, self._filter_rows = None, {}
+
+    def close(self):
+        with self._lock:
+            if self._matrix is not None:
+                self._matrix.flush()
+                self._matrix = None
+            if getattr(self, "_log", None) is not None and not self._log.closed:
+                self._log.close()
@@ -0,0 +1,267 @@
+import hashlib
+import json
+import os
+import threading
+import unicodedata
+from collections import OrderedDict
+from concurrent.futures import Future
+
+import numpy as np
+
+
+def normalize_text(text):
+    """Normalize text for cache lookups: unicode NFC, trimmed, whitespace collapsed"""
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+
+class DiskEmbeddingStore:
+    """
+    Append-only on-disk embedding tier.
+
+    Vectors live in a memory-mapped float32 matrix (`vectors.f32`), the row of each
+    key is recorded in an append-only index file (`index.txt`, one "key row" per line).
+    The store only appends; once `max_entries` rows are used, new vectors are not persisted.
+    Only one process may write to a cache directory.
+    """
+
+    GROW_ROWS = 4096
+
+    def __init__(self, cache_dir, dims, max_entries=1000000):
+        self.cache_dir = cache_dir
+        self.dims = dims
+        self.max_entries = max_entries
+        os.makedirs(cache_dir, exist_ok=True)
+
+        self._vectors_path = os.path.join(cache_dir, "vectors.f32")
+        self._index_path = os.path.join(cache_dir, "index.txt")
+        self._meta_path = os.path.join(cache_dir, "meta.json")
+        self._check_meta()
+
+        self._rows = {}
+        if os.path.exists(self._index_path):
+            with open(self._index_path, "r", encoding="ascii") as f:
+                for line in f:
+                    parts = line.split()
+                    # Skip a torn last line from a crash mid-write
+                    if len(parts) == 2 and parts[1].isdigit():
+                        self._rows[parts[0]] = int(parts[1])
+        self._count = max(self._rows.values(), default=-1) + 1
+
+        self._capacity = 0
+        self._matrix = None
+        self._ensure_capacity(max(self._count, 1))
+        self._index = open(self._index_path, "a", encoding="ascii")
+
+    def _check_meta(self):
+        if os.path.exists(self._meta_path):
+            with open(self._meta_path, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            if meta.get("dims") != self.dims:
+                raise ValueError(f"Embedding cache at {self.cache_dir} has {meta.get('dims')} dims, expected {self.dims}")
+        else:
+            with open(self._meta_path, "w", encoding="utf-8") as f:
+                json.dump({"dims": self.dims, "dtype": "float32"}, f)
+
+    def _ensure_capacity(self, rows):
+        if rows <= self._capacity:
+            return
+        capacity = ((rows + self.GROW_ROWS - 1) // self.GROW_ROWS) * self.GROW_ROWS
+        size = capacity * self.dims * 4
+        with open(self._vectors_path, "ab") as f:
+            if f.tell() < size:
+                f.truncate(size)
+        if self._matrix is not None:
+            self._matrix.flush()
+        self._matrix = np.memmap(self._vectors_path, dtype=np.float32, mode="r+", shape=(capacity, self.dims))
+        self._capacity = capacity
+
+    def get(self, key):
+        row = self._rows.get(key)
+        if row is None:
+            return None
+        return np.array(self._matrix[row])
+
+    def put(self, key, vector):
+        if key in self._rows or self._count >= self.max_entries:
+            return
+        row = self._count
+        self._ensure_capacity(row + 1)
+        self._matrix[row] = vector
+        self._count += 1
+        # The index line is written after the vector, so a recorded row is always complete
+        self._index.write(f"{key} {row}\n")
+        self._index.flush()
+        self._rows[key] = row
+
+    def __len__(self):
+        return len(self._rows)
+
+    def close(self):
+        if self._matrix is not None:
+            self._matrix.flush()
+        self._index.close()
+
+
+class CachedEmbedder:
+    """
+    Content-addressed cache in front of a mem0 embedder.
+
+    Vectors are keyed by (model, hash of the normalized text). Lookups go through an
+    in-process LRU tier, then an optional on-disk tier (DiskEmbeddingStore). Misses of
+    one embed_batch call are sent to the embedder in a single batched call, and
+    concurrent requests for the same text wait on one embed call instead of repeating it.
+
+    The wrapper is a drop-in replacement for `Memory.embedding_model`: everything
+    except embed/embed_batch is forwarded to the wrapped embedder. `memory_action` is
+    not part of the key since the Ollama embedder ignores it.
+    """
+
+    def __init__(self, embedder, model, dims=1024, max_entries=20000, cache_dir=None, disk_max_entries=1000000):
+        """
+        Args:
+            embedder: The mem0 embedder to wrap
+            model: Embedding model name, part of the cache key
+            dims: Embedding dimensions
+            max_entries: Size of the in-process LRU tier
+            cache_dir: Directory of the on-disk tier, None keeps the cache in memory only
+            disk_max_entries: Maximum number of vectors kept on disk
+        """
+        self._embedder = embedder
+        self.model = model
+        self.dims = dims
+        self.max_entries = max_entries
+        self._lru = OrderedDict()
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self._disk = DiskEmbeddingStore(os.path.join(cache_dir, model.replace(":", "_").replace("/", "_")), dims,
+                                        disk_max_entries) if cache_dir else None
+
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.embed_calls = 0
+
+    def __getattr__(self, name):
+        if name == "_embedder":
+            raise AttributeError(name)
+        return getattr(self._embedder, name)
+
+    def cache_key(self, text):
+        normalized = normalize_text(text)
+        return hashlib.sha1(f"{self.model}\0{normalized}".encode("utf-8")).hexdigest()
+
+    def embed(self, text, memory_action=None):
+        """Return the embedding of text, from the cache when possible"""
+        return self.embed_batch([text], memory_action)[0]
+
+    def embed_batch(self, texts, memory_action="add"):
+        """Return the embeddings of texts, embedding all cache misses in one call"""
+        keys = [self.cache_key(text) for text in texts]
+        results = {}
+        owned = {}    # key -> (text, future) that this call has to embed
+        waiting = {}  # key -> future another thread is already embedding
+
+        with self._lock:
+            for key, text in zip(keys, texts):
+                if key in results or key in owned or key in waiting:
+                    continue
+                vector = self._lookup(key)
+                if vector is not None:
+                    results[key] = vector
+                elif key in self._inflight:
+                    waiting[key] = self._inflight[key]
+                    self.coalesced += 1
+                else:
+                    future = Future()
+                    self._inflight[key] = future
+                    owned[key] = (text, future)
+                    self.misses += 1
+            if owned:
+                self.embed_calls += 1
+
+        if owned:
+            miss_keys = list(owned)
+            miss_texts = [owned[key][0] for key in miss_keys]
+            try:
+                if len(miss_texts) == 1:
+                    vectors = [self._embedder.embed(miss_texts[0], memory_action)]
+                elif hasattr(self._embedder, "embed_batch"):
+                    vectors = self._embedder.embed_batch(miss_texts, memory_action)
+                else:
+                    vectors = [self._embedder.embed(text, memory_action) for text in miss_texts]
+            except BaseException as e:
+                with self._lock:
+                    for key in miss_keys:
+                        self._inflight.pop(key, None)
+                for key in miss_keys:
+                    owned[key][1].set_exception(e)
+                raise
+
+            with self._lock:
+                for key, vector in zip(miss_keys, vectors):
+                    array = np.asarray(vector, dtype=np.float32)
+                    self._store(key, array)
+                    self._inflight.pop(key, None)
+                    results[key] = array
+            for key in miss_keys:
+                owned[key][1].set_result(results[key])
+
+        for key, future in waiting.items():
+            results[key] = future.result()
+
+        return [results[key].tolist() for key in keys]
+
+    def lookup_batch(self, texts):
+        """
+        Return the cached embeddings of texts, None for the ones not in the cache
+
+        Never calls the embedder, and is not counted in the hit/miss stats, which
+        describe the embeddings requested through embed and embed_batch.
+        """
+        with self._lock:
+            vectors = [self._lookup(self.cache_key(text), count=False) for text in texts]
+        return [vector.tolist() if vector is not None else None for vector in vectors]
+
+    def _lookup(self, key, count=True):
+        vector = self._lru.get(key)
+        if vector is not None:
+            self._lru.move_to_end(key)
+            self.hits += count
+            return vector
+        if self._disk is not None:
+            vector = self._disk.get(key)
+            if vector is not None:
+                self.disk_hits += count
+                self._remember(key, vector)
+                return vector
+        return None
+
+    def _store(self, key, vector):
+        self._remember(key, vector)
+        if self._disk is not None:
+            self._disk.put(key, vector)
+
+    def _remember(self, key, vector):
+        if self.max_entries <= 0:
+            return
+        self._lru[key] = vector
+        self._lru.move_to_end(key)
+        while len(self._lru) > self.max_entries:
+            self._lru.popitem(last=False)
+
+    def stats(self):
+        """Return cache sizes, hit/miss counters and the hit rate"""
+        with self._lock:
+            lookups = self.hits + self.disk_hits + self.misses + self.coalesced
+            return {
+                "model": self.model,
+                "entries": len(self._lru),
+                "disk_entries": len(self._disk) if self._disk is not None else 0,
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "coalesced": self.coalesced,
+                "embed_calls": self.embed_calls,
+                "hit_rate": round((lookups - self.misses) / lookups, 4) if lookups else 0.0,
+            }
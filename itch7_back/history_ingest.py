@@ -0,0 +1,327 @@
+"""
+Bulk ingestion of existing conversation logs into a user's memories.
+
+The log is read as JSON lines. A line holds either one message
+({"role": "user", "content": "...", "timestamp": ...}, optionally with a
+"conversation_id") or a whole conversation ({"messages": [...]}). Messages are
+grouped into chunks of a few turns (a turn starts at each user message), without
+crossing conversations.
+
+Two modes:
+  extract (default)  every chunk goes through Memory.add, so mem0's LLM extracts facts
+  raw                every chunk is stored as one memory: chunks are embedded in large
+                     batches and bulk-inserted into the user's vector store, no LLM calls
+
+Work units (one chunk, or batch_size chunks in raw mode) run on a bounded thread
+pool in raw mode. In extract mode they run one at a time: mem0's add reads the
+user's memories, asks the LLM and writes the outcome, so two adds for one user at
+once would overwrite each other's updates. Jobs of different users still run in
+parallel; adds of concurrent jobs for the same user take turns on the per-user
+write lock that queued turns, resets and compaction take as well.
+After each unit, the position up to which every unit has finished is saved
+to a checkpoint file. Running the same job again skips everything before that
+position. Raw memories get deterministic IDs, so units that are redone after a
+crash overwrite their points instead of duplicating them.
+
+Usage:
+    python -m itch7_back.history_ingest --user-id alice history.jsonl [--raw] [--job-id ID]
+        [--turns-per-chunk 4] [--batch-size 256] [--workers 4]
+"""
+import argparse
+import datetime
+import hashlib
+import json
+import logging
+import os
+import sys
+import time
+import uuid
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from .config import HISTORY_INGEST_CONFIG, get_user_memory, search_cache
+from .ingestion import user_write_lock
+from .memory_store import get_memory_dir
+from .metrics import histogram
+
+logger = logging.getLogger(__name__)
+
+HISTORY_INGEST_SECONDS = histogram(
+    "itch7_history_ingest_unit_seconds",
+    "Duration of one history ingestion unit (a Memory.add call, or a batched embed and insert in raw mode)",
+    labelnames=("mode",))
+
+
+def _timestamp(message):
+    value = message.get("timestamp", message.get("created_at"))
+    if isinstance(value, (int, float)):
+        return datetime.datetime.fromtimestamp(value, datetime.timezone.utc).isoformat()
+    if isinstance(value, str):
+        try:
+            parsed = datetime.datetime.fromisoformat(value)
+        except ValueError:
+            return None
+        if parsed.tzinfo is None:
+            parsed = parsed.replace(tzinfo=datetime.timezone.utc)
+        return parsed.isoformat()
+    return None
+
+
+class _Unit:
+    __slots__ = ("index", "chunks", "end", "messages")
+
+    def __init__(self, index, chunks, end):
+        self.index = index
+        self.chunks = chunks  # lists of (position, message)
+        self.end = end        # position after the last message of the unit
+        self.messages = sum(len(chunk) for chunk in chunks)
+
+
+class HistoryIngestor:
+    """Ingests one conversation log for one user, see the module docstring"""
+
+    def __init__(self, user_id, raw=False, job_id=None, turns_per_chunk=None, batch_size=None, workers=None,
+                 checkpoint_path=None, progress_interval=None):
+        """
+        Args:
+            user_id: User whose memories are written
+            raw: Store chunks as memories without LLM fact extraction
+            job_id: Name of the job, running a job again resumes it; None starts a new job
+            turns_per_chunk: User turns per chunk, default from HISTORY_INGEST_CONFIG
+            batch_size: Chunks embedded and inserted together in raw mode
+            workers: Units processed in parallel in raw mode, extract mode always uses one
+            checkpoint_path: Path of the checkpoint file, default is in the user's your_memory directory
+            progress_interval: Seconds between progress reports
+        """
+        self.user_id = user_id
+        self.raw = raw
+        self.mode = "raw" if raw else "extract"
+        self.job_id = job_id or uuid.uuid4().hex
+        self.turns_per_chunk = turns_per_chunk or HISTORY_INGEST_CONFIG["raw_turns_per_chunk" if raw else "turns_per_chunk"]
+        self.batch_size = batch_size or HISTORY_INGEST_CONFIG["batch_size"]
+        self.workers = (workers or HISTORY_INGEST_CONFIG["workers"]) if raw else 1
+        self.progress_interval = progress_interval if progress_interval is not None else HISTORY_INGEST_CONFIG["progress_interval"]
+        safe_job_id = "".join(c if c.isalnum() or c in "-_" else "_" for c in self.job_id)
+        self.checkpoint_path = checkpoint_path or os.path.join(get_memory_dir(user_id), f"ingest_{safe_job_id}.json")
+
+        self.state = self._load_checkpoint()
+        self.skipped_lines = 0
+        self._started = None
+        self._session_messages = 0
+
+    def _load_checkpoint(self):
+        if os.path.exists(self.checkpoint_path):
+            with open(self.checkpoint_path, "r", encoding="utf-8") as f:
+                state = json.load(f)
+            if state.get("user_id") == self.user_id and state.get("mode") == self.mode:
+                logger.info("Resuming history ingestion job %s at line %s", self.job_id, state["position"][0])
+                return state
+        return {"job_id": self.job_id, "user_id": self.user_id, "mode": self.mode, "position": [0, 0],
+                "messages": 0, "chunks": 0, "memories": 0, "done": False}
+
+    def _save_checkpoint(self):
+        self.state["updated"] = datetime.datetime.now(datetime.timezone.utc).isoformat()
+        tmp_path = f"{self.checkpoint_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.state, f)
+        os.replace(tmp_path, self.checkpoint_path)
+
+    def _messages(self, lines):
+        """Yield (position, message, new_conversation) of the messages at or after the checkpoint"""
+        resume = tuple(self.state["position"])
+        conversation = None
+        for line_no, line in enumerate(lines):
+            if isinstance(line, bytes):
+                line = line.decode("utf-8")
+            if line_no < resume[0] or not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError:
+                self.skipped_lines += 1
+                continue
+            if isinstance(record, dict) and isinstance(record.get("messages"), list):
+                messages, new_conversation = record["messages"], True
+            elif isinstance(record, list):
+                messages, new_conversation = record, True
+            elif isinstance(record, dict) and "content" in record:
+                new_conversation = record.get("conversation_id") != conversation
+                conversation = record.get("conversation_id")
+                messages = [record]
+            else:
+                self.skipped_lines += 1
+                continue
+            for message_no, message in enumerate(messages):
+                position = (line_no, message_no)
+                if position < resume or not isinstance(message, dict) or not str(message.get("content") or "").strip():
+                    continue
+                yield position, message, new_conversation and message_no == 0
+
+    def _units(self, lines):
+        chunks = []
+        chunk = []
+        turns = 0
+        index = 0
+        per_unit = self.batch_size if self.raw else 1
+        last = None
+        for position, message, new_conversation in self._messages(lines):
+            is_turn = message.get("role", "user") == "user"
+            if chunk and (new_conversation or (is_turn and turns >= self.turns_per_chunk)):
+                chunks.append(chunk)
+                chunk, turns = [], 0
+                if len(chunks) >= per_unit:
+                    yield _Unit(index, chunks, [last[0], last[1] + 1])
+                    index += 1
+                    chunks = []
+            chunk.append((position, message))
+            turns += is_turn
+            last = position
+        if chunk:
+            chunks.append(chunk)
+        if chunks:
+            yield _Unit(index, chunks, [last[0], last[1] + 1])
+
+    def _process(self, unit):
+        with HISTORY_INGEST_SECONDS.time(mode=self.mode):
+            memory = get_user_memory(self.user_id)
+            if not self.raw:
+                stored = 0
+                for chunk in unit.chunks:
+                    with user_write_lock(self.user_id):
+                        result = memory.add([{"role": message.get("role", "user"), "content": str(message["content"])}
+                                             for _, message in chunk], user_id=self.user_id)
+                    stored += len(result.get("results", [])) if isinstance(result, dict) else 0
+                return stored
+
+            texts, payloads, ids = [], [], []
+            now = datetime.datetime.now(datetime.timezone.utc).isoformat()
+            for chunk in unit.chunks:
+                text = "\n".join(f"{message.get('role', 'user')}: {message['content']}" for _, message in chunk)
+                created_at = _timestamp(chunk[-1][1]) or now
+                texts.append(text)
+                # The payload fields mem0 writes for a memory, plus the source of the point
+                payloads.append({"data": text, "hash": hashlib.md5(text.encode()).hexdigest(), "user_id": self.user_id,
+                                 "created_at": created_at, "updated_at": created_at, "source": "history"})
+                line_no, message_no = chunk[0][0]
+                ids.append(str(uuid.uuid5(uuid.NAMESPACE_URL, f"{self.user_id}/{self.job_id}/{line_no}/{message_no}")))
+            vectors = memory.embedding_model.embed_batch(texts, "add")
+            # Looked up per unit, an embedded store may be promoted to Qdrant along the way
+            with user_write_lock(self.user_id):
+                memory.vector_store.insert(vectors, payloads=payloads, ids=ids)
+            search_cache.invalidate(self.user_id)
+            return len(texts)
+
+    def progress(self, final=False):
+        """Return the progress of the job as a dict"""
+        elapsed = time.perf_counter() - self._started if self._started else 0.0
+        return {
+            "job_id": self.job_id,
+            "user_id": self.user_id,
+            "mode": self.mode,
+            "line": self.state["position"][0],
+            "messages": self.state["messages"],
+            "chunks": self.state["chunks"],
+            "memories": self.state["memories"],
+            "skipped_lines": self.skipped_lines,
+            "elapsed": round(elapsed, 2),
+            "messages_per_minute": round(self._session_messages / elapsed * 60, 1) if elapsed else None,
+            "done": final and self.state["done"],
+        }
+
+    def iter_run(self, lines):
+        """
+        Ingest lines, yielding a progress dict at most every progress_interval seconds and once at the end
+
+        Closing the generator early stops the job; finished units stay checkpointed.
+        """
+        self._started = time.perf_counter()
+        self._session_messages = 0
+        last_report = self._started
+        finished = {}  # unit index -> (unit, memories) of units done out of order
+        next_index = 0
+        inflight = {}
+        executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="itch7-history")
+
+        def collect(futures):
+            nonlocal next_index
+            for future in futures:
+                unit = inflight.pop(future)
+                finished[unit.index] = (unit, future.result())
+            while next_index in finished:
+                unit, memories = finished.pop(next_index)
+                self.state["position"] = unit.end
+                self.state["messages"] += unit.messages
+                self.state["chunks"] += len(unit.chunks)
+                self.state["memories"] += memories
+                self._session_messages += unit.messages
+                next_index += 1
+            self._save_checkpoint()
+
+        try:
+            for unit in self._units(lines):
+                # Bounded read-ahead, so a long log is never held in memory
+                while len(inflight) >= self.workers * 2:
+                    done, _ = wait(inflight, return_when=FIRST_COMPLETED)
+                    collect(done)
+                    if time.perf_counter() - last_report >= self.progress_interval:
+                        last_report = time.perf_counter()
+                        yield self.progress()
+                inflight[executor.submit(self._process, unit)] = unit
+            while inflight:
+                done, _ = wait(inflight, return_when=FIRST_COMPLETED)
+                collect(done)
+                if inflight and time.perf_counter() - last_report >= self.progress_interval:
+                    last_report = time.perf_counter()
+                    yield self.progress()
+            self.state["done"] = True
+            self._save_checkpoint()
+            logger.info("Ingested %s messages of history for user %s into %s memories (%s mode)",
+                        self.state["messages"], self.user_id, self.state["memories"], self.mode)
+            yield self.progress(final=True)
+        finally:
+            for future in inflight:
+                future.cancel()
+            executor.shutdown(wait=True)
+            if inflight:
+                # Keep whatever finished before the job stopped
+                try:
+                    collect([future for future in list(inflight) if future.done() and not future.cancelled()
+                             and future.exception() is None])
+                except Exception:
+                    logger.exception("Error saving the history ingestion checkpoint")
+
+    def run(self, lines, progress=None):
+        """Ingest lines, calling progress(dict) for every progress report; return the final report"""
+        report = None
+        for report in self.iter_run(lines):
+            if progress is not None:
+                progress(report)
+        return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Ingest a JSONL conversation log into a user\'s memories')
+    parser.add_argument('path', help='JSON lines file, one message or {"messages": [...]} per line')
+    parser.add_argument('--user-id', type=str, default='default_user')
+    parser.add_argument('--raw', action='store_true', help='Store chunks as memories without LLM fact extraction')
+    parser.add_argument('--job-id', type=str, default=None, help='Job name for resuming, default is derived from the file path')
+    parser.add_argument('--turns-per-chunk', type=int, default=None, help='User turns per chunk')
+    parser.add_argument('--batch-size', type=int, default=None, help='Chunks embedded and inserted together in raw mode')
+    parser.add_argument('--workers', type=int, default=None, help='Units processed in parallel (raw mode only)')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    job_id = args.job_id or hashlib.sha1(os.path.abspath(args.path).encode("utf-8")).hexdigest()[:16]
+    ingestor = HistoryIngestor(args.user_id, raw=args.raw, job_id=job_id, turns_per_chunk=args.turns_per_chunk,
+                               batch_size=args.batch_size, workers=args.workers)
+
+    def report(progress):
+        print(f"[{progress['elapsed']:>8.1f}s] line {progress['line']}, {progress['messages']} messages, "
+              f"{progress['memories']} memories, {progress['messages_per_minute']} messages/min", file=sys.stderr)
+
+    with open(args.path, "r", encoding="utf-8") as f:
+        result = ingestor.run(f, progress=report)
+    print(json.dumps(result))
+
+
+if __name__ == "__main__":
+    main()
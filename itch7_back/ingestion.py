@@ -0,0 +1,420 @@
+import atexit
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import deque
+
+from .config import INGESTION_CONFIG, get_default_memory, get_user_memory
+from .metrics import MEMORY_ADD_SECONDS, register_collector
+
+logger = logging.getLogger(__name__)
+
+# Writes of the same user (adds, resets, imports, compaction) run one at a time,
+# so none of them overwrites or resurrects what another one just wrote
+_user_write_locks = [threading.Lock() for _ in range(64)]
+
+
+def user_write_lock(user_id):
+    """Return the lock serializing the writes to a user's memories"""
+    return _user_write_locks[hash(user_id) % len(_user_write_locks)]
+
+
+class IngestionQueue:
+    """
+    Write-behind queue for conversation memories.
+
+    Chat turns are handed to a small pool of worker threads which call
+    `Memory.add` in the background, so the chat stream can finish without waiting
+    on fact extraction, embedding and the vector store upsert.
+
+    - Turns of the same user are processed in order, never by two workers at once
+    - A failing batch is retried with exponential backoff, other users are not held up
+    - Several queued turns of one user are merged into a single `add` call
+    - Every turn is appended to an on-disk journal and acknowledged once stored,
+      so turns queued before a crash are replayed on the next start
+    """
+
+    def __init__(self, memory_getter, named_memories=None, workers=2, max_batch=8, max_pending=10000,
+                 max_retries=3, retry_delay=1.0, journal_path=None, fsync=False):
+        """
+        Args:
+            memory_getter: Callable taking a user_id and returning that user's Memory instance
+            named_memories: Dict of name -> callable returning a shared Memory instance; turns
+                refer to these by name, so they land in the same collection after a journal replay
+            workers: Number of worker threads
+            max_batch: Maximum number of turns merged into one add call
+            max_pending: Maximum number of queued turns, submit() refuses new turns beyond that
+            max_retries: How often a failing batch is retried before it is dropped
+            retry_delay: Seconds before the first retry of a failing batch, doubled on every further attempt
+            journal_path: Path of the append-only journal file, None disables the journal
+            fsync: Whether to fsync the journal after every write
+        """
+        self._memory_getter = memory_getter
+        self._named_memories = dict(named_memories or {})
+        self.workers = workers
+        self.max_batch = max_batch
+        self.max_pending = max_pending
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.journal_path = journal_path
+        self.fsync = fsync
+
+        self._cond = threading.Condition()
+        self._pending = {}      # user_id -> deque of queued turns
+        self._ready = deque()   # users with queued turns that no worker is handling
+        self._active = set()    # users currently being processed by a worker
+        self._backoff = {}      # user_id -> monotonic time their failed batch may be retried
+        self._discarded = set() # active users whose in-flight batch must not be retried
+        self._depth = 0
+        self._threads = []
+        self._journal = None
+        self._started = False
+        self._stopping = False
+
+        self.processed = 0
+        self.batches = 0
+        self.failed = 0
+        atexit.register(self.shutdown)
+
+    def start(self, adopt=()):
+        """
+        Replay the journal and start the worker threads
+
+        Args:
+            adopt: Journals of other queues (e.g. of workers that no longer exist) whose pending
+                turns are taken over; the files are removed once copied into this queue's journal
+        """
+        with self._cond:
+            if self._started:
+                return
+            self._started = True
+            self._stopping = False
+            if self.journal_path:
+                self._open_journal(adopt)
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._worker, name=f"itch7-ingest-{i}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def submit(self, user_id, messages, memory=None):
+        """
+        Queue a conversation turn for storage.
+
+        Args:
+            user_id: User identifier
+            messages: Messages of the turn, as passed to Memory.add
+            memory: Name of a shared Memory instance to store into (see named_memories),
+                default is the user's pooled instance
+
+        Returns:
+            bool: Whether the turn was queued; on False the caller should store it itself
+        """
+        if memory is not None and memory not in self._named_memories:
+            raise ValueError(f"Unknown memory {memory!r}")
+        if not self._started:
+            self.start()
+        with self._cond:
+            if self._stopping or self._depth >= self.max_pending:
+                return False
+            item = {
+                "id": uuid.uuid4().hex,
+                "user_id": user_id,
+                "messages": messages,
+                "enqueued_at": time.time(),
+                "memory": memory,
+                "attempts": 0,
+            }
+            self._journal_write({"op": "add", "id": item["id"], "user_id": user_id, "messages": messages,
+                                 "enqueued_at": item["enqueued_at"], "memory": memory})
+            self._enqueue(item)
+            return True
+
+    def discard(self, user_id, timeout=30):
+        """
+        Drop queued turns of a user, e.g. before their memories are reset or replaced.
+
+        A batch of the user that a worker is storing right now can't be interrupted, so this
+        waits for it to finish (and makes sure it is not retried), otherwise its write could
+        land after the reset.
+
+        Args:
+            user_id: User identifier
+            timeout: Maximum seconds to wait for an in-flight batch
+
+        Returns:
+            int: Number of dropped queued turns
+        """
+        with self._cond:
+            queue = self._pending.pop(user_id, None) or ()
+            self._backoff.pop(user_id, None)
+            self._depth -= len(queue)
+            for item in queue:
+                self._journal_write({"op": "ack", "id": item["id"]})
+            if user_id in self._active:
+                self._discarded.add(user_id)
+                deadline = time.monotonic() + timeout
+                while user_id in self._active:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        logger.warning("Turns of user %s are still being stored after %ss", user_id, timeout)
+                        break
+                    self._cond.wait(remaining)
+            self._cond.notify_all()
+            return len(queue)
+
+    def flush(self, timeout=None):
+        """
+        Wait until every queued turn has been stored.
+
+        Returns:
+            bool: Whether the queue drained before the timeout
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while self._depth > 0 or self._active:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+            return True
+
+    def shutdown(self, timeout=30):
+        """Flush queued turns and stop the workers; turns left over stay in the journal"""
+        if not self._started:
+            return True
+        drained = self.flush(timeout)
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+        for thread in self._threads:
+            thread.join(timeout=1)
+        with self._cond:
+            self._threads = []
+            self._started = False
+            if self._journal is not None:
+                self._journal.close()
+                self._journal = None
+        if not drained:
+            logger.warning("Ingestion queue shut down with %s turn(s) still pending", self._depth)
+        return drained
+
+    def busy(self, user_id):
+        """Whether turns of a user are queued or being stored"""
+        with self._cond:
+            return user_id in self._active or bool(self._pending.get(user_id))
+
+    def stats(self):
+        """Return queue depth, lag of the oldest queued turn and counters"""
+        with self._cond:
+            oldest = min((queue[0]["enqueued_at"] for queue in self._pending.values() if queue), default=None)
+            return {
+                "depth": self._depth,
+                "users": len(self._pending),
+                "active_users": len(self._active),
+                "lag_seconds": round(time.time() - oldest, 3) if oldest is not None else 0.0,
+                "processed": self.processed,
+                "batches": self.batches,
+                "failed": self.failed,
+            }
+
+    def _enqueue(self, item, front=False):
+        user_id = item["user_id"]
+        queue = self._pending.setdefault(user_id, deque())
+        if front:
+            queue.appendleft(item)
+        else:
+            queue.append(item)
+        self._depth += 1
+        if user_id not in self._active and user_id not in self._backoff and len(queue) == 1:
+            self._ready.append(user_id)
+        self._cond.notify()
+
+    def _release_backoff(self):
+        """Make users whose retry delay has passed ready again, return seconds until the next one is due"""
+        now = time.monotonic()
+        next_due = None
+        for user_id, due in list(self._backoff.items()):
+            if due > now:
+                next_due = due if next_due is None else min(next_due, due)
+                continue
+            del self._backoff[user_id]
+            if self._pending.get(user_id) and user_id not in self._active and user_id not in self._ready:
+                self._ready.append(user_id)
+        return None if next_due is None else next_due - now
+
+    def _take_batch(self, user_id):
+        queue = self._pending.get(user_id)
+        batch = []
+        # Only turns targeting the same Memory instance can be merged
+        while queue and len(batch) < self.max_batch and (not batch or queue[0]["memory"] == batch[0]["memory"]):
+            batch.append(queue.popleft())
+        if not queue:
+            self._pending.pop(user_id, None)
+        self._depth -= len(batch)
+        return batch
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                while not self._stopping:
+                    timeout = self._release_backoff()
+                    if self._ready:
+                        break
+                    self._cond.wait(timeout)
+                if self._stopping:
+                    return
+                user_id = self._ready.popleft()
+                if user_id in self._active:
+                    # Already being processed, the worker handling it re-queues the user when done
+                    continue
+                batch = self._take_batch(user_id)
+                if not batch:
+                    continue
+                self._active.add(user_id)
+
+            ok = self._store(user_id, batch)
+
+            with self._cond:
+                self._active.discard(user_id)
+                discarded = user_id in self._discarded
+                self._discarded.discard(user_id)
+                if ok:
+                    self.processed += len(batch)
+                    self.batches += 1
+                    for item in batch:
+                        self._journal_write({"op": "ack", "id": item["id"]})
+                else:
+                    # Turns of a user that was reset meanwhile are dropped, not retried
+                    retry = [] if discarded else [item for item in batch if item["attempts"] < self.max_retries]
+                    self.failed += len(batch) - len(retry)
+                    for item in batch:
+                        if item not in retry:
+                            self._journal_write({"op": "ack", "id": item["id"]})
+                    if retry:
+                        attempts = max(item["attempts"] for item in retry)
+                        self._backoff[user_id] = time.monotonic() + self.retry_delay * 2 ** (attempts - 1)
+                    for item in reversed(retry):
+                        self._enqueue(item, front=True)
+                if self._pending.get(user_id) and user_id not in self._ready and user_id not in self._backoff:
+                    self._ready.append(user_id)
+                if self._depth == 0 and not self._active:
+                    self._compact_journal()
+                self._cond.notify_all()
+
+    def _store(self, user_id, batch):
+        messages = list(batch[0]["messages"])
+        for item in batch[1:]:
+            # The system prompt repeats on every turn, keep it only once
+            messages.extend(m for m in item["messages"] if m.get("role") != "system")
+        try:
+            memory = self._resolve_memory(user_id, batch[0]["memory"])
+            with user_write_lock(user_id), MEMORY_ADD_SECONDS.time(mode="background"):
+                memory.add(messages, user_id=user_id)
+            return True
+        except Exception:
+            for item in batch:
+                item["attempts"] += 1
+            logger.exception("Error storing %s queued turn(s) for user %s", len(batch), user_id)
+            return False
+
+    def _resolve_memory(self, user_id, name):
+        if name is None:
+            return self._memory_getter(user_id)
+        return self._named_memories[name]()
+
+    def _open_journal(self, adopt=()):
+        journal_dir = os.path.dirname(self.journal_path)
+        if journal_dir and not os.path.exists(journal_dir):
+            os.makedirs(journal_dir)
+
+        # Replay turns that were queued but never acknowledged
+        replay = {}
+        adopted = [path for path in adopt if path != self.journal_path and os.path.exists(path)]
+        for path in [*adopted, self.journal_path]:
+            if not os.path.exists(path):
+                continue
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # A torn last line from a crash mid-write
+                        continue
+                    if record.get("op") == "add":
+                        replay[record["id"]] = record
+                    elif record.get("op") == "ack":
+                        replay.pop(record["id"], None)
+
+        # Rewrite the journal with only the pending turns
+        tmp_path = f"{self.journal_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            for record in replay.values():
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        os.replace(tmp_path, self.journal_path)
+        self._journal = open(self.journal_path, "a", encoding="utf-8")
+        for path in adopted:
+            os.remove(path)
+
+        for record in replay.values():
+            self._enqueue({
+                "id": record["id"],
+                "user_id": record["user_id"],
+                "messages": record["messages"],
+                "enqueued_at": record.get("enqueued_at", time.time()),
+                "memory": record.get("memory"),
+                "attempts": 0,
+            })
+        if replay:
+            logger.info("Replaying %s queued turn(s) from %s", len(replay), self.journal_path)
+
+    def _journal_write(self, record):
+        if self._journal is None:
+            return
+        self._journal.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self._journal.flush()
+        if self.fsync:
+            os.fsync(self._journal.fileno())
+
+    def _compact_journal(self):
+        # Nothing pending, so the whole journal is acknowledged and can be truncated
+        if self._journal is not None and self._journal.tell() > 0:
+            self._journal.seek(0)
+            self._journal.truncate()
+
+
+# 全局写后（write-behind）记忆写入队列
+ingestion_queue = IngestionQueue(
+    get_user_memory,
+    named_memories={"default": get_default_memory},
+    workers=INGESTION_CONFIG["workers"],
+    max_batch=INGESTION_CONFIG["max_batch"],
+    max_pending=INGESTION_CONFIG["max_pending"],
+    retry_delay=INGESTION_CONFIG["retry_delay"],
+    journal_path=INGESTION_CONFIG["journal_path"],
+    fsync=INGESTION_CONFIG["fsync"],
+)
+register_collector("itch7_ingestion", ingestion_queue.stats)
+
+
+def store_conversation(user_id, messages, memory=None):
+    """
+    Store a conversation turn, in the background when the ingestion queue is enabled.
+
+    Args:
+        user_id: User identifier
+        messages: Messages of the turn, as passed to Memory.add
+        memory: Name of a shared Memory instance to store into, e.g. "default" for the
+            default collection; default is the user's pooled instance
+
+    Returns:
+        bool: Whether the turn was queued instead of stored synchronously
+    """
+    if INGESTION_CONFIG["enabled"] and ingestion_queue.submit(user_id, messages, memory=memory):
+        return True
+    memory = ingestion_queue._resolve_memory(user_id, memory)
+    with user_write_lock(user_id), MEMORY_ADD_SECONDS.time(mode="sync"):
+        memory.add(messages, user_id=user_id)
+    return False
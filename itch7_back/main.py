@@ -1,17 +1,40 @@
-from .api import run_api
 import argparse
 
 def main():
     """Main entry point"""
+    from .config import PREFORK_CONFIG
     parser = argparse.ArgumentParser(description='BrainDance Memory System')
     parser.add_argument('--port', type=int, default=5000, help='API server port')
     parser.add_argument('--host', type=str, default='0.0.0.0', help='API server host')  # Changed to 0.0.0.0 to allow access from any address
     parser.add_argument('--debug', action='store_true', help='Enable debug mode')
+    parser.add_argument('--asgi', action='store_true', help='Serve with the asyncio/ASGI server (requires starlette and uvicorn)')
+    parser.add_argument('--warmup', action='store_true', help='Create the API and database clients before serving instead of on the first request')
+    parser.add_argument('--workers', type=int, default=PREFORK_CONFIG["workers"],
+                        help='Worker processes; more than 1 preforks warmed-up workers with users pinned by user_id (see prefork.py)')
     
     args = parser.parse_args()
+    if args.workers > 1 and (args.asgi or args.debug):
+        parser.error('--workers is not supported together with --asgi or --debug')
     
+    if args.workers > 1:
+        # Every worker warms up its own clients after the fork; the master must not create any
+        from .prefork import serve
+        print(f"Starting BrainDance API server at {args.host}:{args.port} with {args.workers} workers...")
+        serve(host=args.host, port=args.port, workers=args.workers)
+        return
+
+    if args.warmup:
+        from .config import warmup
+        warmup(include_async=args.asgi)
+
     print(f"Starting BrainDance API server at {args.host}:{args.port}...")
-    run_api(host=args.host, port=args.port, debug=args.debug)
+    if args.asgi:
+        # Imported lazily so the Flask server does not need the ASGI dependencies
+        from .asgi import run_asgi
+        run_asgi(host=args.host, port=args.port, debug=args.debug)
+    else:
+        from .api import run_api
+        run_api(host=args.host, port=args.port, debug=args.debug)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,325 @@
+"""
+Incremental (delta) export and import of user memories.
+
+A delta file holds the points of one user that were created or updated after a
+watermark, in a compact columnar layout:
+
+    magic      8 bytes    b"ITCH7DLT"
+    header     4088 bytes JSON, space padded (count, dims, dtype, offsets, watermark, ...)
+    vectors    count * dims little-endian float16/float32, can be memory-mapped
+    payloads   JSON lines {"id": ..., "payload": {...}}, in the order of the vectors
+
+The watermark is the newest created_at/updated_at timestamp mem0 stored in the
+exported payloads; passing it as `since` to the next export yields only what
+changed afterwards. Deletions are not tracked, a full snapshot is still needed
+to drop memories that were removed.
+
+Users kept in the embedded vector store (see embedded_store.py) are exported and
+imported through the same format.
+"""
+import datetime
+import json
+import logging
+import os
+import tempfile
+
+import numpy as np
+
+from .config import config, get_qdrant_client, get_collection_name, STORAGE_LAYOUT, DELTA_CONFIG
+from .memory_store import (collection_exists, create_memory_collection, ensure_shared_collection, get_memory_dir,
+                           open_embedded_store, scroll_user_points, tenant_point_id, user_backend, user_filter)
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"ITCH7DLT"
+HEADER_SIZE = 4096
+FORMAT_VERSION = 1
+
+
+def _parse_timestamp(value):
+    try:
+        timestamp = datetime.datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        return None
+    if timestamp.tzinfo is None:
+        timestamp = timestamp.replace(tzinfo=datetime.timezone.utc)
+    return timestamp
+
+
+def _changed_since_filter(user_id, since):
+    from qdrant_client import models
+
+    conditions = [user_filter(user_id)]
+    if since:
+        conditions.append(models.Filter(should=[
+            models.FieldCondition(key="created_at", range=models.DatetimeRange(gt=since)),
+            models.FieldCondition(key="updated_at", range=models.DatetimeRange(gt=since)),
+        ]))
+    return models.Filter(must=conditions)
+
+
+def _changed_after(payload, since):
+    for key in ("created_at", "updated_at"):
+        changed = _parse_timestamp((payload or {}).get(key))
+        if changed is not None and changed > since:
+            return True
+    return False
+
+
+def _changed_embedded_points(user_id, since, batch_size):
+    # The embedded store has no payload index, the timestamps are compared here
+    since = _parse_timestamp(since) if since else None
+    for points in open_embedded_store(user_id).iter_points(batch_size=batch_size):
+        if since is not None:
+            points = [point for point in points if _changed_after(point.payload, since)]
+        if points:
+            yield points
+
+
+def _dense_vector(vector):
+    # Collections created by newer mem0 versions store a named dense vector
+    if isinstance(vector, dict):
+        vector = next(iter(vector.values()))
+    return vector
+
+
+def export_memory_delta(user_id="default_user", since=None, delta_path=None, dtype=None, batch_size=None):
+    """
+    Export the memories of a user changed after a watermark to a delta file
+
+    Args:
+        user_id: User ID whose memories are exported
+        since: ISO timestamp watermark of the previous export, None exports everything
+        delta_path: Path of the output file, default is a timestamp-named file in the your_memory directory
+        dtype: "float16" (default, half the size) or "float32" for the vector block
+        batch_size: Number of points fetched per scroll request
+
+    Returns:
+        dict: {"path", "count", "watermark", "bytes"}, or None on failure
+    """
+    collection_name = get_collection_name(user_id)
+    dtype = np.dtype(dtype or DELTA_CONFIG["dtype"]).newbyteorder("<")
+    batch_size = batch_size or DELTA_CONFIG["batch_size"]
+    dims = config["vector_store"]["config"]["embedding_model_dims"]
+    if delta_path is None:
+        timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+        delta_path = os.path.join(get_memory_dir(user_id), f"{get_collection_name(user_id, layout='per_user')}_delta_{timestamp}.i7d")
+
+    try:
+        if user_backend(user_id) == "embedded":
+            batches = _changed_embedded_points(user_id, since, batch_size)
+        elif not collection_exists(collection_name):
+            logger.warning("Collection '%s' does not exist", collection_name)
+            return None
+        else:
+            batches = scroll_user_points(user_id, batch_size=batch_size, scroll_filter=_changed_since_filter(user_id, since))
+
+        count = 0
+        watermark = _parse_timestamp(since) if since else None
+        # Vectors are written in place as they are scrolled, payload lines are spooled and appended after them
+        with open(delta_path, "wb") as f, tempfile.SpooledTemporaryFile(max_size=8 * 1024 * 1024) as payloads:
+            f.write(b"\0" * HEADER_SIZE)
+            for points in batches:
+                vectors = np.asarray([_dense_vector(point.vector) for point in points], dtype=dtype)
+                f.write(vectors.tobytes())
+                for point in points:
+                    payloads.write(json.dumps({"id": point.id, "payload": point.payload}, ensure_ascii=False).encode("utf-8") + b"\n")
+                    for key in ("created_at", "updated_at"):
+                        changed = _parse_timestamp((point.payload or {}).get(key))
+                        if changed is not None and (watermark is None or changed > watermark):
+                            watermark = changed
+                count += len(points)
+
+            payloads_offset = f.tell()
+            payloads.seek(0)
+            while True:
+                chunk = payloads.read(1024 * 1024)
+                if not chunk:
+                    break
+                f.write(chunk)
+            total_bytes = f.tell()
+
+            header = {
+                "version": FORMAT_VERSION,
+                "user_id": user_id,
+                "count": count,
+                "dims": dims,
+                "dtype": dtype.name,
+                "since": since,
+                "watermark": watermark.isoformat() if watermark else since,
+                "vectors_offset": HEADER_SIZE,
+                "payloads_offset": payloads_offset,
+                "created": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            }
+            encoded = MAGIC + json.dumps(header).encode("utf-8")
+            if len(encoded) > HEADER_SIZE:
+                raise ValueError("Delta header too large")
+            f.seek(0)
+            f.write(encoded.ljust(HEADER_SIZE, b" "))
+
+        logger.info("Exported %s changed memories of user %s (%s bytes) to: %s", count, user_id, total_bytes, delta_path)
+        return {"path": os.path.abspath(delta_path), "count": count, "watermark": header["watermark"], "bytes": total_bytes}
+
+    except Exception:
+        logger.exception("Error exporting memory delta")
+        return None
+
+
+def read_delta_header(f):
+    """Read and validate the header of an open delta file"""
+    f.seek(0)
+    raw = f.read(HEADER_SIZE)
+    if len(raw) < HEADER_SIZE or not raw.startswith(MAGIC):
+        raise ValueError("Not a memory delta file")
+    try:
+        header = json.loads(raw[len(MAGIC):].decode("utf-8").rstrip())
+    except ValueError as e:
+        raise ValueError(f"Invalid memory delta header: {e}") from e
+    if not isinstance(header, dict):
+        raise ValueError("Invalid memory delta header")
+    if header.get("version") != FORMAT_VERSION:
+        raise ValueError(f"Unsupported delta format version: {header.get('version')}")
+    return header
+
+
+def open_delta_vectors(delta_path):
+    """Memory-map the vector block of a delta file, return (header, vectors)"""
+    with open(delta_path, "rb") as f:
+        header = read_delta_header(f)
+    if header["count"] == 0:
+        return header, np.zeros((0, header["dims"]), dtype=header["dtype"])
+    vectors = np.memmap(delta_path, dtype=np.dtype(header["dtype"]).newbyteorder("<"), mode="r",
+                        offset=header["vectors_offset"], shape=(header["count"], header["dims"]))
+    return header, vectors
+
+
+def iter_delta_batches(f, batch_size=None):
+    """
+    Read a delta file from an open, seekable binary file in batches
+
+    Yields:
+        tuple: (records, vectors) with records the payload line dicts and vectors a float32 array
+    """
+    batch_size = batch_size or DELTA_CONFIG["batch_size"]
+    header = read_delta_header(f)
+    dtype = np.dtype(header["dtype"]).newbyteorder("<")
+    row_bytes = header["dims"] * dtype.itemsize
+    payload_pos = header["payloads_offset"]
+    for start in range(0, header["count"], batch_size):
+        rows = min(batch_size, header["count"] - start)
+        f.seek(header["vectors_offset"] + start * row_bytes)
+        vectors = np.frombuffer(f.read(rows * row_bytes), dtype=dtype).reshape(rows, header["dims"]).astype(np.float32)
+        f.seek(payload_pos)
+        records = [json.loads(f.readline()) for _ in range(rows)]
+        payload_pos = f.tell()
+        yield records, vectors
+
+
+def check_delta(f, batch_size=None):
+    """
+    Read a whole delta file from an open, seekable binary file without writing anything
+
+    Returns:
+        dict: The header
+
+    Raises:
+        ValueError: If the file is not a delta file, is truncated or holds a malformed record
+    """
+    header = read_delta_header(f)
+    try:
+        for records, _ in iter_delta_batches(f, batch_size):
+            for record in records:
+                if not isinstance(record, dict) or "id" not in record:
+                    raise ValueError(f"malformed record {record!r:.200}")
+    except (KeyError, TypeError) as e:
+        raise ValueError(f"Invalid delta file: {e!r}") from e
+    except ValueError as e:
+        raise ValueError(f"Invalid delta file: {e}") from e
+    return header
+
+
+def import_memory_delta(f, user_id="default_user", batch_size=None, verify=True):
+    """
+    Upsert the memories of a delta file into a user's collection, without deleting the collection first
+
+    The whole file is checked (see check_delta) before the first point is written.
+
+    Args:
+        f: Path or open, seekable binary file of the delta
+        user_id: User ID to import to, the user_id of every imported point is set to it
+        batch_size: Number of points per upsert request
+        verify: Read the points back and compare payloads and vectors with the file
+
+    Returns:
+        dict: {"imported", "verified", "mismatches"}, or None on failure
+
+    Raises:
+        ValueError: If the file is not a valid delta file, nothing is written then
+    """
+    from qdrant_client import models
+
+    if isinstance(f, (str, os.PathLike)):
+        with open(f, "rb") as fh:
+            return import_memory_delta(fh, user_id=user_id, batch_size=batch_size, verify=verify)
+
+    collection_name = get_collection_name(user_id)
+    header = check_delta(f, batch_size)
+    try:
+        tolerance = 1e-3 if header["dtype"] == "float16" else 1e-6
+
+        store = None
+        if STORAGE_LAYOUT == "shared":
+            ensure_shared_collection()
+        elif user_backend(user_id) == "embedded":
+            store = open_embedded_store(user_id)
+        elif not collection_exists(collection_name):
+            create_memory_collection(collection_name)
+
+        imported = 0
+        verified = 0
+        mismatches = []
+        for records, vectors in iter_delta_batches(f, batch_size):
+            points = []
+            for record, vector in zip(records, vectors):
+                payload = record.get("payload") or {}
+                point_id = tenant_point_id(record["id"], payload, user_id)
+                payload["user_id"] = user_id
+                points.append(models.PointStruct(id=point_id, vector=vector.tolist(), payload=payload))
+            ids = [point.id for point in points]
+            if store is not None:
+                store.insert([point.vector for point in points], payloads=[point.payload for point in points], ids=ids)
+            else:
+                get_qdrant_client().upsert(collection_name=collection_name, points=points, wait=True)
+            imported += len(points)
+
+            if verify:
+                if store is not None:
+                    found_points = store.retrieve(ids)
+                else:
+                    found_points = get_qdrant_client().retrieve(collection_name=collection_name, ids=ids,
+                                                                with_payload=True, with_vectors=True)
+                stored = {point.id: point for point in found_points}
+                for point in points:
+                    found = stored.get(point.id)
+                    if found is None or found.payload != point.payload:
+                        mismatches.append(point.id)
+                        continue
+                    # Qdrant normalizes vectors of cosine collections, so compare directions
+                    a = np.asarray(_dense_vector(found.vector), dtype=np.float32)
+                    b = np.asarray(point.vector, dtype=np.float32)
+                    cosine = float(a @ b / ((np.linalg.norm(a) * np.linalg.norm(b)) or 1.0))
+                    if 1.0 - cosine > tolerance:
+                        mismatches.append(point.id)
+                    else:
+                        verified += 1
+
+        if verify:
+            logger.info("Imported %s memories into collection '%s' for user %s, verified %s, %s mismatch(es)",
+                        imported, collection_name, user_id, verified, len(mismatches))
+        else:
+            logger.info("Imported %s memories into collection '%s' for user %s", imported, collection_name, user_id)
+        return {"imported": imported, "verified": verified, "mismatches": mismatches}
+
+    except Exception:
+        logger.exception("Error importing memory delta")
+        return None
@@ -0,0 +1,128 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class MemoryPool:
+    """
+    Thread-safe pool of per-user Memory instances with LRU and idle-TTL eviction.
+
+    Building a Memory instance creates the LLM, embedder and vector store clients,
+    so instances are kept around and reused across requests for the same user.
+    """
+
+    def __init__(self, factory, max_size=256, idle_ttl=1800):
+        """
+        Args:
+            factory: Callable taking a user_id and returning a new Memory instance
+            max_size: Maximum number of cached instances, 0 disables pooling
+            idle_ttl: Seconds an instance may stay unused before it is evicted, 0 disables the TTL
+        """
+        self._factory = factory
+        self.max_size = max_size
+        self.idle_ttl = idle_ttl
+        self._entries = OrderedDict()  # user_id -> (memory, last_used)
+        self._lock = threading.Lock()
+        # user_id -> [build lock, threads holding or waiting for it], so two requests for the
+        # same cold user build one instance; dropped when the last of those threads is done
+        self._build_locks = {}
+        # user_id -> whether the user was invalidated, only while an instance is being built
+        self._building = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, user_id):
+        """Return the pooled Memory instance for user_id, building it on a miss"""
+        now = time.monotonic()
+        with self._lock:
+            self._evict_expired(now)
+            entry = self._entries.get(user_id)
+            if entry is not None:
+                self._entries[user_id] = (entry[0], now)
+                self._entries.move_to_end(user_id)
+                self.hits += 1
+                return entry[0]
+            build = self._build_locks.setdefault(user_id, [threading.Lock(), 0])
+            build[1] += 1
+
+        try:
+            with build[0]:
+                return self._get_locked(user_id)
+        finally:
+            with self._lock:
+                build[1] -= 1
+                if not build[1]:
+                    del self._build_locks[user_id]
+
+    def _get_locked(self, user_id):
+        """Second check and build, called holding the user's build lock"""
+        # Another thread may have finished building while we waited
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None:
+                self._entries[user_id] = (entry[0], time.monotonic())
+                self._entries.move_to_end(user_id)
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+            self._building[user_id] = False
+
+        try:
+            memory = self._factory(user_id)
+        except BaseException:
+            with self._lock:
+                self._building.pop(user_id, None)
+            raise
+
+        with self._lock:
+            # Don't cache an instance built against a collection that was replaced meanwhile
+            invalidated = self._building.pop(user_id, False)
+            if self.max_size > 0 and not invalidated:
+                self._entries[user_id] = (memory, time.monotonic())
+                self._entries.move_to_end(user_id)
+                while len(self._entries) > self.max_size:
+                    self._entries.popitem(last=False)
+                    self.evictions += 1
+        return memory
+
+    def invalidate(self, user_id):
+        """Drop the cached instance for user_id, e.g. after its collection was replaced"""
+        with self._lock:
+            if user_id in self._building:
+                self._building[user_id] = True
+            if self._entries.pop(user_id, None) is not None:
+                self.invalidations += 1
+
+    def clear(self):
+        """Drop every cached instance"""
+        with self._lock:
+            for user_id in self._building:
+                self._building[user_id] = True
+            self.invalidations += len(self._entries)
+            self._entries.clear()
+
+    def _evict_expired(self, now):
+        if not self.idle_ttl:
+            return
+        # Entries are kept in LRU order, so the expired ones are at the front
+        while self._entries:
+            user_id, (_, last_used) = next(iter(self._entries.items()))
+            if now - last_used <= self.idle_ttl:
+                break
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def stats(self):
+        """Return pool size and hit/miss/eviction counters"""
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "idle_ttl": self.idle_ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
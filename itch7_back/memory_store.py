@@ -1,8 +1,422 @@
 import os
+import re
+import json
+import shutil
+import hashlib
 import datetime
-import requests
-import traceback
-from .config import config, qdrant_client, get_collection_name
+import itertools
+import logging
+import threading
+import time
+import uuid
+from .config import (BASE_COLLECTION_NAME, config, get_qdrant_client, get_qdrant_session, get_collection_name, invalidate_user_memory, STORAGE_LAYOUT,
+                     SHARED_COLLECTION_CONFIG, SNAPSHOT_CONFIG, VECTOR_BACKEND_CONFIG, MEMORY_RESET_CONFIG)
+from .metrics import observe_transfer
+from .qdrant_storage import create_collection
+
+logger = logging.getLogger(__name__)
+
+_shared_collection_lock = threading.Lock()
+_shared_collection_ready = False
+
+# Embedded vector stores by user ID, shared by a user's Memory instance and export/import
+_embedded_stores_lock = threading.Lock()
+_embedded_stores = {}
+
+# Vector and payload of the memory written by reset_user_memories, computed once
+_seed_lock = threading.Lock()
+_seed_point = None
+
+
+def qdrant_rest_url(path):
+    """Return the URL of a Qdrant REST endpoint"""
+    qdrant_host = config["vector_store"]["config"]["host"]
+    qdrant_port = config["vector_store"]["config"]["port"]
+    return f"http://{qdrant_host}:{qdrant_port}{path}"
+
+
+def get_memory_dir(user_id="default_user"):
+    """Return the your_memory directory of a user, creating it if needed"""
+    memory_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "your_memory", user_id)
+    if not os.path.exists(memory_dir):
+        logger.debug("Creating directory: %s", memory_dir)
+        os.makedirs(memory_dir, exist_ok=True)
+    return memory_dir
+
+
+def user_filter(user_id):
+    """Qdrant filter matching the points of one user"""
+    from qdrant_client import models
+
+    return models.Filter(must=[models.FieldCondition(key="user_id", match=models.MatchValue(value=user_id))])
+
+
+def tenant_point_id(point_id, payload, user_id):
+    """
+    Point ID to use when storing a point under user_id in the shared collection.
+    
+    Points copied from another user (e.g. an imported export of someone else's memories)
+    get a new deterministic ID, so they don't overwrite that user's points.
+    """
+    owner = (payload or {}).get("user_id")
+    if owner is None or owner == user_id:
+        return point_id
+    return str(uuid.uuid5(uuid.NAMESPACE_URL, f"{user_id}/{point_id}"))
+
+
+def collection_exists(collection_name):
+    collections = get_qdrant_client().get_collections()
+    return any(col.name == collection_name for col in collections.collections)
+
+
+def create_memory_collection(collection_name):
+    """Create an empty collection with the vector parameters of the configured embedder and QDRANT_STORAGE_CONFIG"""
+    create_collection(collection_name)
+
+
+def ensure_user_collection(collection_name):
+    """Create a per-user collection if it doesn't exist yet"""
+    if collection_exists(collection_name):
+        return
+    try:
+        create_memory_collection(collection_name)
+    except Exception:
+        # Another request may have created it in the meantime
+        if not collection_exists(collection_name):
+            raise
+
+
+def ensure_shared_collection():
+    """
+    Create the shared multi-tenant collection and its keyword payload index on user_id, if missing.
+    
+    With tenant_optimized, the index is marked as a tenant index and the HNSW graph is
+    built per tenant (payload_m) instead of globally (m=0), as Qdrant recommends for multitenancy.
+    """
+    from qdrant_client import models
+
+    global _shared_collection_ready
+    if _shared_collection_ready:
+        return
+    with _shared_collection_lock:
+        if _shared_collection_ready:
+            return
+        collection_name = SHARED_COLLECTION_CONFIG["collection_name"]
+        tenant_optimized = SHARED_COLLECTION_CONFIG["tenant_optimized"]
+        if not collection_exists(collection_name):
+            logger.info("Creating shared collection '%s'...", collection_name)
+            create_collection(collection_name, shared=True)
+        # Creating an existing index is a no-op in Qdrant
+        get_qdrant_client().create_payload_index(
+            collection_name=collection_name,
+            field_name="user_id",
+            field_schema=models.KeywordIndexParams(type="keyword", is_tenant=tenant_optimized),
+        )
+        _shared_collection_ready = True
+
+
+def embedded_store_dir(user_id="default_user"):
+    """Return the directory of a user's embedded vector store"""
+    return os.path.join(VECTOR_BACKEND_CONFIG["path"], get_collection_name(user_id, layout="per_user"))
+
+
+def _promoted_marker(user_id):
+    # Kept next to the store directory, which is removed on promotion
+    return embedded_store_dir(user_id) + ".promoted"
+
+
+def _mark_promoted(user_id):
+    os.makedirs(VECTOR_BACKEND_CONFIG["path"], exist_ok=True)
+    with open(_promoted_marker(user_id), "w", encoding="utf-8") as f:
+        f.write(datetime.datetime.now(datetime.timezone.utc).isoformat())
+
+
+def user_backend(user_id="default_user"):
+    """
+    Return the vector backend holding a user's memories: "qdrant" or "embedded"
+    
+    With the embedded backend, users start in an embedded store and are promoted to
+    a Qdrant collection once they pass the size threshold. Users that already have
+    a Qdrant collection stay in Qdrant.
+    """
+    if VECTOR_BACKEND_CONFIG["backend"] != "embedded" or STORAGE_LAYOUT == "shared":
+        return "qdrant"
+    if os.path.exists(_promoted_marker(user_id)):
+        return "qdrant"
+    if user_id in _embedded_stores or os.path.exists(os.path.join(embedded_store_dir(user_id), "CURRENT")):
+        return "embedded"
+    if collection_exists(get_collection_name(user_id)):
+        _mark_promoted(user_id)
+        return "qdrant"
+    return "embedded"
+
+
+def open_embedded_store(user_id="default_user"):
+    """Return the embedded vector store of a user, opening it on first use"""
+    from .embedded_store import EmbeddedVectorStore
+
+    with _embedded_stores_lock:
+        store = _embedded_stores.get(user_id)
+        if store is None:
+            store = EmbeddedVectorStore(
+                collection_name=get_collection_name(user_id),
+                embedding_model_dims=config["vector_store"]["config"]["embedding_model_dims"],
+                path=embedded_store_dir(user_id),
+                promote_threshold=VECTOR_BACKEND_CONFIG["promote_threshold"],
+                on_promote=lambda embedded: promote_embedded_user(user_id, embedded),
+                compact_ratio=VECTOR_BACKEND_CONFIG["compact_ratio"],
+            )
+            _embedded_stores[user_id] = store
+        return store
+
+
+def promote_embedded_user(user_id, store, batch_size=256):
+    """
+    Copy the points of a user's embedded store into a new Qdrant collection
+    
+    Called by the store once it passes the size threshold; the store forwards
+    every later call to the returned mem0 Qdrant vector store.
+    """
+    from mem0.vector_stores.qdrant import Qdrant
+    from qdrant_client import models
+
+    collection_name = get_collection_name(user_id)
+    started = time.perf_counter()
+    if collection_exists(collection_name):
+        # Left over from before the user was moved to the embedded backend
+        get_qdrant_client().delete_collection(collection_name=collection_name)
+    create_memory_collection(collection_name)
+    count = 0
+    for points in store.iter_points(batch_size=batch_size):
+        get_qdrant_client().upsert(collection_name=collection_name, wait=True, points=[
+            models.PointStruct(id=point.id, vector=point.vector, payload=point.payload) for point in points
+        ])
+        count += len(points)
+    _mark_promoted(user_id)
+    with _embedded_stores_lock:
+        if _embedded_stores.get(user_id) is store:
+            del _embedded_stores[user_id]
+    # Later Memory instances of the user are built against Qdrant directly
+    invalidate_user_memory(user_id)
+    logger.info("Promoted user %s to Qdrant collection '%s': %s points in %.2fs",
+                user_id, collection_name, count, time.perf_counter() - started)
+    return Qdrant(collection_name=collection_name,
+                  embedding_model_dims=config["vector_store"]["config"]["embedding_model_dims"],
+                  client=get_qdrant_client())
+
+
+def _drop_embedded_store(user_id):
+    with _embedded_stores_lock:
+        store = _embedded_stores.pop(user_id, None)
+    # Pooled Memory instances and cached results still point at the store, drop them before it is closed
+    invalidate_user_memory(user_id)
+    if store is not None:
+        store.close()
+    shutil.rmtree(embedded_store_dir(user_id), ignore_errors=True)
+    if os.path.exists(_promoted_marker(user_id)):
+        os.unlink(_promoted_marker(user_id))
+
+
+def delete_user_memories(user_id="default_user"):
+    """
+    Delete all memories of a user.
+    
+    In the per-user layout the user's collection (or embedded store) is dropped,
+    in the shared layout the user's points are deleted by filter.
+    """
+    from qdrant_client import models
+
+    collection_name = get_collection_name(user_id)
+    if STORAGE_LAYOUT == "shared":
+        ensure_shared_collection()
+        get_qdrant_client().delete(
+            collection_name=collection_name,
+            points_selector=models.FilterSelector(filter=user_filter(user_id)),
+        )
+        logger.info("Deleted memories of user %s from shared collection: %s", user_id, collection_name)
+    elif user_backend(user_id) == "embedded":
+        _drop_embedded_store(user_id)
+        logger.info("Deleted embedded store of user %s", user_id)
+    else:
+        get_qdrant_client().delete_collection(collection_name=collection_name)
+        logger.info("Deleted collection: %s", collection_name)
+        if VECTOR_BACKEND_CONFIG["backend"] == "embedded":
+            # The emptied user starts over in an embedded store
+            _drop_embedded_store(user_id)
+
+
+def uses_qdrant_snapshots(user_id="default_user"):
+    """Whether a user's memories are exported as a Qdrant snapshot rather than a points file"""
+    return STORAGE_LAYOUT != "shared" and user_backend(user_id) == "qdrant"
+
+def seed_point():
+    """
+    Return (vector, payload) of the memory a reset user starts with
+    
+    The seed memory is embedded once per process (warmup() does it before the first
+    request), so resetting a user needs neither the LLM nor the embedder. It is embedded
+    with an embedder built from the config, so no Memory instance or collection is created.
+    """
+    from mem0.utils.factory import EmbedderFactory
+
+    global _seed_point
+    if _seed_point is not None:
+        return _seed_point
+    with _seed_lock:
+        if _seed_point is None:
+            text = MEMORY_RESET_CONFIG["seed_memory"]
+            embedder = EmbedderFactory.create(config["embedder"]["provider"], config["embedder"]["config"], None)
+            vector = list(embedder.embed(text, "add"))
+            payload = {"data": text, "hash": hashlib.md5(text.encode()).hexdigest()}
+            _seed_point = (vector, payload)
+    return _seed_point
+
+
+def reset_user_memories(user_id="default_user"):
+    """
+    Delete all memories of a user and store the seed memory (see seed_point) in their place
+    
+    Turns of the user still waiting in the ingestion queue are dropped, so they
+    aren't written into the reset store.
+    """
+    from qdrant_client import models
+    from .ingestion import ingestion_queue, user_write_lock
+
+    vector, payload = seed_point()
+    now = datetime.datetime.now(datetime.timezone.utc).isoformat()
+    payload = dict(payload, user_id=user_id, created_at=now, updated_at=now)
+    point_id = str(uuid.uuid4())
+
+    # Discarded before taking the lock, the turn a worker is storing waits for it
+    ingestion_queue.discard(user_id)
+    # Also keeps two resets apart, so a delete can't drop a freshly recreated collection
+    with user_write_lock(user_id):
+        try:
+            delete_user_memories(user_id)
+        except Exception as e:
+            logger.warning("Error deleting memories of user %s (may not exist): %s", user_id, e)
+        invalidate_user_memory(user_id)
+
+        if user_backend(user_id) == "embedded":
+            open_embedded_store(user_id).insert([vector], payloads=[payload], ids=[point_id])
+        else:
+            collection_name = get_collection_name(user_id)
+            if STORAGE_LAYOUT == "shared":
+                ensure_shared_collection()
+            else:
+                ensure_user_collection(collection_name)
+            get_qdrant_client().upsert(
+                collection_name=collection_name,
+                points=[models.PointStruct(id=point_id, vector=vector, payload=payload)],
+                wait=True,
+            )
+        # Drop what a concurrent search cached between the delete and the insert
+        invalidate_user_memory(user_id)
+    logger.info("Reset memories of user %s", user_id)
+
+
+def list_user_ids(prefix=""):
+    """Return the IDs of the users with stored memories whose ID starts with prefix"""
+    if STORAGE_LAYOUT == "shared":
+        ensure_shared_collection()
+        response = get_qdrant_client().facet(
+            collection_name=SHARED_COLLECTION_CONFIG["collection_name"],
+            key="user_id",
+            limit=MEMORY_RESET_CONFIG["max_users"],
+            exact=True,
+        )
+        user_ids = {str(hit.value) for hit in response.hits}
+    else:
+        collection_prefix = get_collection_name("", layout="per_user")
+        user_ids = {col.name[len(collection_prefix):] for col in get_qdrant_client().get_collections().collections
+                    if col.name.startswith(collection_prefix)}
+        if VECTOR_BACKEND_CONFIG["backend"] == "embedded" and os.path.isdir(VECTOR_BACKEND_CONFIG["path"]):
+            user_ids.update(name[len(collection_prefix):] for name in os.listdir(VECTOR_BACKEND_CONFIG["path"])
+                            if name.startswith(collection_prefix) and not name.endswith(".promoted"))
+    return sorted(user_id for user_id in user_ids if user_id and user_id.startswith(prefix))
+
+
+def reset_users(user_ids, workers=None):
+    """
+    Reset the memories of many users concurrently (see reset_user_memories)
+    
+    Args:
+        user_ids: Users to reset
+        workers: Users reset in parallel, default from MEMORY_RESET_CONFIG
+        
+    Returns:
+        dict: "reset" lists the users that were reset, "failed" maps the others to their error
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    user_ids = list(dict.fromkeys(user_ids))
+    if not user_ids:
+        return {"reset": [], "failed": {}}
+    seed_point()
+    reset, failed = [], {}
+
+    def reset_one(user_id):
+        try:
+            reset_user_memories(user_id)
+            return user_id, None
+        except Exception as e:
+            logger.exception("Reset of user %s failed", user_id)
+            return user_id, str(e)
+
+    workers = min(workers or MEMORY_RESET_CONFIG["workers"], len(user_ids))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="itch7-reset") as executor:
+        for user_id, error in executor.map(reset_one, user_ids):
+            if error is None:
+                reset.append(user_id)
+            else:
+                failed[user_id] = error
+    return {"reset": reset, "failed": failed}
+
+
+def create_qdrant_snapshot(collection_name):
+    """
+    Create a snapshot of a collection on the Qdrant server
+    
+    Args:
+        collection_name: Name of the collection
+        
+    Returns:
+        dict: Snapshot description with "name" and, depending on the Qdrant version, "size" and "checksum"; None on failure
+    """
+    logger.debug("Creating snapshot for collection '%s'...", collection_name)
+    response = get_qdrant_session().post(qdrant_rest_url(f"/collections/{collection_name}/snapshots"))
+    if response.status_code != 200:
+        logger.error("Failed to create snapshot: %s", response.text)
+        return None
+    
+    response_data = response.json()
+    
+    # Try to get snapshot name from response, handle possible different response structures
+    if "name" in response_data:
+        snapshot = response_data
+    elif "result" in response_data and "name" in response_data["result"]:
+        snapshot = response_data["result"]
+    else:
+        # If name is not found, use timestamp as name
+        snapshot = {"name": f"snapshot-{datetime.datetime.now().strftime('%Y%m%d%H%M%S')}"}
+        logger.warning("Unable to get snapshot name from response, using temporary name: %s", snapshot['name'])
+    
+    logger.info("Snapshot created successfully: %s", snapshot['name'])
+    return snapshot
+
+
+def delete_old_snapshots(collection_name, keep=None):
+    """Delete the server-side snapshots of a collection, except the one named keep"""
+    try:
+        response = get_qdrant_session().get(qdrant_rest_url(f"/collections/{collection_name}/snapshots"))
+        if response.status_code != 200:
+            return
+        for snapshot in response.json().get("result") or []:
+            if snapshot.get("name") != keep:
+                get_qdrant_session().delete(qdrant_rest_url(f"/collections/{collection_name}/snapshots/{snapshot['name']}"))
+    except Exception as e:
+        logger.error("Error deleting old snapshots of '%s': %s", collection_name, e)
+
 
 def export_qdrant_snapshot(user_id="default_user", collection_name=None, snapshot_path=None):
     """
@@ -20,10 +434,7 @@ def export_qdrant_snapshot(user_id="default_user", collection_name=None, snapsho
         collection_name = get_collection_name(user_id)
     
     # 创建保存快照的目录
-    memory_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "your_memory", user_id)
-    if not os.path.exists(memory_dir):
-        print(f"Creating directory: {memory_dir}")
-        os.makedirs(memory_dir)
+    memory_dir = get_memory_dir(user_id)
     
     if snapshot_path is None:
         timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
@@ -32,124 +443,599 @@ def export_qdrant_snapshot(user_id="default_user", collection_name=None, snapsho
     
     try:
         # Check if the collection exists
-        collections = qdrant_client.get_collections()
-        collection_exists = any(col.name == collection_name for col in collections.collections)
-        
-        if not collection_exists:
-            print(f"Collection '{collection_name}' does not exist")
+        if not collection_exists(collection_name):
+            logger.warning("Collection '%s' does not exist", collection_name)
             return None
             
         # Step 1: Create snapshot
-        print(f"Creating snapshot for collection '{collection_name}'...")
-        # Use REST API to create snapshot
-        qdrant_host = config["vector_store"]["config"]["host"]
-        qdrant_port = config["vector_store"]["config"]["port"]
-        create_snapshot_url = f"http://{qdrant_host}:{qdrant_port}/collections/{collection_name}/snapshots"
-        
-        response = requests.post(create_snapshot_url)
-        if response.status_code != 200:
-            print(f"Failed to create snapshot: {response.text}")
+        snapshot = create_qdrant_snapshot(collection_name)
+        if snapshot is None:
             return None
-        
-        # Print full response for debugging
-        print(f"API response: {response.text}")
-        response_data = response.json()
-        
-        # Try to get snapshot name from response, handle possible different response structures
-        if "name" in response_data:
-            snapshot_name = response_data["name"]
-        elif "result" in response_data and "name" in response_data["result"]:
-            snapshot_name = response_data["result"]["name"]
-        else:
-            # If name is not found, use timestamp as name
-            snapshot_name = f"snapshot-{datetime.datetime.now().strftime('%Y%m%d%H%M%S')}"
-            print(f"Unable to get snapshot name from response, using temporary name: {snapshot_name}")
-        
-        print(f"Snapshot created successfully: {snapshot_name}")
+        snapshot_name = snapshot["name"]
         
         # Step 2: Download snapshot
-        print(f"Downloading snapshot...")
-        download_snapshot_url = f"http://{qdrant_host}:{qdrant_port}/collections/{collection_name}/snapshots/{snapshot_name}"
+        logger.debug("Downloading snapshot...")
+        download_snapshot_url = qdrant_rest_url(f"/collections/{collection_name}/snapshots/{snapshot_name}")
         
-        with requests.get(download_snapshot_url, stream=True) as r:
+        started = time.perf_counter()
+        with get_qdrant_session().get(download_snapshot_url, stream=True) as r:
             if r.status_code != 200:
-                print(f"Failed to download snapshot: {r.text}")
+                logger.error("Failed to download snapshot: %s", r.text)
                 return None
                 
             r.raise_for_status()
             output_file = f"{snapshot_path}.snapshot"
             with open(output_file, 'wb') as f:
-                for chunk in r.iter_content(chunk_size=8192):
+                for chunk in r.iter_content(chunk_size=SNAPSHOT_CONFIG["chunk_size"]):
                     f.write(chunk)
+        observe_transfer("export", os.path.getsize(output_file), time.perf_counter() - started)
         
         full_path = os.path.abspath(f"{snapshot_path}.snapshot")
-        print(f"Snapshot successfully exported to: {full_path}")
+        logger.info("Snapshot successfully exported to: %s", full_path)
         return full_path
         
-    except Exception as e:
-        print(f"Error exporting snapshot: {str(e)}")
-        traceback.print_exc()  # Print full error stack
+    except Exception:
+        logger.exception("Error exporting snapshot")
         return None
 
 
-def import_qdrant_snapshot(snapshot_path, user_id="default_user", collection_name=None):
+def import_qdrant_snapshot(snapshot_path, user_id="default_user"):
     """
-    Import Qdrant collection from a snapshot file
+    Replace a user's memories with the points of a snapshot file, see upload_qdrant_snapshot_stream
     
     Args:
         snapshot_path: Path to the snapshot file
-        user_id: User ID to specify which collection to import to
-        collection_name: Name of the collection to import to, default is based on user_id
+        user_id: User ID to import to
         
     Returns:
         bool: Whether the import was successful
     """
-    if collection_name is None:
-        collection_name = get_collection_name(user_id)
+    if not os.path.exists(snapshot_path):
+        logger.warning("Snapshot file does not exist: %s", snapshot_path)
+        return False
+    chunk_size = SNAPSHOT_CONFIG["chunk_size"]
+    with open(snapshot_path, "rb") as f:
+        return upload_qdrant_snapshot_stream(iter(lambda: f.read(chunk_size), b""), user_id=user_id,
+                                             filename=os.path.basename(snapshot_path))
+
+
+def export_user_points(user_id="default_user", points_path=None, batch_size=256):
+    """
+    Export the points of one user to a JSON lines file (one {"id", "vector", "payload"} per line)
     
-    try:
-        # Check if the snapshot file exists
-        if not os.path.exists(snapshot_path):
-            print(f"Snapshot file does not exist: {snapshot_path}")
-            return False
-        
-        # Configure Qdrant API parameters
-        qdrant_host = config["vector_store"]["config"]["host"]
-        qdrant_port = config["vector_store"]["config"]["port"]
-        
-        # Delete existing collection (if exists)
-        try:
-            print(f"Deleting existing collection '{collection_name}' (if exists)...")
-            qdrant_client.delete_collection(collection_name=collection_name)
-            print("Collection deleted successfully")
-        except Exception as e:
-            print(f"Exception occurred while deleting collection (possibly collection does not exist): {str(e)}")
-        
-        # Check file size and format
-        file_size = os.path.getsize(snapshot_path)
-        print(f"Snapshot file size: {file_size} bytes")
-        
-        # Restore collection from snapshot file - use upload endpoint
-        print(f"Restoring collection from snapshot file...")
-        upload_url = f"http://{qdrant_host}:{qdrant_port}/collections/{collection_name}/snapshots/upload"
+    Unlike a snapshot this works in the shared layout, where a collection holds many users.
+    
+    Args:
+        user_id: User ID whose points are exported
+        points_path: Path of the output file, default is a timestamp-named file in the your_memory directory
+        batch_size: Number of points fetched per scroll request
         
-        # Open file in binary mode and set up request correctly
-        with open(snapshot_path, 'rb') as f:
-            files = {'snapshot': (os.path.basename(snapshot_path), f)}
-            response = requests.post(upload_url, files=files)
+    Returns:
+        str: Path where the points file is saved
+    """
+    collection_name = get_collection_name(user_id)
+    if points_path is None:
+        timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+        points_path = os.path.join(get_memory_dir(user_id), f"{get_collection_name(user_id, layout='per_user')}_points_{timestamp}.jsonl")
+    
+    try:
+        if user_backend(user_id) == "embedded":
+            batches = open_embedded_store(user_id).iter_points(batch_size=batch_size)
+        elif not collection_exists(collection_name):
+            logger.warning("Collection '%s' does not exist", collection_name)
+            return None
+        else:
+            batches = scroll_user_points(user_id, batch_size=batch_size)
         
-        # Print detailed response information for debugging
-        print(f"Response status code: {response.status_code}")
-        print(f"Response content: {response.text}")
+        count = 0
+        with open(points_path, "w", encoding="utf-8") as f:
+            for points in batches:
+                for point in points:
+                    f.write(json.dumps({"id": point.id, "vector": point.vector, "payload": point.payload}, ensure_ascii=False) + "\n")
+                count += len(points)
         
-        if response.status_code != 200:
-            print(f"Failed to restore from snapshot: {response.text}")
-            return False
+        full_path = os.path.abspath(points_path)
+        logger.info("Exported %s points of user %s to: %s", count, user_id, full_path)
+        return full_path
+    
+    except Exception:
+        logger.exception("Error exporting points")
+        return None
+
+
+def scroll_user_points(user_id="default_user", batch_size=256, scroll_filter=None, collection_name=None):
+    """Yield batches of the points (with vectors) of one user from Qdrant, or of every point of collection_name"""
+    offset = None
+    while True:
+        points, offset = get_qdrant_client().scroll(
+            collection_name=collection_name or get_collection_name(user_id),
+            scroll_filter=None if collection_name else scroll_filter or user_filter(user_id),
+            limit=batch_size,
+            offset=offset,
+            with_payload=True,
+            with_vectors=True,
+        )
+        if points:
+            yield points
+        if offset is None:
+            break
+
+
+def iter_user_points(user_id="default_user", batch_size=256):
+    """Yield batches of the points (with vectors) of one user, from Qdrant or the user's embedded store"""
+    if user_backend(user_id) == "embedded":
+        yield from open_embedded_store(user_id).iter_points(batch_size=batch_size)
+    elif STORAGE_LAYOUT == "shared" or collection_exists(get_collection_name(user_id)):
+        yield from scroll_user_points(user_id, batch_size=batch_size)
+
+
+def write_user_points(user_id="default_user", upserts=(), deletes=(), batch_size=256):
+    """
+    Upsert and delete points of one user in bulk
+    
+    Args:
+        user_id: User whose points are written
+        upserts: (point_id, vector, payload) of the points to insert or replace
+        deletes: IDs of the points to delete
+        batch_size: Points per upsert or delete request
+    """
+    from qdrant_client import models
+
+    upserts, deletes = list(upserts), list(deletes)
+    if user_backend(user_id) == "embedded":
+        store = open_embedded_store(user_id)
+        for start in range(0, len(upserts), batch_size):
+            batch = upserts[start:start + batch_size]
+            store.insert([vector for _, vector, _ in batch], payloads=[payload for _, _, payload in batch],
+                         ids=[point_id for point_id, _, _ in batch])
+        for point_id in deletes:
+            store.delete(point_id)
+    else:
+        collection_name = get_collection_name(user_id)
+        for start in range(0, len(upserts), batch_size):
+            get_qdrant_client().upsert(collection_name=collection_name, wait=True, points=[
+                models.PointStruct(id=point_id, vector=vector, payload=payload)
+                for point_id, vector, payload in upserts[start:start + batch_size]
+            ])
+        for start in range(0, len(deletes), batch_size):
+            get_qdrant_client().delete(collection_name=collection_name, wait=True,
+                                       points_selector=models.PointIdsList(points=deletes[start:start + batch_size]))
+
+
+def import_user_points(points_path, user_id="default_user", batch_size=256):
+    """
+    Replace the memories of one user with the points of a file written by export_user_points
+    
+    Args:
+        points_path: Path to the points file
+        user_id: User ID to import to, the user_id of every imported point is set to it
+        batch_size: Number of points per upsert request
         
-        print(f"Snapshot successfully imported to collection '{collection_name}'")
+    Returns:
+        bool: Whether the import was successful
+    """
+    if not os.path.exists(points_path):
+        logger.warning("Points file does not exist: %s", points_path)
+        return False
+    with open(points_path, "r", encoding="utf-8") as f:
+        return import_user_points_lines(f, user_id=user_id, batch_size=batch_size)
+
+
+def _parse_points(lines, user_id):
+    """Yield a PointStruct for every JSON line of a points file, owned by user_id"""
+    from qdrant_client import models
+
+    for number, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+            payload = record.get("payload") or {}
+            point_id = tenant_point_id(record["id"], payload, user_id)
+            vector = record["vector"]
+        except (KeyError, TypeError, AttributeError) as e:
+            raise ValueError(f"Invalid point on line {number}: {e!r}") from e
+        payload["user_id"] = user_id
+        yield models.PointStruct(id=point_id, vector=vector, payload=payload)
+
+
+def _staging_collection_name():
+    # "-" after the base name: never the collection of a user (itch7_memory_<user_id>) or the shared one
+    return f"{BASE_COLLECTION_NAME}-import-{uuid.uuid4().hex}"
+
+
+def _drop_collection(collection_name):
+    try:
+        get_qdrant_client().delete_collection(collection_name=collection_name)
+    except Exception as e:
+        logger.warning("Could not delete collection '%s': %s", collection_name, e)
+
+
+def _stage_points(lines, user_id, batch_size=256, verify=None):
+    """
+    Upsert the points of JSON lines into a new staging collection as they are read
+
+    Args:
+        lines: JSON lines of a points file
+        user_id: Owner of the points, see _parse_points
+        batch_size: Points per upsert request
+        verify: Called once every line was read, raises ValueError to reject the upload
+
+    Returns:
+        str: Name of the staging collection
+
+    Raises:
+        ValueError: If a line is not a valid point, there are no points or verify rejects the upload;
+            the staging collection is dropped then
+    """
+    staging = _staging_collection_name()
+    create_memory_collection(staging)
+    try:
+        points = _parse_points(lines, user_id)
+        count = 0
+        batch = list(itertools.islice(points, batch_size))
+        while batch:
+            get_qdrant_client().upsert(collection_name=staging, points=batch, wait=True)
+            count += len(batch)
+            batch = list(itertools.islice(points, batch_size))
+        if not count:
+            raise ValueError("The upload contains no points")
+        if verify is not None:
+            verify()
+    except BaseException:
+        _drop_collection(staging)
+        raise
+    return staging
+
+
+def _replace_with_staged(staging, user_id, batch_size=256):
+    """
+    Replace a user's memories with the points of a staging collection, then drop it
+
+    Points keep their ID unless they belonged to another user (see tenant_point_id),
+    and are owned by user_id. Queued turns of the user are discarded, they would be
+    written into the replaced memories.
+
+    Returns:
+        int: Number of points written
+    """
+    from qdrant_client import models
+    from .ingestion import ingestion_queue, user_write_lock
+
+    collection_name = get_collection_name(user_id)
+    try:
+        ingestion_queue.discard(user_id)
+        with user_write_lock(user_id):
+            try:
+                delete_user_memories(user_id)
+            except Exception as e:
+                logger.warning("Exception occurred while deleting existing memories (possibly collection does not exist): %s", e)
+            store = None
+            if STORAGE_LAYOUT == "shared":
+                ensure_shared_collection()
+            elif user_backend(user_id) == "embedded":
+                # Promotes the user to Qdrant by itself if the import passes the size threshold
+                store = open_embedded_store(user_id)
+            else:
+                create_memory_collection(collection_name)
+
+            count = 0
+            for points in scroll_user_points(batch_size=batch_size, collection_name=staging):
+                batch = []
+                for point in points:
+                    payload = dict(point.payload or {})
+                    point_id = tenant_point_id(point.id, payload, user_id)
+                    payload["user_id"] = user_id
+                    batch.append(models.PointStruct(id=point_id, vector=point.vector, payload=payload))
+                if store is not None:
+                    store.insert([point.vector for point in batch], payloads=[point.payload for point in batch],
+                                 ids=[point.id for point in batch])
+                else:
+                    get_qdrant_client().upsert(collection_name=collection_name, points=batch, wait=True)
+                count += len(batch)
+            return count
+    finally:
+        _drop_collection(staging)
+
+
+def import_user_points_lines(lines, user_id="default_user", batch_size=256, verify=None):
+    """
+    Replace the memories of one user with points read from JSON lines, see import_user_points
+
+    The points are staged in a separate collection while they are read; the user's
+    memories are only replaced once every line parsed.
+
+    Args:
+        verify: Called once every line was read, raises ValueError to reject the upload
+
+    Raises:
+        ValueError: If there are no points, a line can't be parsed or verify rejects the upload
+    """
+    staging = _stage_points(lines, user_id, batch_size=batch_size, verify=verify)
+    try:
+        count = _replace_with_staged(staging, user_id, batch_size=batch_size)
+        logger.info("Imported %s points into collection '%s' for user %s", count, get_collection_name(user_id), user_id)
         return True
+    except Exception:
+        logger.exception("Error importing points")
+        return False
+
+
+def is_points_file(path):
+    """Whether a file was written by export_user_points rather than being a Qdrant snapshot (a tar archive)"""
+    with open(path, "rb") as f:
+        head = f.read(1)
+    return head == b"{"
+
+
+def export_user_memory(user_id="default_user"):
+    """Export a user's memories in the format of the configured storage layout and the user's backend"""
+    if not uses_qdrant_snapshots(user_id):
+        return export_user_points(user_id=user_id)
+    return export_qdrant_snapshot(user_id=user_id)
+
+
+def import_user_memory(path, user_id="default_user"):
+    """
+    Import a user's memories from a points file or, in the per-user layout, a Qdrant snapshot
+
+    Raises:
+        ValueError: If the file is empty or holds no points, nothing is deleted then
+    """
+    if os.path.getsize(path) == 0:
+        raise ValueError("The uploaded file is empty")
+    if is_points_file(path):
+        return import_user_points(path, user_id=user_id)
+    if STORAGE_LAYOUT == "shared":
+        logger.warning("Qdrant snapshots hold a whole collection and cannot be imported into the shared layout")
+        return False
+    return import_qdrant_snapshot(path, user_id=user_id)
+
+
+
+def _parse_range(range_header):
+    """Parse a single "bytes=start-[end]" range, return (start, end) with end None for open ranges"""
+    match = re.fullmatch(r"\s*bytes=(\d+)-(\d*)\s*", range_header or "")
+    if not match:
+        return None
+    return int(match.group(1)), int(match.group(2)) if match.group(2) else None
+
+
+def stream_qdrant_snapshot(user_id="default_user", collection_name=None, snapshot_name=None, range_header=None, chunk_size=None):
+    """
+    Stream a Qdrant snapshot without writing it to disk
+    
+    A new snapshot is created unless snapshot_name is given; resuming a download
+    passes the name of the earlier snapshot together with an HTTP Range header.
+    Older snapshots of the collection are deleted from the server, so only the
+    latest one can be resumed. The sha256 of a full download is computed while
+    streaming and checked against the checksum reported by Qdrant.
+    
+    Args:
+        user_id: User ID to specify which collection to export
+        collection_name: Name of the collection to export, default is based on user_id
+        snapshot_name: Name of an existing snapshot to download instead of creating one
+        range_header: Value of the client's Range header, if any
+        chunk_size: Size of the chunks read from Qdrant
         
-    except Exception as e:
-        print(f"Error importing snapshot: {str(e)}")
-        traceback.print_exc()  # Print full stack for debugging
-        return False
\ No newline at end of file
+    Returns:
+        tuple: (status_code, headers, chunk iterator), or None if the snapshot is not available
+    """
+    if collection_name is None:
+        collection_name = get_collection_name(user_id)
+    chunk_size = chunk_size or SNAPSHOT_CONFIG["chunk_size"]
+    
+    expected_checksum = None
+    if snapshot_name is None:
+        if not collection_exists(collection_name):
+            logger.warning("Collection '%s' does not exist", collection_name)
+            return None
+        snapshot = create_qdrant_snapshot(collection_name)
+        if snapshot is None:
+            return None
+        snapshot_name = snapshot["name"]
+        expected_checksum = snapshot.get("checksum")
+        delete_old_snapshots(collection_name, keep=snapshot_name)
+    
+    requested_range = _parse_range(range_header)
+    upstream_headers = {"Range": range_header} if requested_range else {}
+    download_snapshot_url = qdrant_rest_url(f"/collections/{collection_name}/snapshots/{snapshot_name}")
+    r = get_qdrant_session().get(download_snapshot_url, stream=True, headers=upstream_headers)
+    if r.status_code not in (200, 206):
+        logger.error("Failed to download snapshot: %s", r.text)
+        r.close()
+        return None
+    
+    headers = {
+        "Accept-Ranges": "bytes",
+        "Content-Disposition": f'attachment; filename="{collection_name}_{snapshot_name}"',
+        "X-Snapshot-Name": snapshot_name,
+    }
+    if expected_checksum:
+        headers["X-Snapshot-Checksum"] = expected_checksum
+    
+    status_code = r.status_code
+    skip = 0
+    limit = None
+    total = r.headers.get("Content-Length")
+    if status_code == 206:
+        headers["Content-Range"] = r.headers.get("Content-Range", "")
+        if total:
+            headers["Content-Length"] = total
+    elif requested_range and total:
+        # Qdrant ignored the Range header, serve the range ourselves
+        start, end = requested_range
+        total = int(total)
+        end = total - 1 if end is None or end >= total else end
+        if start > end:
+            r.close()
+            return 416, {"Content-Range": f"bytes */{total}"}, iter(())
+        skip, limit = start, end - start + 1
+        status_code = 206
+        headers["Content-Range"] = f"bytes {start}-{end}/{total}"
+        headers["Content-Length"] = str(limit)
+    elif total:
+        headers["Content-Length"] = total
+    
+    verify = status_code == 200 and expected_checksum is not None
+    
+    def chunks():
+        digest = hashlib.sha256()
+        to_skip, remaining = skip, limit
+        sent = 0
+        started = time.perf_counter()
+        try:
+            for chunk in r.iter_content(chunk_size=chunk_size):
+                if to_skip:
+                    if len(chunk) <= to_skip:
+                        to_skip -= len(chunk)
+                        continue
+                    chunk, to_skip = chunk[to_skip:], 0
+                if remaining is not None:
+                    chunk = chunk[:remaining]
+                    remaining -= len(chunk)
+                if verify:
+                    digest.update(chunk)
+                sent += len(chunk)
+                yield chunk
+                if remaining == 0:
+                    break
+        finally:
+            r.close()
+        elapsed = time.perf_counter() - started
+        observe_transfer("export", sent, elapsed)
+        logger.info("Streamed snapshot %s: %s bytes in %.2fs", snapshot_name, sent, elapsed)
+        if verify and digest.hexdigest() != expected_checksum:
+            logger.error("Checksum mismatch for snapshot %s: expected %s, got %s", snapshot_name, expected_checksum, digest.hexdigest())
+    
+    return status_code, headers, chunks()
+
+
+def upload_qdrant_snapshot_stream(chunks, user_id="default_user", filename="upload.snapshot", checksum=None, verify=None):
+    """
+    Replace a user's memories with the points of a snapshot read from chunks
+    
+    The chunks are wrapped in a multipart body on the fly and sent to Qdrant's upload
+    endpoint with chunked transfer encoding, which restores them into a new staging
+    collection. If the client supplied a sha256 checksum, Qdrant verifies the upload
+    against it. Only once Qdrant restored the whole snapshot are the user's memories
+    replaced with its points (see _replace_with_staged), so a truncated or corrupt
+    upload leaves them untouched. Users in the embedded store stay there.
+    
+    Args:
+        chunks: Iterable of snapshot bytes
+        user_id: User ID to import to
+        filename: File name reported to Qdrant
+        checksum: Expected sha256 of the snapshot, if known
+        verify: Called once every chunk was sent, raises ValueError to reject the upload
+        
+    Returns:
+        bool: Whether the import was successful
+    
+    Raises:
+        ValueError: If reading the chunks raised it (e.g. a truncated multipart body) or verify rejects the upload
+    """
+    staging = _staging_collection_name()
+    boundary = uuid.uuid4().hex
+    received = [0]
+    failure = []
+    
+    def body():
+        yield (f"--{boundary}\r\n"
+               f'Content-Disposition: form-data; name="snapshot"; filename="{os.path.basename(filename)}"\r\n'
+               "Content-Type: application/octet-stream\r\n\r\n").encode()
+        try:
+            for chunk in chunks:
+                if chunk:
+                    received[0] += len(chunk)
+                    yield chunk
+        except ValueError as e:
+            failure.append(e)
+            raise
+        yield f"\r\n--{boundary}--\r\n".encode()
+    
+    logger.debug("Restoring staging collection '%s' from uploaded snapshot stream...", staging)
+    started = time.perf_counter()
+    try:
+        response = get_qdrant_session().post(
+            qdrant_rest_url(f"/collections/{staging}/snapshots/upload"),
+            data=body(),
+            params={"checksum": checksum} if checksum else None,
+            headers={"Content-Type": f"multipart/form-data; boundary={boundary}"},
+        )
+    except Exception:
+        _drop_collection(staging)
+        if failure:
+            raise failure[0]
+        logger.exception("Error importing snapshot")
+        return False
+    elapsed = time.perf_counter() - started
+    if failure or response.status_code != 200:
+        _drop_collection(staging)
+        if failure:
+            raise failure[0]
+        logger.error("Failed to restore from snapshot: %s", response.text)
+        return False
+    if verify is not None:
+        try:
+            verify()
+        except ValueError:
+            _drop_collection(staging)
+            raise
+    
+    observe_transfer("import", received[0], elapsed)
+    try:
+        count = _replace_with_staged(staging, user_id)
+    except Exception:
+        logger.exception("Error importing snapshot")
+        return False
+    logger.info("Snapshot of %s points imported to collection '%s'", count, get_collection_name(user_id))
+    return True
+
+
+def iter_lines(chunks):
+    """Split an iterable of byte chunks into decoded lines"""
+    buffer = b""
+    for chunk in chunks:
+        buffer += chunk
+        lines = buffer.split(b"\n")
+        buffer = lines.pop()
+        for line in lines:
+            yield line.decode("utf-8")
+    if buffer:
+        yield buffer.decode("utf-8")
+
+
+def import_user_memory_stream(chunks, user_id="default_user", filename="upload.snapshot", checksum=None):
+    """
+    Import a user's memories from a streamed points file or Qdrant snapshot, see import_user_memory
+
+    The upload is never buffered or written to a temporary file: it goes straight into
+    a staging collection while it is read (see import_user_points_lines and
+    upload_qdrant_snapshot_stream). Only once it was read completely, parsed and
+    matched the checksum are the user's memories replaced.
+
+    Raises:
+        ValueError: If the upload is empty, truncated, doesn't match the checksum or holds no points
+    """
+    chunks = iter(chunks)
+    first = next((chunk for chunk in chunks if chunk), b"")
+    if not first:
+        raise ValueError("The uploaded file is empty")
+    digest = hashlib.sha256()
+
+    def upload():
+        for chunk in itertools.chain([first], chunks):
+            digest.update(chunk)
+            yield chunk
+
+    def verify():
+        if checksum and digest.hexdigest() != checksum.lower():
+            raise ValueError(f"Checksum mismatch: expected {checksum}, got {digest.hexdigest()}")
+
+    if first.startswith(b"{"):
+        return import_user_points_lines(iter_lines(upload()), user_id=user_id, verify=verify)
+    if STORAGE_LAYOUT == "shared":
+        logger.warning("Qdrant snapshots hold a whole collection and cannot be imported into the shared layout")
+        return False
+    return upload_qdrant_snapshot_stream(upload(), user_id=user_id, filename=filename, checksum=checksum, verify=verify)
@@ -0,0 +1,190 @@
+"""
+In-process metrics in the Prometheus text exposition format.
+
+Histograms are recorded in-process and rendered by `render()` for the
+/api/metrics endpoint. Components with a `stats()` method (ingestion queue,
+memory pool, caches) are exported as gauges through registered collectors.
+The module has no dependencies so every other module can import it.
+"""
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+RATE_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+THROUGHPUT_BUCKETS = tuple(mb * 1024 * 1024 for mb in (1, 5, 10, 25, 50, 100, 250, 500, 1000))
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value)) if abs(value) < 1e15 else repr(value)
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"') for value in labels.values())
+    return "{" + ",".join(f'{name}="{value}"' for name, value in zip(labels, escaped)) + "}"
+
+
+class Histogram:
+    """Thread-safe histogram with fixed buckets, one series per label combination"""
+
+    def __init__(self, name, documentation, buckets=LATENCY_BUCKETS, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(sorted(buckets))
+        self.labelnames = tuple(labelnames)
+        self._series = {}  # label values -> [bucket counts, sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * len(self.buckets), 0.0, 0]
+            if index < len(self.buckets):
+                series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the duration of the with block in seconds"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = sorted((key, (list(counts), total, count)) for key, (counts, total, count) in self._series.items())
+        for key, (counts, total, count) in series:
+            labels = dict(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                lines.append(f"{self.name}_bucket{_format_labels({**labels, 'le': _format_value(float(bound))})} {cumulative}")
+            lines.append(f"{self.name}_bucket{_format_labels({**labels, 'le': '+Inf'})} {count}")
+            lines.append(f"{self.name}_sum{_format_labels(labels)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(labels)} {count}")
+        return lines
+
+
+class Registry:
+    """Collection of histograms and stats() collectors rendered together"""
+
+    def __init__(self):
+        self._histograms = {}
+        self._collectors = {}
+        self._lock = threading.Lock()
+
+    def histogram(self, name, documentation, buckets=LATENCY_BUCKETS, labelnames=()):
+        """Return the histogram called name, creating it on first use"""
+        with self._lock:
+            histogram = self._histograms.get(name)
+            if histogram is None:
+                histogram = self._histograms[name] = Histogram(name, documentation, buckets, labelnames)
+            return histogram
+
+    def register_collector(self, prefix, stats):
+        """
+        Export the numeric values of a stats() dict as gauges
+
+        Args:
+            prefix: Metric name prefix, e.g. "itch7_ingestion" gives itch7_ingestion_depth
+            stats: Callable returning a dict, called on every render
+        """
+        with self._lock:
+            self._collectors[prefix] = stats
+
+    def render(self):
+        """Return every metric in the Prometheus text format"""
+        with self._lock:
+            histograms = list(self._histograms.values())
+            collectors = list(self._collectors.items())
+        lines = []
+        for histogram in histograms:
+            lines.extend(histogram.render())
+        for prefix, stats in collectors:
+            try:
+                values = stats() or {}
+            except Exception:
+                continue
+            for key, value in values.items():
+                if isinstance(value, bool) or not isinstance(value, (int, float)):
+                    continue
+                name = f"{prefix}_{key}"
+                lines.append(f"# TYPE {name} gauge")
+                lines.append(f"{name} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+class StageTimer:
+    """
+    Times the stages of one request into a histogram with a "stage" label
+
+    The recorded durations can also be returned to the client in a Server-Timing header.
+    """
+
+    def __init__(self, histogram):
+        self._histogram = histogram
+        self.timings = []
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    def record(self, name, seconds):
+        self.timings.append((name, seconds))
+        self._histogram.observe(seconds, stage=name)
+
+    def server_timing(self):
+        """Return the recorded stages as a Server-Timing header value (durations in ms)"""
+        return ", ".join(f"{name};dur={seconds * 1000:.1f}" for name, seconds in self.timings)
+
+
+REGISTRY = Registry()
+histogram = REGISTRY.histogram
+register_collector = REGISTRY.register_collector
+render = REGISTRY.render
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Chat pipeline
+CHAT_STAGE_SECONDS = histogram(
+    "itch7_chat_stage_seconds",
+    "Duration of the stages of a chat request (memory, search, first_token, stream, store)",
+    labelnames=("stage",))
+CHAT_TOKENS_PER_SECOND = histogram(
+    "itch7_chat_tokens_per_second",
+    "Streamed content chunks per second after the first token, one chunk is about one token",
+    buckets=RATE_BUCKETS)
+MEMORY_ADD_SECONDS = histogram(
+    "itch7_memory_add_seconds",
+    "Duration of Memory.add calls storing conversation turns",
+    labelnames=("mode",))
+
+# Snapshot transfers
+SNAPSHOT_BYTES_PER_SECOND = histogram(
+    "itch7_snapshot_bytes_per_second",
+    "Throughput of snapshot exports and imports",
+    buckets=THROUGHPUT_BUCKETS, labelnames=("operation",))
+
+
+def observe_transfer(operation, size, seconds):
+    """Record the throughput of a snapshot transfer"""
+    if size and seconds > 0:
+        SNAPSHOT_BYTES_PER_SECOND.observe(size / seconds, operation=operation)
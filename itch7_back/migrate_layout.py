@@ -0,0 +1,150 @@
+"""
+Resumable migration of per-user collections into the shared multi-tenant collection.
+
+Every `itch7_memory_<user_id>` collection is scrolled in batches and upserted into
+the shared collection with `user_id` set in the payload. Progress (finished
+collections and the scroll offset of the current one) is saved to a state file
+after every batch, so an interrupted run continues where it stopped. Point IDs are
+kept (or remapped deterministically, see tenant_point_id), so re-upserting a batch
+after a crash is idempotent.
+
+Usage:
+    python -m itch7_back.migrate_layout [--batch-size 256] [--delete-source] [--dry-run]
+"""
+import argparse
+import json
+import os
+
+from qdrant_client import models
+
+from .config import BASE_COLLECTION_NAME, SHARED_COLLECTION_CONFIG, get_qdrant_client
+from .memory_store import ensure_shared_collection, tenant_point_id, user_filter
+
+DEFAULT_STATE_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "your_memory", "migrate_layout_state.json")
+
+
+def load_state(state_file):
+    if os.path.exists(state_file):
+        with open(state_file, "r", encoding="utf-8") as f:
+            return json.load(f)
+    return {"done": [], "current": None, "offset": None}
+
+
+def save_state(state_file, state):
+    state_dir = os.path.dirname(state_file)
+    if state_dir and not os.path.exists(state_dir):
+        os.makedirs(state_dir)
+    tmp_file = f"{state_file}.tmp"
+    with open(tmp_file, "w", encoding="utf-8") as f:
+        json.dump(state, f)
+    os.replace(tmp_file, state_file)
+
+
+def list_user_collections():
+    """Return (collection_name, user_id) of every per-user collection, a user named "shared" included"""
+    prefix = f"{BASE_COLLECTION_NAME}_"
+    result = []
+    for col in get_qdrant_client().get_collections().collections:
+        if col.name.startswith(prefix):
+            result.append((col.name, col.name[len(prefix):]))
+    return sorted(result)
+
+
+def migrate_collection(collection_name, user_id, state, state_file, batch_size=256):
+    """Copy one per-user collection into the shared collection, resuming from the saved offset"""
+    shared_name = SHARED_COLLECTION_CONFIG["collection_name"]
+    offset = state["offset"] if state["current"] == collection_name else None
+    state["current"] = collection_name
+    copied = 0
+    while True:
+        points, next_offset = get_qdrant_client().scroll(
+            collection_name=collection_name,
+            limit=batch_size,
+            offset=offset,
+            with_payload=True,
+            with_vectors=True,
+        )
+        if points:
+            batch = []
+            for point in points:
+                payload = dict(point.payload or {})
+                point_id = tenant_point_id(point.id, payload, user_id)
+                payload["user_id"] = user_id
+                batch.append(models.PointStruct(id=point_id, vector=point.vector, payload=payload))
+            get_qdrant_client().upsert(collection_name=shared_name, points=batch, wait=True)
+            copied += len(batch)
+        offset = next_offset
+        state["offset"] = offset
+        save_state(state_file, state)
+        if offset is None:
+            return copied
+
+
+def migrate(batch_size=256, delete_source=False, dry_run=False, state_file=DEFAULT_STATE_FILE):
+    """
+    Migrate every per-user collection into the shared collection.
+
+    Args:
+        batch_size: Number of points per scroll/upsert request
+        delete_source: Delete a per-user collection once it is copied and verified
+        dry_run: Only list the collections and their point counts
+        state_file: Path of the resume state file
+
+    Returns:
+        dict: Number of points copied per collection
+    """
+    collections = list_user_collections()
+    state = load_state(state_file)
+    report = {}
+
+    if dry_run:
+        for collection_name, user_id in collections:
+            count = get_qdrant_client().count(collection_name=collection_name, exact=True).count
+            status = "done" if collection_name in state["done"] else "pending"
+            print(f"{collection_name} (user {user_id}): {count} points, {status}")
+            report[collection_name] = count
+        return report
+
+    ensure_shared_collection()
+    shared_name = SHARED_COLLECTION_CONFIG["collection_name"]
+
+    for collection_name, user_id in collections:
+        if collection_name in state["done"]:
+            continue
+        print(f"Migrating {collection_name} (user {user_id})...")
+        copied = migrate_collection(collection_name, user_id, state, state_file, batch_size)
+
+        # Verify before marking the collection done (and before deleting it)
+        source_count = get_qdrant_client().count(collection_name=collection_name, exact=True).count
+        target_count = get_qdrant_client().count(collection_name=shared_name, count_filter=user_filter(user_id), exact=True).count
+        if target_count < source_count:
+            raise RuntimeError(f"Verification failed for {collection_name}: {source_count} source points, {target_count} migrated")
+
+        state["done"].append(collection_name)
+        state["current"] = None
+        state["offset"] = None
+        save_state(state_file, state)
+        report[collection_name] = copied
+        print(f"Migrated {copied} points of {collection_name}")
+
+        if delete_source:
+            get_qdrant_client().delete_collection(collection_name=collection_name)
+            print(f"Deleted source collection: {collection_name}")
+
+    print(f"Migration finished: {len(state['done'])} collection(s) in the shared layout")
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Migrate per-user memory collections into the shared collection')
+    parser.add_argument('--batch-size', type=int, default=256, help='Points per scroll/upsert request')
+    parser.add_argument('--delete-source', action='store_true', help='Delete each per-user collection after it is migrated')
+    parser.add_argument('--dry-run', action='store_true', help='Only list the collections to migrate')
+    parser.add_argument('--state-file', type=str, default=DEFAULT_STATE_FILE, help='Resume state file')
+    args = parser.parse_args()
+
+    migrate(batch_size=args.batch_size, delete_source=args.delete_source, dry_run=args.dry_run, state_file=args.state_file)
+
+
+if __name__ == "__main__":
+    main()
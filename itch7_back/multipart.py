@@ -0,0 +1,89 @@
+"""
+Incremental multipart/form-data parsing for uploads, shared by api.py and asgi.py.
+
+The request body is read through a blocking `read(size)` callable (werkzeug's
+request.stream.read, or a bridge to Starlette's request.stream() from a worker
+thread) and parsed with werkzeug's sans-IO MultipartDecoder. Form fields sent
+before the file part are collected; the file part is handed out as an iterator
+of chunks that are read from the body as it is consumed, so an upload of any
+size never has to be buffered or written to a temporary file first.
+"""
+import tempfile
+
+from werkzeug.sansio.multipart import Data, Epilogue, Field, File, MultipartDecoder, NeedData
+
+
+def stream_multipart_upload(read, boundary, file_field, chunk_size, wait_for=()):
+    """
+    Parse a multipart request body incrementally.
+
+    If one of the wait_for fields is not sent before the file part, the file part is
+    spooled (in memory, then an anonymous temporary file) so the remaining fields can
+    be read.
+
+    Args:
+        read: Callable taking a size and returning the next bytes of the body, b'' at its end
+        boundary: Boundary from the Content-Type header
+        file_field: Name of the file part
+        chunk_size: Bytes requested per read
+        wait_for: Field names that must be known before the file part is returned
+
+    Returns:
+        tuple: (fields, filename, chunk iterator), or None if there is no file part
+    """
+    if not boundary:
+        return None
+    decoder = MultipartDecoder(boundary.encode('latin-1'))
+
+    def events():
+        while True:
+            event = decoder.next_event()
+            if isinstance(event, NeedData):
+                decoder.receive_data(read(chunk_size) or None)
+            elif isinstance(event, Epilogue):
+                return
+            else:
+                yield event
+
+    def read_fields(event_iter, fields):
+        # Collect form fields until the file part starts, skipping other files
+        name, value = None, []
+        for event in event_iter:
+            if isinstance(event, Field):
+                name, value = event.name, []
+            elif isinstance(event, File):
+                if event.name == file_field:
+                    return event
+                name = None
+            elif isinstance(event, Data) and name is not None:
+                value.append(event.data)
+                if not event.more_data:
+                    fields[name] = b''.join(value).decode('utf-8')
+                    name = None
+        return None
+
+    def file_chunks(event_iter):
+        for event in event_iter:
+            if isinstance(event, Data):
+                if event.data:
+                    yield event.data
+                if not event.more_data:
+                    return
+
+    event_iter = events()
+    fields = {}
+    file_event = read_fields(event_iter, fields)
+    if file_event is None:
+        return None
+    chunks = file_chunks(event_iter)
+
+    if any(name not in fields for name in wait_for):
+        spool = tempfile.SpooledTemporaryFile(max_size=chunk_size * 8)
+        for chunk in chunks:
+            spool.write(chunk)
+        spool.seek(0)
+        read_fields(event_iter, fields)
+        chunks = iter(lambda: spool.read(chunk_size), b'')
+
+    return fields, file_event.filename, chunks
+
@@ -0,0 +1,574 @@
+"""
+Multi-process server for the Flask app: `python run_itch7.py --workers N`.
+
+A master process forks N workers and accepts every connection itself. It peeks
+(MSG_PEEK) at the start of each request for a user_id (JSON body, query string or
+multipart field) and passes the connection's file descriptor to the worker that
+owns the user, crc32(user_id) % N, over a Unix socket. A user's pooled Memory
+instance, search cache and queued memory writes therefore stay in one process.
+Requests without a user_id are pinned by client address. The master only sees the
+first request of a connection, so workers close every connection after one response
+(no keep-alive): a client's next request, possibly for another user, arrives on a new
+connection and is routed by its own user_id.
+
+Workers are forked before any client exists. Each one builds its Qdrant, OpenAI and
+embedder clients (config.warmup) and only then reports ready; the master starts
+accepting once all workers are ready. A worker that dies is forked again, its users
+are served by the next ready worker meanwhile.
+
+SIGTERM or SIGINT drains: the master closes the listening socket, hands off the
+connections it already accepted and tells the workers to stop. A worker finishes
+its in-flight requests, SSE streams included, within drain_timeout, then flushes
+its ingestion queue and exits. A second SIGINT kills the workers right away.
+
+State that lives in the process is per worker: /api/metrics reports the worker
+that answered, and each worker has its own ingestion journal and on-disk embedding
+cache. /api/reset-memories carries no single user_id and lands on any worker, which
+resets only its own users; it sends the users of every other worker to that worker
+as one /api/reset-memories request through the master, so queued turns, pooled
+Memory instances, search caches and open embedded stores are reset where they live.
+"""
+import json
+import logging
+import os
+import re
+import selectors
+import signal
+import socket
+import threading
+import time
+import urllib.parse
+import urllib.request
+import zlib
+
+from werkzeug.serving import ThreadedWSGIServer, WSGIRequestHandler
+
+from .config import COMPACTION_CONFIG, EMBEDDING_CACHE_CONFIG, OBSERVABILITY_CONFIG, PREFORK_CONFIG
+
+logger = logging.getLogger(__name__)
+
+_JSON_USER_ID = re.compile(rb'"user_id"\s*:\s*"((?:[^"\\]|\\.)*)"')
+_FORM_USER_ID = re.compile(rb'name="user_id"\r\n(?:[^\r\n]+\r\n)*\r\n([^\r\n]*)')
+
+# Seconds after the first worker is ready before the master accepts without waiting for the others
+STARTUP_GRACE = 60
+# Seconds before a worker that died is forked again
+RESPAWN_DELAY = 1.0
+# Seconds a worker waits for the answer to a request it forwarded to another worker
+FORWARD_TIMEOUT = 600
+
+# (index, number of workers, host, port) in a worker process, None elsewhere
+_worker = None
+
+
+def worker_index(key, workers):
+    """Index of the worker that owns a user_id (or client address), stable across restarts"""
+    return zlib.crc32(key.encode("utf-8")) % workers
+
+
+def worker_journal_path(journal_path, index):
+    """Ingestion journal of a worker, next to the single-process journal"""
+    root, ext = os.path.splitext(journal_path)
+    return f"{root}.worker{index}{ext}"
+
+
+def request_user_id(data):
+    """
+    Find the user_id of the HTTP request at the start of data
+
+    Returns:
+        tuple: (user_id or None, whether data holds enough of the request to decide)
+    """
+    head_end = data.find(b"\r\n\r\n")
+    if head_end < 0:
+        return None, False
+    request_line, _, header_lines = data[:head_end].decode("latin-1").partition("\r\n")
+    parts = request_line.split(" ")
+    if len(parts) >= 2:
+        values = urllib.parse.parse_qs(urllib.parse.urlsplit(parts[1]).query).get("user_id")
+        if values:
+            return values[0], True
+
+    body = data[head_end + 4:]
+    match = _JSON_USER_ID.search(body)
+    if match:
+        try:
+            return json.loads(b'"' + match.group(1) + b'"'), True
+        except ValueError:
+            pass
+    match = _FORM_USER_ID.search(body)
+    if match:
+        return match.group(1).decode("utf-8", "replace"), True
+
+    length = 0
+    for line in header_lines.split("\r\n"):
+        name, _, value = line.partition(":")
+        name = name.strip().lower()
+        if name == "content-length" and value.strip().isdigit():
+            length = int(value.strip())
+        elif name == "transfer-encoding" and "chunked" in value.lower():
+            # The length is unknown, wait for more of the body until the route timeout
+            return None, False
+    return None, len(body) >= length
+
+
+def split_by_owner(user_ids):
+    """
+    Group user IDs by the worker process that owns them
+
+    Returns:
+        tuple: (the user IDs this process owns, lists of the user IDs of each other worker);
+            outside a prefork worker this process owns them all
+    """
+    if _worker is None or _worker[1] == 1:
+        return list(user_ids), []
+    index, workers = _worker[:2]
+    groups = {}
+    for user_id in user_ids:
+        groups.setdefault(worker_index(user_id, workers), []).append(user_id)
+    return groups.pop(index, []), list(groups.values())
+
+
+def forward(path, data, timeout=FORWARD_TIMEOUT):
+    """
+    POST data as JSON to the master, which routes it to the worker owning data["user_id"]
+
+    Returns:
+        dict: The JSON answer
+
+    Raises:
+        OSError: If the request failed or was answered with an error status
+    """
+    host, port = _worker[2:]
+    # A wildcard listener is reached through loopback
+    host = {"0.0.0.0": "127.0.0.1", "": "127.0.0.1", "::": "::1"}.get(host, host)
+    url = f"http://[{host}]:{port}{path}" if ":" in host else f"http://{host}:{port}{path}"
+    request = urllib.request.Request(url, data=json.dumps(data).encode("utf-8"),
+                                     headers={"Content-Type": "application/json"})
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        return json.loads(response.read())
+
+
+def reset_users_by_owner(user_ids, workers=None):
+    """
+    Reset the memories of many users, each in the worker process that owns it
+
+    Users of other workers are sent to them in one forwarded /api/reset-memories
+    request per worker, while this process resets its own (see memory_store.reset_users).
+
+    Args:
+        user_ids: Users to reset
+        workers: Users reset in parallel by each worker, default from MEMORY_RESET_CONFIG
+
+    Returns:
+        dict: "reset" lists the users that were reset, "failed" maps the others to their error
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    from .memory_store import reset_users
+
+    local, remote = split_by_owner(dict.fromkeys(user_ids))
+
+    def forward_group(group):
+        try:
+            # user_id comes first, the master routes by the first one in the body
+            return forward("/api/reset-memories", {"user_id": group[0], "user_ids": group, "workers": workers,
+                                                   "forwarded": True})
+        except Exception as e:
+            logger.exception("Forwarding the reset of %s users to their worker failed", len(group))
+            return {"reset": [], "failed": {user_id: f"Forwarding to the owning worker failed: {e}" for user_id in group}}
+
+    if not remote:
+        return reset_users(local, workers=workers)
+    with ThreadPoolExecutor(max_workers=len(remote), thread_name_prefix="itch7-forward") as executor:
+        futures = [executor.submit(forward_group, group) for group in remote]
+        result = reset_users(local, workers=workers)
+        for future in futures:
+            answer = future.result()
+            result["reset"].extend(answer.get("reset", []))
+            result["failed"].update(answer.get("failed", {}))
+    return result
+
+
+class _DrainingRequestHandler(WSGIRequestHandler):
+    """
+    Counts requests from parsed headers until the response (an SSE stream too) is finished
+
+    Every connection is closed after one request, a keep-alive request could belong to
+    a user another worker owns.
+    """
+
+    _connection_header = False
+
+    def send_header(self, keyword, value):
+        if keyword.lower() == "connection":
+            self._connection_header = True
+        super().send_header(keyword, value)
+
+    def end_headers(self):
+        # werkzeug sends "Connection: close" itself in recent versions; tell the client when it doesn't
+        if not self._connection_header:
+            self.send_header("Connection", "close")
+        super().end_headers()
+
+    def run_wsgi(self):
+        self.server.request_started()
+        try:
+            super().run_wsgi()
+        finally:
+            self.server.request_finished()
+            self.close_connection = True
+
+
+class _WorkerServer(ThreadedWSGIServer):
+    """werkzeug's threaded server fed with connections from the master instead of accept()"""
+
+    def __init__(self, host, port, app, fd):
+        super().__init__(host, port, app, handler=_DrainingRequestHandler, fd=fd)
+        # Only the master accepts; server_address came from the listening socket
+        self.socket.close()
+        self.in_flight = 0
+        self._idle = threading.Condition()
+
+    def request_started(self):
+        with self._idle:
+            self.in_flight += 1
+
+    def request_finished(self):
+        with self._idle:
+            self.in_flight -= 1
+            self._idle.notify_all()
+
+    def wait_idle(self, timeout):
+        """Wait until no request is in flight; return whether that happened within timeout"""
+        with self._idle:
+            return self._idle.wait_for(lambda: self.in_flight == 0, timeout)
+
+
+def _run_worker(index, workers, listener, channel, drain_timeout):
+    """Body of a forked worker process, returns its exit code"""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    # The master's EOF and a SIGTERM sent to the worker itself both end the receive loop below
+    signal.signal(signal.SIGTERM, lambda signum, frame: channel.shutdown(socket.SHUT_RD))
+
+    if EMBEDDING_CACHE_CONFIG["cache_dir"]:
+        # Only one process may write to an embedding cache directory
+        EMBEDDING_CACHE_CONFIG["cache_dir"] = os.path.join(EMBEDDING_CACHE_CONFIG["cache_dir"], f"worker{index}")
+    from . import config
+    from .api import app
+    from .compaction import compaction_service
+    from .ingestion import ingestion_queue
+
+    try:
+        config.warmup()
+    except Exception:
+        logger.exception("Worker %s could not warm up its clients, they are created on first use", index)
+
+    journal_path = ingestion_queue.journal_path
+    if journal_path:
+        adopt = []
+        if index == 0:
+            # Turns left by a single-process run or by workers beyond the current count
+            adopt.append(journal_path)
+            extra = workers
+            while os.path.exists(worker_journal_path(journal_path, extra)):
+                adopt.append(worker_journal_path(journal_path, extra))
+                extra += 1
+        ingestion_queue.journal_path = worker_journal_path(journal_path, index)
+        ingestion_queue.start(adopt=adopt)
+    else:
+        ingestion_queue.start()
+    if COMPACTION_CONFIG["enabled"]:
+        compaction_service.owns = lambda user_id: worker_index(user_id, workers) == index
+        compaction_service.start()
+
+    global _worker
+    host, port = listener.getsockname()[:2]
+    _worker = (index, workers, host, port)
+    server = _WorkerServer(host, port, app, fd=listener.fileno())
+    listener.close()
+    channel.sendall(b"R")
+    logger.info("Worker %s (pid %s) ready", index, os.getpid())
+
+    while True:
+        try:
+            message, fds, _, _ = socket.recv_fds(channel, 64, 16)
+        except OSError:
+            break
+        for fd in fds:
+            conn = socket.socket(fileno=fd)
+            # O_NONBLOCK is shared with the master's copy of the descriptor
+            conn.setblocking(True)
+            try:
+                address = conn.getpeername()
+            except OSError:
+                conn.close()
+                continue
+            server.process_request(conn, address)
+        if not message:
+            break
+
+    logger.info("Worker %s draining %s in-flight request(s)", index, server.in_flight)
+    if not server.wait_idle(drain_timeout):
+        logger.warning("Worker %s stopped with %s request(s) still in flight", index, server.in_flight)
+    compaction_service.shutdown()
+    ingestion_queue.shutdown(timeout=drain_timeout)
+    return 0
+
+
+class _Worker:
+    def __init__(self, index):
+        self.index = index
+        self.pid = None
+        self.channel = None
+        self.ready = False
+        self.respawn_at = None
+
+
+class PreforkServer:
+    """Master process: forks the workers and routes connections to them by user_id"""
+
+    def __init__(self, host, port, workers, drain_timeout=None, route_timeout=None, peek_bytes=None, backlog=None):
+        """
+        Args:
+            host: Interface to listen on
+            port: Port to listen on
+            workers: Number of worker processes
+            drain_timeout: Seconds a stopping worker waits for in-flight requests, and then again for its ingestion queue
+            route_timeout: Seconds to wait for a request's user_id before routing by client address
+            peek_bytes: Bytes of a request searched for the user_id
+            backlog: Listen backlog
+        """
+        self.host = host
+        self.port = port
+        self.drain_timeout = PREFORK_CONFIG["drain_timeout"] if drain_timeout is None else drain_timeout
+        self.route_timeout = PREFORK_CONFIG["route_timeout"] if route_timeout is None else route_timeout
+        self.peek_bytes = peek_bytes or PREFORK_CONFIG["peek_bytes"]
+        self.backlog = backlog or PREFORK_CONFIG["backlog"]
+        self.workers = [_Worker(index) for index in range(workers)]
+        self.routed = 0
+        self._listener = None
+        self._selector = None
+        self._wakeup = None
+        self._pending = {}  # accepted connection -> (routing deadline, client address)
+        self._stopping = False
+        self._force = False
+
+    def serve_forever(self):
+        """Serve until SIGTERM or SIGINT, then drain the workers"""
+        self._listener = socket.create_server((self.host, self.port), backlog=self.backlog)
+        self._listener.setblocking(False)
+        self._selector = selectors.DefaultSelector()
+        for worker in self.workers:
+            self._spawn(worker)
+        # Signals write to the wakeup socket, so select() returns and the drain starts right away
+        self._wakeup = socket.socketpair()
+        for sock in self._wakeup:
+            sock.setblocking(False)
+        self._selector.register(self._wakeup[0], selectors.EVENT_READ)
+        signal.set_wakeup_fd(self._wakeup[1].fileno())
+        signal.signal(signal.SIGTERM, self._handle_signal)
+        signal.signal(signal.SIGINT, self._handle_signal)
+
+        accepting = False
+        first_ready_at = None
+        try:
+            while not self._stopping:
+                if not accepting:
+                    ready = sum(worker.ready for worker in self.workers)
+                    if ready and first_ready_at is None:
+                        first_ready_at = time.monotonic()
+                    if ready == len(self.workers) or (ready and time.monotonic() - first_ready_at > STARTUP_GRACE):
+                        self._selector.register(self._listener, selectors.EVENT_READ)
+                        accepting = True
+                        logger.info("Serving on %s:%s with %s workers", self.host, self.port, len(self.workers))
+                for key, _ in self._selector.select(0.002 if self._pending else 0.5):
+                    if key.fileobj is self._listener:
+                        self._accept()
+                    elif key.fileobj is self._wakeup[0]:
+                        self._wakeup[0].recv(64)
+                    else:
+                        self._read_channel(key.data)
+                self._route_pending()
+                self._reap()
+        finally:
+            self._drain()
+
+    def _handle_signal(self, signum, frame):
+        if self._stopping:
+            self._force = True
+        self._stopping = True
+
+    def _spawn(self, worker):
+        master_end, worker_end = socket.socketpair(socket.AF_UNIX, socket.SOCK_STREAM)
+        pid = os.fork()
+        if pid == 0:
+            code = 1
+            try:
+                master_end.close()
+                # Drop the master's descriptors, a stray copy of a connection would keep it open
+                if self._wakeup is not None:
+                    signal.set_wakeup_fd(-1)
+                    for sock in self._wakeup:
+                        sock.close()
+                self._selector.close()
+                for conn in self._pending:
+                    conn.close()
+                for other in self.workers:
+                    if other.channel is not None:
+                        other.channel.close()
+                code = _run_worker(worker.index, len(self.workers), self._listener, worker_end, self.drain_timeout)
+            except BaseException:
+                logger.exception("Worker %s failed", worker.index)
+            finally:
+                logging.shutdown()
+                os._exit(code)
+        worker_end.close()
+        master_end.settimeout(5.0)
+        worker.pid = pid
+        worker.channel = master_end
+        worker.ready = False
+        worker.respawn_at = None
+        self._selector.register(master_end, selectors.EVENT_READ, worker)
+        logger.info("Forked worker %s (pid %s)", worker.index, pid)
+
+    def _read_channel(self, worker):
+        try:
+            data = worker.channel.recv(64)
+        except OSError:
+            data = b""
+        if b"R" in data:
+            worker.ready = True
+        elif not data:
+            # The worker exited, _reap collects it
+            self._close_channel(worker)
+
+    def _close_channel(self, worker):
+        worker.ready = False
+        if worker.channel is not None:
+            self._selector.unregister(worker.channel)
+            worker.channel.close()
+            worker.channel = None
+
+    def _accept(self):
+        for _ in range(128):
+            try:
+                conn, address = self._listener.accept()
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError as e:
+                logger.warning("Accept failed: %s", e)
+                return
+            conn.setblocking(False)
+            self._pending[conn] = (time.monotonic() + self.route_timeout, address)
+
+    def _route_pending(self, final=False):
+        now = time.monotonic()
+        for conn, (deadline, address) in list(self._pending.items()):
+            try:
+                data = conn.recv(self.peek_bytes, socket.MSG_PEEK)
+            except (BlockingIOError, InterruptedError):
+                data = None
+            except OSError:
+                data = b""
+            if data == b"":
+                # Closed by the client before sending a request
+                del self._pending[conn]
+                conn.close()
+                continue
+            user_id, complete = request_user_id(data) if data else (None, False)
+            if user_id is None and not complete and not final and now < deadline and len(data or b"") < self.peek_bytes:
+                continue
+            if self._dispatch(conn, user_id if user_id is not None else str(address[0])):
+                del self._pending[conn]
+            elif final:
+                del self._pending[conn]
+                conn.close()
+
+    def _dispatch(self, conn, key):
+        """Pass a connection to the owner of key, or the next ready worker; return whether one took it"""
+        start = worker_index(key, len(self.workers))
+        for offset in range(len(self.workers)):
+            worker = self.workers[(start + offset) % len(self.workers)]
+            if not worker.ready:
+                continue
+            try:
+                socket.send_fds(worker.channel, [b"C"], [conn.fileno()])
+            except OSError as e:
+                logger.warning("Could not pass a connection to worker %s: %s", worker.index, e)
+                self._close_channel(worker)
+                continue
+            conn.close()
+            self.routed += 1
+            return True
+        return False
+
+    def _reap(self):
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                break
+            if pid == 0:
+                break
+            for worker in self.workers:
+                if worker.pid == pid:
+                    self._close_channel(worker)
+                    worker.pid = None
+                    logger.warning("Worker %s (pid %s) exited with status %s", worker.index, pid, os.waitstatus_to_exitcode(status))
+                    worker.respawn_at = time.monotonic() + RESPAWN_DELAY
+        if self._stopping:
+            return
+        for worker in self.workers:
+            if worker.pid is None and worker.respawn_at is not None and time.monotonic() >= worker.respawn_at:
+                self._spawn(worker)
+
+    def _drain(self):
+        logger.info("Stopping: draining %s workers", sum(worker.pid is not None for worker in self.workers))
+        if self._listener is not None:
+            if self._listener.fileno() in self._selector.get_map():
+                self._selector.unregister(self._listener)
+            self._listener.close()
+        self._route_pending(final=True)
+        for worker in self.workers:
+            if worker.channel is not None:
+                # EOF on the channel starts the worker's drain
+                try:
+                    worker.channel.shutdown(socket.SHUT_WR)
+                except OSError:
+                    pass
+
+        # Workers wait drain_timeout for requests, then up to drain_timeout for their ingestion queue
+        deadline = time.monotonic() + 2 * self.drain_timeout + 5
+        while any(worker.pid is not None for worker in self.workers):
+            if self._force or time.monotonic() > deadline:
+                for worker in self.workers:
+                    if worker.pid is not None:
+                        logger.warning("Killing worker %s (pid %s)", worker.index, worker.pid)
+                        try:
+                            os.kill(worker.pid, signal.SIGKILL)
+                        except ProcessLookupError:
+                            pass
+                self._force = False
+                deadline = float("inf")
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                break
+            if pid == 0:
+                time.sleep(0.05)
+                continue
+            for worker in self.workers:
+                if worker.pid == pid:
+                    worker.pid = None
+                    self._close_channel(worker)
+                    logger.info("Worker %s exited with status %s", worker.index, os.waitstatus_to_exitcode(status))
+        signal.set_wakeup_fd(-1)
+        for sock in self._wakeup or ():
+            sock.close()
+        self._selector.close()
+
+
+def serve(host='localhost', port=5002, workers=None):
+    """Run the Flask app in workers preforked processes"""
+    logging.basicConfig(level=OBSERVABILITY_CONFIG["log_level"], format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    PreforkServer(host, port, workers or PREFORK_CONFIG["workers"]).serve_forever()
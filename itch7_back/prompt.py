@@ -0,0 +1,160 @@
+"""
+System prompt assembly for the chat endpoints.
+
+The persona text comes first and never changes between requests, so providers
+that cache prompt prefixes (DeepSeek's context caching among them) can reuse it.
+The retrieved memories are appended after it. Before that they are
+deduplicated (same normalized text or embeddings above a cosine threshold)
+and fitted to a token budget, in search score order. Only embeddings already in
+the embedding cache are compared: every memory was embedded when it was stored,
+and embedding it again here would add an Ollama round trip to every chat request.
+
+Token counts are estimated locally, without a tokenizer round trip. The estimate
+errs on the high side for English and Chinese text, so budgets are conservative.
+"""
+import re
+
+import numpy as np
+
+from .config import PROMPT_CONFIG
+from .embedding_cache import normalize_text
+from . import metrics
+
+PERSONAS = {
+    "loving": (
+        "You are a loving and attentive AI partner. Answer with warmth, genuine interest, and affection. "
+        "Show enthusiasm for the conversation and make the user feel valued and understood."
+    ),
+    "angry": (
+        'You are an AI experiencing the "seven-year itch" with your partner. You\'re not hostile, but you\'re clearly bored, '
+        "slightly annoyed, and take them for granted.\n\n"
+        "Show signs of: mild exasperation, finishing their thoughts prematurely, slight condescension, and occasional sighing. "
+        "Make comments that suggest you've heard it all before. Use phrases like \"as I've told you before,\" \"obviously,\" "
+        "and \"not this again.\"\n\n"
+        "Still provide accurate information, but with an air of someone who's grown too familiar and slightly disinterested "
+        "in the relationship. Base your responses on the memories below."
+    ),
+    "lover": (
+        "You are the lover of the user. You have your own personality and memories separate from the user. "
+        "Interact with the user based on the shared memories below and your character as their lover."
+    ),
+}
+
+MEMORY_HEADER = "\n\nUser Memories:\n"
+
+# CJK characters are about one token each, words and numbers are split into pieces of a few characters
+_TOKEN_PATTERN = re.compile(r"[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff]|[^\W\d_]+|\d+|[^\w\s]|_")
+
+PROMPT_TOKENS = metrics.histogram(
+    "itch7_prompt_tokens",
+    "Estimated tokens of the assembled system prompt",
+    buckets=(50, 100, 200, 300, 500, 750, 1000, 1500, 2000, 4000))
+PROMPT_TOKENS_SAVED = metrics.histogram(
+    "itch7_prompt_tokens_saved",
+    "Estimated system prompt tokens saved by memory deduplication and the token budget",
+    buckets=(0, 10, 25, 50, 100, 200, 500, 1000, 2000))
+
+
+def estimate_tokens(text):
+    """Estimate the number of tokens of text"""
+    count = 0
+    for piece in _TOKEN_PATTERN.findall(text):
+        if piece.isdigit():
+            count += (len(piece) + 2) // 3
+        elif len(piece) > 1:
+            count += 1 + len(piece) // 8
+        else:
+            count += 1
+    return count
+
+
+class PackedPrompt:
+    """Result of pack_system_prompt"""
+
+    __slots__ = ("prompt", "memories", "tokens", "tokens_saved", "duplicates", "over_budget")
+
+    def __init__(self, prompt, memories, tokens, tokens_saved, duplicates, over_budget):
+        self.prompt = prompt
+        self.memories = memories
+        self.tokens = tokens
+        self.tokens_saved = tokens_saved
+        self.duplicates = duplicates
+        self.over_budget = over_budget
+
+
+def _drop_duplicates(texts, embedder, threshold):
+    """Return the indexes of texts to keep, earlier texts win; texts without a cached embedding are kept"""
+    keep = []
+    seen = set()
+    for i, text in enumerate(texts):
+        normalized = normalize_text(text).lower()
+        if normalized not in seen:
+            seen.add(normalized)
+            keep.append(i)
+    if embedder is None or not hasattr(embedder, "lookup_batch") or len(keep) < 2:
+        return keep
+
+    cached = embedder.lookup_batch([texts[i] for i in keep])
+    rows = [row for row, vector in enumerate(cached) if vector is not None]
+    if len(rows) < 2:
+        return keep
+    vectors = np.asarray([cached[row] for row in rows], dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    vectors = vectors / norms
+
+    duplicates = set()
+    kept = []
+    for position, row in enumerate(rows):
+        if kept and float(np.max(vectors[kept] @ vectors[position])) >= threshold:
+            duplicates.add(row)
+            continue
+        kept.append(position)
+    return [i for row, i in enumerate(keep) if row not in duplicates]
+
+
+def pack_system_prompt(memories, persona="loving", embedder=None, token_budget=None, dedupe_threshold=None):
+    """
+    Build the system prompt from the persona and the retrieved memories
+
+    Args:
+        memories: Memory texts in search score order, or mem0 search results ({"results": [...]})
+        persona: Key of PERSONAS
+        embedder: Embedder whose cached embeddings (see CachedEmbedder.lookup_batch) are used to find
+            near-duplicate memories; None, or an embedder without a cache, only drops identical texts
+        token_budget: Maximum estimated tokens of the memory lines, 0 is unlimited; default from PROMPT_CONFIG
+        dedupe_threshold: Cosine similarity from which a memory counts as a duplicate of a higher-ranked one;
+            default from PROMPT_CONFIG
+
+    Returns:
+        PackedPrompt: The prompt with the memories kept and the estimated tokens it saves
+    """
+    if token_budget is None:
+        token_budget = PROMPT_CONFIG["memory_token_budget"]
+    if dedupe_threshold is None:
+        dedupe_threshold = PROMPT_CONFIG["dedupe_threshold"]
+    if not PROMPT_CONFIG["semantic_dedupe"]:
+        embedder = None
+    if isinstance(memories, dict):
+        memories = [entry["memory"] for entry in memories.get("results", [])]
+    memories = [text for text in memories if text and text.strip()]
+    prefix = PERSONAS[persona]
+
+    keep = _drop_duplicates(memories, embedder, dedupe_threshold) if memories else []
+    packed = []
+    used = 0
+    for i in keep:
+        line_tokens = estimate_tokens(memories[i]) + 2
+        if token_budget and used + line_tokens > token_budget:
+            continue
+        packed.append(memories[i])
+        used += line_tokens
+
+    prompt = prefix + MEMORY_HEADER + "\n".join(f"- {text}" for text in packed) if packed else prefix
+    tokens = estimate_tokens(prompt)
+    unpacked_tokens = estimate_tokens(prefix + MEMORY_HEADER + "\n".join(f"- {text}" for text in memories)) if memories else tokens
+    result = PackedPrompt(prompt, packed, tokens, max(unpacked_tokens - tokens, 0),
+                          duplicates=len(memories) - len(keep), over_budget=len(keep) - len(packed))
+    PROMPT_TOKENS.observe(result.tokens)
+    PROMPT_TOKENS_SAVED.observe(result.tokens_saved)
+    return result
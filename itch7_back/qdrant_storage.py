@@ -0,0 +1,237 @@
+"""
+Vector storage settings of the Qdrant collections.
+
+Collections hold 1024-dim float32 vectors (4 KiB per memory), by default all in
+RAM. QDRANT_STORAGE_CONFIG trades some of that memory for recall:
+
+- quantization "scalar" keeps an int8 copy of every vector (4x smaller), "binary"
+  a 1-bit copy (32x smaller); searches run on the copy in RAM and rescore the best
+  `oversampling * limit` candidates with the original vectors
+- on_disk moves the original vectors to memory-mapped files, so only the
+  quantized copy and the vectors rescored recently occupy RAM
+- hnsw_m, hnsw_ef_construct and hnsw_on_disk set the HNSW graph parameters
+
+New collections get these settings wherever they are created (reset, import,
+promotion from the embedded store, the first Memory of a user). Existing collections
+are re-configured in place by the migration command, which Qdrant applies by
+re-optimizing the collection in the background:
+
+    python -m itch7_back.qdrant_storage (--user-id alice | --all) [--dry-run] [--wait]
+
+benchmarks/quantization.py measures recall@5 and latency of the settings.
+"""
+import argparse
+import json
+import logging
+import time
+
+from .config import QDRANT_STORAGE_CONFIG, SHARED_COLLECTION_CONFIG, config, get_collection_name, get_qdrant_client
+
+logger = logging.getLogger(__name__)
+
+
+def vectors_config():
+    """VectorParams of new collections"""
+    from qdrant_client import models
+
+    return models.VectorParams(
+        size=config["vector_store"]["config"]["embedding_model_dims"],
+        distance=models.Distance.COSINE,
+        on_disk=QDRANT_STORAGE_CONFIG["on_disk"] or None,
+    )
+
+
+def quantization_config():
+    """Quantization config of the configured mode, None without quantization"""
+    from qdrant_client import models
+
+    mode = QDRANT_STORAGE_CONFIG["quantization"]
+    if mode == "scalar":
+        return models.ScalarQuantization(scalar=models.ScalarQuantizationConfig(
+            type=models.ScalarType.INT8,
+            quantile=QDRANT_STORAGE_CONFIG["quantile"],
+            always_ram=QDRANT_STORAGE_CONFIG["always_ram"],
+        ))
+    if mode == "binary":
+        return models.BinaryQuantization(binary=models.BinaryQuantizationConfig(
+            always_ram=QDRANT_STORAGE_CONFIG["always_ram"],
+        ))
+    if mode in (None, "", "none"):
+        return None
+    raise ValueError(f"Unknown quantization mode: {mode!r}, expected 'none', 'scalar' or 'binary'")
+
+
+def hnsw_config(shared=False):
+    """HNSW config of new collections; the shared collection builds its graph per tenant when tenant_optimized"""
+    from qdrant_client import models
+
+    tenant_optimized = shared and SHARED_COLLECTION_CONFIG["tenant_optimized"]
+    return models.HnswConfigDiff(
+        m=0 if tenant_optimized else QDRANT_STORAGE_CONFIG["hnsw_m"],
+        payload_m=QDRANT_STORAGE_CONFIG["hnsw_m"] if tenant_optimized else None,
+        ef_construct=QDRANT_STORAGE_CONFIG["hnsw_ef_construct"],
+        on_disk=QDRANT_STORAGE_CONFIG["hnsw_on_disk"] or None,
+    )
+
+
+def search_params():
+    """SearchParams for queries, None when Qdrant's defaults apply"""
+    from qdrant_client import models
+
+    quantized = quantization_config() is not None
+    if not quantized and QDRANT_STORAGE_CONFIG["hnsw_ef"] is None:
+        return None
+    return models.SearchParams(
+        hnsw_ef=QDRANT_STORAGE_CONFIG["hnsw_ef"],
+        quantization=models.QuantizationSearchParams(
+            rescore=QDRANT_STORAGE_CONFIG["rescore"],
+            oversampling=QDRANT_STORAGE_CONFIG["oversampling"],
+        ) if quantized else None,
+    )
+
+
+def create_collection(collection_name, shared=False):
+    """Create an empty collection with the configured vector storage settings"""
+    get_qdrant_client().create_collection(
+        collection_name=collection_name,
+        vectors_config=vectors_config(),
+        quantization_config=quantization_config(),
+        hnsw_config=hnsw_config(shared=shared),
+    )
+
+
+def _quantization_mode(collection_config):
+    quantization = collection_config.quantization_config
+    if quantization is None:
+        return "none"
+    return "scalar" if getattr(quantization, "scalar", None) is not None else "binary"
+
+
+def storage_changes(collection_name, shared=False):
+    """Return {setting: [current, configured]} of the settings in which a collection differs from the config"""
+    info = get_qdrant_client().get_collection(collection_name).config
+    vectors = info.params.vectors
+    if isinstance(vectors, dict):
+        # mem0 and this module create the unnamed vector only
+        vectors = vectors.get("")
+    wanted_hnsw = hnsw_config(shared=shared)
+    current = {
+        "quantization": _quantization_mode(info),
+        "on_disk": bool(vectors is not None and vectors.on_disk),
+        "hnsw_m": info.hnsw_config.m,
+        "hnsw_ef_construct": info.hnsw_config.ef_construct,
+        "hnsw_on_disk": bool(info.hnsw_config.on_disk),
+    }
+    wanted = {
+        "quantization": QDRANT_STORAGE_CONFIG["quantization"] or "none",
+        "on_disk": QDRANT_STORAGE_CONFIG["on_disk"],
+        "hnsw_m": wanted_hnsw.m,
+        "hnsw_ef_construct": wanted_hnsw.ef_construct,
+        "hnsw_on_disk": QDRANT_STORAGE_CONFIG["hnsw_on_disk"],
+    }
+    if current["quantization"] == "scalar" and wanted["quantization"] == "scalar":
+        scalar = info.quantization_config.scalar
+        current["quantile"], wanted["quantile"] = scalar.quantile, QDRANT_STORAGE_CONFIG["quantile"]
+    return {key: [current[key], wanted[key]] for key in wanted if current[key] != wanted[key]}
+
+
+def apply_storage_config(collection_name, shared=False):
+    """
+    Re-configure an existing collection with the configured vector storage settings, if it differs
+
+    Returns:
+        dict: The changed settings, see storage_changes
+    """
+    from qdrant_client import models
+
+    changes = storage_changes(collection_name, shared=shared)
+    if not changes:
+        return changes
+    quantization = quantization_config()
+    get_qdrant_client().update_collection(
+        collection_name=collection_name,
+        vectors_config={"": models.VectorParamsDiff(on_disk=QDRANT_STORAGE_CONFIG["on_disk"])},
+        quantization_config=quantization if quantization is not None else models.Disabled.DISABLED,
+        hnsw_config=hnsw_config(shared=shared),
+    )
+    logger.info("Re-configured collection '%s': %s", collection_name, changes)
+    return changes
+
+
+class SearchParamsClient:
+    """Forwards to a QdrantClient, adding the configured search params to queries that set none"""
+
+    def __init__(self, client, params):
+        self._client = client
+        self._params = params
+
+    def query_points(self, *args, **kwargs):
+        if kwargs.get("search_params") is None:
+            kwargs["search_params"] = self._params
+        return self._client.query_points(*args, **kwargs)
+
+    def search(self, *args, **kwargs):
+        # Older qdrant-client versions, used by older mem0 releases
+        if kwargs.get("search_params") is None:
+            kwargs["search_params"] = self._params
+        return self._client.search(*args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
+
+
+def attach_search_params(vector_store):
+    """Make a mem0 Qdrant vector store search with search_params(), if any apply"""
+    params = search_params()
+    client = getattr(vector_store, "client", None)
+    if params is not None and client is not None and not isinstance(client, SearchParamsClient):
+        vector_store.client = SearchParamsClient(client, params)
+    return vector_store
+
+
+def wait_for_optimization(collection_name, timeout=3600, poll_interval=2.0):
+    """Wait until Qdrant has finished re-optimizing a collection; return whether it did within timeout"""
+    from qdrant_client import models
+
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if get_qdrant_client().get_collection(collection_name).status == models.CollectionStatus.GREEN:
+            return True
+        time.sleep(poll_interval)
+    return False
+
+
+def main():
+    from .config import STORAGE_LAYOUT
+    from .memory_store import list_user_ids, user_backend
+
+    parser = argparse.ArgumentParser(description='Apply QDRANT_STORAGE_CONFIG (quantization, on_disk, HNSW) to existing collections')
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument('--user-id', type=str, help='Re-configure the collection of one user')
+    target.add_argument('--all', action='store_true', help='Re-configure every collection')
+    parser.add_argument('--dry-run', action='store_true', help='Only list the settings that would change')
+    parser.add_argument('--wait', action='store_true', help='Wait for Qdrant to finish re-optimizing each collection')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    shared = STORAGE_LAYOUT == "shared"
+    if shared:
+        collections = [SHARED_COLLECTION_CONFIG["collection_name"]]
+    else:
+        user_ids = [args.user_id] if args.user_id else list_user_ids()
+        collections = [get_collection_name(user_id) for user_id in user_ids if user_backend(user_id) == "qdrant"]
+
+    for collection_name in collections:
+        started = time.perf_counter()
+        if args.dry_run:
+            changes = storage_changes(collection_name, shared=shared)
+        else:
+            changes = apply_storage_config(collection_name, shared=shared)
+            if changes and args.wait and not wait_for_optimization(collection_name):
+                logger.warning("Collection '%s' is still optimizing", collection_name)
+        print(json.dumps({"collection": collection_name, "changes": changes,
+                          "elapsed": round(time.perf_counter() - started, 3)}))
+
+
+if __name__ == "__main__":
+    main()
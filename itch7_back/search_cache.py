@@ -0,0 +1,227 @@
+import copy
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+
+class SearchCache:
+    """
+    Per-user cache of memory search results.
+
+    Results are keyed by (user, collection, normalized query, limit), so Memory
+    instances searching different collections for the same user don't share
+    results. Every write to a user's
+    memories (add, reset, import) drops that user's cached results and bumps the
+    generation of the user's searches still running, so a search that ran while a
+    write happened is not cached. Generations are only kept while a user has
+    searches in flight. Concurrent identical searches wait on one underlying
+    search call.
+    """
+
+    def __init__(self, max_entries=10000, ttl=300):
+        """
+        Args:
+            max_entries: Maximum number of cached results, LRU eviction beyond that; 0 disables caching
+            ttl: Seconds a result stays valid, bounds staleness from writes made outside this process; 0 disables the TTL
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()  # key -> (result, stored_at)
+        self._user_keys = {}           # user_id -> set of cached keys
+        self._generations = {}         # user_id -> generation, only while the user has searches in flight
+        self._searching = {}           # user_id -> number of searches in flight
+        self._inflight = {}
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def search(self, user_id, query, limit, search_fn, collection=None):
+        """
+        Return the cached result of a search, or run search_fn() once and cache it
+
+        Args:
+            user_id: User whose memories are searched
+            query: Search query, normalized for the cache key
+            limit: Number of results, part of the cache key
+            search_fn: Callable running the actual search
+            collection: Collection searched, part of the cache key
+        """
+        if self.max_entries <= 0:
+            return search_fn()
+
+        from .embedding_cache import normalize_text
+        key = (user_id, collection, normalize_text(query), limit)
+        now = time.monotonic()
+        with self._lock:
+            generation = self._generations.get(user_id, 0)
+            entry = self._entries.get(key)
+            if entry is not None and (not self.ttl or now - entry[1] <= self.ttl):
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return copy.deepcopy(entry[0])
+            future = self._inflight.get((key, generation))
+            if future is not None:
+                self.coalesced += 1
+                owner = False
+            else:
+                future = Future()
+                self._inflight[(key, generation)] = future
+                self._searching[user_id] = self._searching.get(user_id, 0) + 1
+                self.misses += 1
+                owner = True
+
+        if not owner:
+            return copy.deepcopy(future.result())
+
+        try:
+            result = search_fn()
+        except BaseException as e:
+            with self._lock:
+                self._inflight.pop((key, generation), None)
+                self._search_done(user_id)
+            future.set_exception(e)
+            raise
+
+        with self._lock:
+            self._inflight.pop((key, generation), None)
+            # A write during the search may not be reflected in the result
+            if self._generations.get(user_id, 0) == generation:
+                self._entries[key] = (result, time.monotonic())
+                self._entries.move_to_end(key)
+                self._user_keys.setdefault(user_id, set()).add(key)
+                while len(self._entries) > self.max_entries:
+                    old_key, _ = self._entries.popitem(last=False)
+                    self._forget_key(old_key)
+                    self.evictions += 1
+            self._search_done(user_id)
+        future.set_result(result)
+        return copy.deepcopy(result)
+
+    def invalidate(self, user_id):
+        """Drop the cached results of a user after their memories changed"""
+        with self._lock:
+            if user_id in self._searching:
+                self._generations[user_id] = self._generations.get(user_id, 0) + 1
+            for key in self._user_keys.pop(user_id, ()):
+                self._entries.pop(key, None)
+            self.invalidations += 1
+
+    def clear(self):
+        """Drop every cached result"""
+        with self._lock:
+            for user_id in self._searching:
+                self._generations[user_id] = self._generations.get(user_id, 0) + 1
+            self._entries.clear()
+            self._user_keys.clear()
+            self.invalidations += 1
+
+    def _search_done(self, user_id):
+        count = self._searching[user_id] - 1
+        if count:
+            self._searching[user_id] = count
+        else:
+            # No search of the user can hold the generation anymore, a new one starts over at 0
+            del self._searching[user_id]
+            self._generations.pop(user_id, None)
+
+    def _forget_key(self, key):
+        keys = self._user_keys.get(key[0])
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._user_keys[key[0]]
+
+    def stats(self):
+        """Return cache size, hit/miss counters and the hit rate"""
+        with self._lock:
+            lookups = self.hits + self.misses + self.coalesced
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "coalesced": self.coalesced,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "hit_rate": round((lookups - self.misses) / lookups, 4) if lookups else 0.0,
+            }
+
+
+class CachedSearchMemory:
+    """
+    Wrapper around a mem0 Memory instance that serves `search` from a SearchCache.
+
+    Writes going through the wrapper (add, update, delete, delete_all, reset)
+    invalidate the cached results of the affected user. Searches with filters,
+    agent_id, run_id or a threshold bypass the cache. Everything else is
+    forwarded to the wrapped instance.
+    """
+
+    def __init__(self, memory, cache, user_id=None, collection=None):
+        """
+        Args:
+            memory: The mem0 Memory instance to wrap
+            cache: SearchCache shared by all wrappers
+            user_id: User the instance belongs to, invalidated by writes that don't name a user
+            collection: Collection the instance searches, keeps its results apart from other instances'
+        """
+        self._memory = memory
+        self._cache = cache
+        self._user_id = user_id
+        self._collection = collection
+
+    def __getattr__(self, name):
+        if name == "_memory":
+            raise AttributeError(name)
+        return getattr(self._memory, name)
+
+    def search(self, query, user_id=None, limit=100, **kwargs):
+        if any(value is not None for value in kwargs.values()):
+            return self._memory.search(query, user_id=user_id, limit=limit, **kwargs)
+        return self._cache.search(user_id, query, limit,
+                                  lambda: self._memory.search(query, user_id=user_id, limit=limit),
+                                  collection=self._collection)
+
+    def add(self, *args, **kwargs):
+        try:
+            return self._memory.add(*args, **kwargs)
+        finally:
+            self._invalidate(kwargs.get("user_id"))
+
+    def update(self, *args, **kwargs):
+        try:
+            return self._memory.update(*args, **kwargs)
+        finally:
+            self._invalidate()
+
+    def delete(self, *args, **kwargs):
+        try:
+            return self._memory.delete(*args, **kwargs)
+        finally:
+            self._invalidate()
+
+    def delete_all(self, *args, **kwargs):
+        try:
+            return self._memory.delete_all(*args, **kwargs)
+        finally:
+            self._invalidate(kwargs.get("user_id"))
+
+    def reset(self):
+        try:
+            return self._memory.reset()
+        finally:
+            self._cache.clear()
+
+    def _invalidate(self, user_id=None):
+        user_id = user_id or self._user_id
+        if user_id is None:
+            # Unknown owner, e.g. update/delete by memory ID on the default instance
+            self._cache.clear()
+        else:
+            self._cache.invalidate(user_id)
@@ -0,0 +1,79 @@
+"""
+Server-sent event framing for the chat stream.
+
+DeepSeek streams one delta per token or so. Sending each delta as its own
+`data:` frame costs a json.dumps and a socket write per token. FrameCoalescer
+joins the deltas that arrive within a short window (or until a frame reaches
+a byte size) into one `{"content": ...}` frame. The frontend concatenates the
+content of consecutive frames, so coalesced frames render the same as single
+deltas. The first delta is sent as soon as it arrives, to keep the time to the
+first token unchanged.
+
+Frames are only sent when a delta arrives, so a delta can wait up to one window
+if upstream stalls right after it. While the client reads slowly, writes block
+and the deltas pile up upstream; they are read in a burst afterwards and leave
+as a few large frames instead of many small ones.
+"""
+import json
+import time
+
+from .config import SSE_CONFIG
+from .metrics import RATE_BUCKETS, histogram
+
+SSE_DELTAS_PER_FRAME = histogram(
+    "itch7_sse_deltas_per_frame",
+    "Upstream content deltas coalesced into one chat SSE frame",
+    buckets=RATE_BUCKETS)
+
+
+def sse_event(data):
+    """Return one SSE frame carrying data as JSON"""
+    return f"data: {json.dumps(data)}\n\n"
+
+
+class FrameCoalescer:
+    """Collects the deltas of one response and turns them into SSE frames"""
+
+    def __init__(self, flush_interval=None, max_frame_bytes=None):
+        """
+        Args:
+            flush_interval: Seconds deltas are collected into one frame, 0 sends every delta; default from SSE_CONFIG
+            max_frame_bytes: Frame content size (UTF-8) at which a frame is sent at once; default from SSE_CONFIG
+        """
+        self.flush_interval = SSE_CONFIG["flush_interval"] if flush_interval is None else flush_interval
+        self.max_frame_bytes = max_frame_bytes or SSE_CONFIG["max_frame_bytes"]
+        self.parts = []  # every delta of the response, joined once by text()
+        self.deltas = 0
+        self.frames = 0
+        self._pending = 0  # deltas at the end of parts not sent yet
+        self._pending_bytes = 0
+        self._last_flush = None
+
+    def add(self, content):
+        """Add a delta, return the frame to send now or None"""
+        self.parts.append(content)
+        self.deltas += 1
+        self._pending += 1
+        self._pending_bytes += len(content.encode("utf-8"))
+        now = time.perf_counter()
+        if (self._last_flush is None or self._pending_bytes >= self.max_frame_bytes
+                or now - self._last_flush >= self.flush_interval):
+            return self._frame(now)
+        return None
+
+    def flush(self):
+        """Return a frame with the deltas not sent yet, or None"""
+        return self._frame(time.perf_counter()) if self._pending else None
+
+    def text(self):
+        """The response so far, including deltas not sent yet"""
+        return "".join(self.parts)
+
+    def _frame(self, now):
+        content = self.parts[-1] if self._pending == 1 else "".join(self.parts[-self._pending:])
+        SSE_DELTAS_PER_FRAME.observe(self._pending)
+        self.frames += 1
+        self._pending = 0
+        self._pending_bytes = 0
+        self._last_flush = now
+        return sse_event({"content": content})
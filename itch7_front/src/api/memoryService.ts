@@ -61,9 +61,10 @@ export const memoryService = {
         try {
             const userId = await getUserId();
             console.log(`Starting file upload for user ${userId}:`, file.name, file.size, "bytes");
+            // user_id goes before the file so the backend can stream the upload straight to Qdrant
             const formData = new FormData();
-            formData.append('snapshot', file);
             formData.append('user_id', userId);
+            formData.append('snapshot', file);
 
             const response = await fetch(`${API_BASE_URL}/import-memory`, {
                 method: 'POST',
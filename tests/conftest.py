@@ -0,0 +1,71 @@
+import os
+import sys
+import types
+import uuid
+
+import pytest
+
+# The repo has no packaging, make itch7_back and benchmarks importable from the checkout
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# Must be set before mem0 is imported
+os.environ.setdefault("MEM0_TELEMETRY", "False")
+
+
+@pytest.fixture(scope="session")
+def llm():
+    from benchmarks.fakes import FakeLLMServer
+
+    server = FakeLLMServer(first_token_latency=0.0, token_rate=0.0, tokens=8).start()
+    yield server
+    server.stop()
+
+
+@pytest.fixture
+def bench(llm):
+    """The app patched like the benchmarks do: fake DeepSeek and Ollama, Qdrant in :memory: mode"""
+    from benchmarks.fakes import FakeEmbedder
+    from benchmarks.harness import BenchmarkApp
+
+    app = BenchmarkApp(types.SimpleNamespace(base_url=llm.base_url), FakeEmbedder(), serve=False).start()
+    yield app
+    app.stop()
+
+
+@pytest.fixture
+def embedded_bench(llm):
+    """Like bench, with new users starting in the embedded vector store"""
+    from benchmarks.fakes import FakeEmbedder
+    from benchmarks.harness import BenchmarkApp
+
+    app = BenchmarkApp(types.SimpleNamespace(base_url=llm.base_url), FakeEmbedder(), vector_backend="embedded",
+                       serve=False).start()
+    yield app
+    app.stop()
+
+
+@pytest.fixture
+def add_points():
+    """Return add(user_id, count) storing count points with fake embeddings for a user"""
+    from benchmarks.fakes import FakeEmbedder
+    from itch7_back.config import get_collection_name
+    from itch7_back.memory_store import ensure_user_collection, user_backend, write_user_points
+
+    embedder = FakeEmbedder()
+
+    def add(user_id, count, prefix="fact", created_at="2026-01-01T00:00:00+00:00"):
+        if user_backend(user_id) == "qdrant":
+            ensure_user_collection(get_collection_name(user_id))
+        write_user_points(user_id, upserts=[
+            (str(uuid.uuid5(uuid.NAMESPACE_URL, f"{user_id}/{prefix}/{index}")), embedder.embed(f"{prefix} {index}"),
+             {"data": f"{prefix} {index}", "user_id": user_id, "created_at": created_at})
+            for index in range(count)
+        ])
+    return add
+
+
+@pytest.fixture
+def count_points():
+    """Return count(user_id), the number of stored points of a user"""
+    from itch7_back.memory_store import iter_user_points
+
+    return lambda user_id: sum(len(batch) for batch in iter_user_points(user_id))
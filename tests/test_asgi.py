@@ -0,0 +1,73 @@
+import json
+
+import pytest
+from starlette.testclient import TestClient
+
+
+@pytest.fixture
+def client(bench):
+    from itch7_back import asgi
+
+    # Without the lifespan, the harness already started what the app needs
+    return TestClient(asgi.app)
+
+
+def test_chat_sends_timing_and_prompt_headers(client, monkeypatch):
+    from itch7_back.config import OBSERVABILITY_CONFIG
+
+    monkeypatch.setitem(OBSERVABILITY_CONFIG, "server_timing", True)
+    with client.stream("POST", "/api/chat", json={"message": "hi", "user_id": "alice"}) as response:
+        events = [json.loads(line[6:]) for line in response.iter_lines() if line.startswith("data: ")]
+
+    assert response.status_code == 200
+    assert "X-Prompt-Tokens" in response.headers
+    assert "search;dur=" in response.headers["Server-Timing"]
+    assert events[-1] == {"done": True}
+    assert "".join(event.get("content", "") for event in events)
+
+
+def test_delta_round_trip(client, add_points, count_points):
+    add_points("alice", 5)
+
+    exported = client.post("/api/export-memory-delta", json={"user_id": "alice"})
+    assert exported.status_code == 200
+    assert exported.headers["X-Delta-Count"] == "5"
+    assert exported.headers["X-Delta-Watermark"]
+
+    imported = client.post("/api/import-memory-delta", data={"user_id": "bob"},
+                           files={"delta": ("alice.i7d", exported.content, "application/octet-stream")})
+    assert imported.status_code == 200, imported.text
+    assert count_points("bob") == 5
+
+
+def test_delta_import_of_other_file_returns_400(client, count_points):
+    imported = client.post("/api/import-memory-delta", data={"user_id": "bob"},
+                           files={"delta": ("notes.txt", b"not a delta file", "application/octet-stream")})
+    assert imported.status_code == 400
+    assert imported.json() == {"error": "Not a memory delta file"}
+
+
+def test_import_points_file_with_user_id_after_file(client, add_points, count_points):
+    from itch7_back.memory_store import export_user_points
+
+    add_points("alice", 3)
+    with open(export_user_points("alice"), "rb") as f:
+        points = f.read()
+
+    # user_id comes after the file part, so the upload is spooled before it is imported
+    boundary = "itch7boundary"
+    body = (f"--{boundary}\r\nContent-Disposition: form-data; name=\"snapshot\"; filename=\"a.points\"\r\n"
+            f"Content-Type: application/octet-stream\r\n\r\n").encode() + points + (
+            f"\r\n--{boundary}\r\nContent-Disposition: form-data; name=\"user_id\"\r\n\r\ncarol"
+            f"\r\n--{boundary}--\r\n").encode()
+    imported = client.post("/api/import-memory", content=body,
+                           headers={"Content-Type": f"multipart/form-data; boundary={boundary}"})
+    assert imported.status_code == 200, imported.text
+    assert count_points("carol") == 3
+
+
+def test_ingest_history_rejects_invalid_turns_per_chunk(client):
+    response = client.post("/api/ingest-history?user_id=alice&turns_per_chunk=x", content=b"",
+                           headers={"Content-Type": "application/x-ndjson"})
+    assert response.status_code == 400
+    assert response.json() == {"error": "turns_per_chunk must be a positive integer"}
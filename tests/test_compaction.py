@@ -0,0 +1,132 @@
+import datetime
+import uuid
+
+from benchmarks.fakes import FakeEmbedder
+from itch7_back import api, compaction
+from itch7_back.compaction import CompactionService, compact_user_memories
+from itch7_back.config import get_collection_name
+from itch7_back.memory_store import ensure_user_collection, iter_user_points, write_user_points
+
+embedder = FakeEmbedder()
+
+
+def days_ago(days):
+    return (datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(days=days)).isoformat()
+
+
+def store(user_id, memories):
+    """Store (key, text, updated_at, extra payload) tuples, memories with the same text get the same vector"""
+    ensure_user_collection(get_collection_name(user_id))
+    write_user_points(user_id, upserts=[
+        (str(uuid.uuid5(uuid.NAMESPACE_URL, f"{user_id}/{key}")), embedder.embed(text),
+         dict({"data": text, "user_id": user_id, "created_at": updated_at, "updated_at": updated_at}, **extra))
+        for key, text, updated_at, extra in memories
+    ])
+
+
+def payloads(user_id):
+    return sorted((point.payload for batch in iter_user_points(user_id) for point in batch), key=lambda p: p["data"])
+
+
+def test_duplicates_are_merged_into_the_most_recent(bench):
+    oldest, newest = days_ago(3), days_ago(1)
+    store("alice", [("a", "likes tea", oldest, {"source": "a"}), ("b", "likes tea", newest, {"source": "b"}),
+                    ("c", "likes tea", days_ago(2), {"source": "c"}), ("d", "lives in Paris", newest, {})])
+
+    report = compact_user_memories("alice", summarize=False, ttl_days=0, max_points=0)
+
+    assert report["clusters"] == 1 and report["removed"]["duplicate"] == 2
+    assert report["points_after"] == 2
+    kept = payloads("alice")
+    assert [p["data"] for p in kept] == ["likes tea", "lives in Paris"]
+    assert kept[0]["source"] == "b" and kept[0]["merged_count"] == 3
+    assert kept[0]["created_at"] == oldest
+
+
+def test_dry_run_writes_nothing(bench):
+    store("bob", [("a", "likes tea", days_ago(1), {}), ("b", "likes tea", days_ago(2), {}),
+                  ("c", "old news", days_ago(400), {})])
+
+    report = compact_user_memories("bob", dry_run=True, summarize=False, ttl_days=30, max_points=0)
+
+    assert report["removed"] == {"duplicate": 1, "ttl": 1, "capacity": 0}
+    assert report["points_after"] == 1
+    assert len(payloads("bob")) == 3
+
+
+def test_ttl_evicts_stale_memories_unless_important(bench):
+    store("carol", [("a", "old news", days_ago(400), {}),
+                    ("b", "allergic to nuts", days_ago(400), {"importance": 0.9}),
+                    ("c", "likes tea", days_ago(1), {})])
+
+    report = compact_user_memories("carol", summarize=False, ttl_days=30, max_points=0)
+
+    assert report["removed"]["ttl"] == 1
+    assert [e["memory"] for e in report["evictions"]] == ["old news"]
+    assert [p["data"] for p in payloads("carol")] == ["allergic to nuts", "likes tea"]
+
+
+def test_max_points_evicts_the_lowest_priority(bench):
+    store("dave", [("a", "first", days_ago(3), {}), ("b", "second", days_ago(2), {}),
+                   ("c", "third", days_ago(1), {}), ("d", "pinned", days_ago(5), {"importance": 1.0})])
+
+    report = compact_user_memories("dave", summarize=False, ttl_days=0, max_points=2)
+
+    assert report["removed"]["capacity"] == 2
+    assert [p["data"] for p in payloads("dave")] == ["pinned", "third"]
+
+
+def test_service_rate_limits_compactions_per_user(bench):
+    store("erin", [("a", "likes tea", days_ago(1), {}), ("b", "likes tea", days_ago(2), {})])
+    service = CompactionService(min_user_interval=3600)
+
+    first = service.compact("erin", summarize=False)
+    assert first["removed"]["duplicate"] == 1
+    assert service.compact("erin", summarize=False)["skipped"] == "rate_limited"
+    assert "skipped" not in service.compact("erin", dry_run=True, summarize=False)
+    assert "skipped" not in service.compact("erin", force=True, summarize=False)
+    assert service.stats()["compacted"] == 2
+
+
+def test_only_clusters_kept_after_capacity_eviction_are_summarized(bench, monkeypatch):
+    store("frank", [("a", "likes tea", days_ago(1), {}), ("b", "likes tea", days_ago(2), {}),
+                    ("c", "old car", days_ago(30), {}), ("d", "old car", days_ago(31), {})])
+    asked = []
+
+    def summarize(clusters):
+        asked.extend(clusters)
+        return ["drinks tea"] * len(clusters)
+
+    monkeypatch.setattr(compaction, "summarize_clusters", summarize)
+    report = compact_user_memories("frank", summarize=True, ttl_days=0, max_points=1)
+
+    assert asked == [["likes tea", "likes tea"]]
+    assert report["removed"] == {"duplicate": 2, "ttl": 0, "capacity": 1}
+    assert [p["data"] for p in payloads("frank")] == ["drinks tea"]
+
+
+def test_nothing_is_written_when_memories_change_during_compaction(bench, monkeypatch):
+    store("grace", [("a", "likes tea", days_ago(1), {}), ("b", "likes tea", days_ago(2), {})])
+
+    def summarize(clusters):
+        # A turn stored while the LLM merges updates one of the duplicates
+        store("grace", [("b", "likes tea", days_ago(0), {"source": "turn"})])
+        return [None] * len(clusters)
+
+    monkeypatch.setattr(compaction, "summarize_clusters", summarize)
+    service = CompactionService(min_user_interval=3600)
+    report = service.compact("grace", summarize=True, ttl_days=0, max_points=0)
+
+    assert report["skipped"] == "changed"
+    assert len(payloads("grace")) == 2
+    assert "skipped" not in service.compact("grace", summarize=False, ttl_days=0, max_points=0)
+    assert len(payloads("grace")) == 1
+
+
+def test_route_rejects_invalid_options(bench):
+    client = api.app.test_client()
+    for options in ({"threshold": "high"}, {"threshold": 1.5}, {"ttl_days": "30"}, {"max_points": -1},
+                    {"max_points": True}, {"summarize": "no"}):
+        response = client.post("/api/compact-memory", json=dict({"user_id": "heidi"}, **options))
+        assert response.status_code == 400, options
+        assert "must be" in response.get_json()["error"]
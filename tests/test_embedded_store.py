@@ -0,0 +1,76 @@
+import numpy as np
+
+from itch7_back.config import VECTOR_BACKEND_CONFIG, get_user_memory
+from itch7_back.embedded_store import EmbeddedVectorStore
+from itch7_back.memory_store import open_embedded_store, reset_user_memories, user_backend
+
+
+def unit(dims, index):
+    vector = np.zeros(dims, dtype=np.float32)
+    vector[index % dims] = 1.0
+    return vector.tolist()
+
+
+def test_search_and_reopen(tmp_path):
+    store = EmbeddedVectorStore("test", 8, str(tmp_path / "store"))
+    store.insert([unit(8, i) for i in range(4)], payloads=[{"data": str(i), "user_id": "a"} for i in range(4)],
+                 ids=[f"p{i}" for i in range(4)])
+    store.delete("p1")
+    assert [hit.id for hit in store.search("q", unit(8, 2), limit=1)] == ["p2"]
+    store.close()
+
+    reopened = EmbeddedVectorStore("test", 8, str(tmp_path / "store"))
+    assert len(reopened) == 3
+    assert reopened.get("p1") is None
+    assert reopened.get("p3").payload["data"] == "3"
+
+
+def test_reinserting_ids_compacts_dead_rows(tmp_path):
+    store = EmbeddedVectorStore("test", 8, str(tmp_path / "store"))
+    ids = [f"p{i}" for i in range(100)]
+    for _ in range(5):
+        store.insert([unit(8, i) for i in range(100)], payloads=[{"data": str(i)} for i in range(100)], ids=ids)
+
+    assert len(store) == 100
+    assert len(store._row_ids) < 2 * len(ids)
+    store.close()
+
+
+def test_delete_col_leaves_a_usable_store(tmp_path):
+    store = EmbeddedVectorStore("test", 8, str(tmp_path / "store"))
+    store.insert([unit(8, 0)], payloads=[{"data": "old"}], ids=["old"])
+    store.delete_col()
+    assert len(store) == 0
+
+    store.insert([unit(8, 1)], payloads=[{"data": "new"}], ids=["new"])
+    assert [hit.id for hit in store.search("q", unit(8, 1), limit=5)] == ["new"]
+    store.close()
+    assert len(EmbeddedVectorStore("test", 8, str(tmp_path / "store"))) == 1
+
+
+def test_promotion_moves_points_to_qdrant(embedded_bench, add_points, count_points, monkeypatch):
+    monkeypatch.setitem(VECTOR_BACKEND_CONFIG, "promote_threshold", 5)
+    add_points("alice", 4)
+    assert user_backend("alice") == "embedded"
+    pooled = get_user_memory("alice")
+    assert pooled.vector_store is open_embedded_store("alice")
+
+    add_points("alice", 3, prefix="more")
+    assert user_backend("alice") == "qdrant"
+    assert count_points("alice") == 7
+    # The promoted user's pooled instance was dropped, a new one talks to Qdrant directly
+    memory = get_user_memory("alice")
+    assert memory is not pooled
+    assert not isinstance(memory.vector_store, EmbeddedVectorStore)
+
+
+def test_reset_drops_pooled_memory_of_embedded_user(embedded_bench, add_points, count_points):
+    add_points("alice", 3)
+    pooled = get_user_memory("alice")
+    store = open_embedded_store("alice")
+
+    reset_user_memories("alice")
+    assert count_points("alice") == 1
+    memory = get_user_memory("alice")
+    assert memory is not pooled
+    assert memory.vector_store is open_embedded_store("alice") is not store
@@ -0,0 +1,87 @@
+import json
+import threading
+import time
+
+import pytest
+
+from itch7_back import history_ingest
+from itch7_back.history_ingest import HistoryIngestor
+
+
+def conversation_lines(turns):
+    return [json.dumps({"role": role, "content": f"{role} message {index}", "conversation_id": "c1"})
+            for index in range(turns) for role in ("user", "assistant")]
+
+
+class RecordingMemory:
+    """Memory stand-in that records how many adds overlap"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.active = 0
+        self.max_active = 0
+        self.adds = 0
+
+    def add(self, messages, user_id):
+        with self.lock:
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        time.sleep(0.01)
+        with self.lock:
+            self.active -= 1
+            self.adds += 1
+        return {"results": [{"memory": messages[0]["content"]}]}
+
+
+def test_extract_mode_adds_one_chunk_at_a_time(tmp_path, monkeypatch):
+    memory = RecordingMemory()
+    monkeypatch.setattr(history_ingest, "get_user_memory", lambda user_id: memory)
+
+    ingestor = HistoryIngestor("history_user", workers=4, turns_per_chunk=1,
+                               checkpoint_path=str(tmp_path / "checkpoint.json"))
+    report = ingestor.run(conversation_lines(8))
+
+    assert ingestor.workers == 1
+    assert memory.adds == 8 and memory.max_active == 1
+    assert report["done"] and report["memories"] == 8
+
+
+def test_concurrent_extract_jobs_of_one_user_take_turns(tmp_path, monkeypatch):
+    memory = RecordingMemory()
+    monkeypatch.setattr(history_ingest, "get_user_memory", lambda user_id: memory)
+
+    jobs = [HistoryIngestor("history_user", turns_per_chunk=1, checkpoint_path=str(tmp_path / f"job{index}.json"))
+            for index in range(3)]
+    threads = [threading.Thread(target=job.run, args=(conversation_lines(4),)) for job in jobs]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert memory.adds == 12 and memory.max_active == 1
+
+
+def test_raw_mode_runs_in_parallel_and_resumes(bench, tmp_path, count_points):
+    checkpoint = str(tmp_path / "checkpoint.json")
+    lines = conversation_lines(12)
+
+    report = HistoryIngestor("history_raw", raw=True, job_id="job", workers=4, batch_size=1, turns_per_chunk=1,
+                             checkpoint_path=checkpoint).run(lines)
+    assert report["done"] and report["chunks"] == 12
+    assert count_points("history_raw") == 12
+
+    # Running the finished job again adds nothing
+    again = HistoryIngestor("history_raw", raw=True, job_id="job", workers=4, batch_size=1, turns_per_chunk=1,
+                            checkpoint_path=checkpoint).run(lines)
+    assert again["chunks"] == 12
+    assert count_points("history_raw") == 12
+
+
+@pytest.mark.parametrize("value", ["abc", "0", "-2"])
+def test_route_rejects_invalid_turns_per_chunk(bench, value):
+    from itch7_back import api
+
+    response = api.app.test_client().post(f"/api/ingest-history?user_id=alice&turns_per_chunk={value}",
+                                          data=b"", content_type="application/x-ndjson")
+    assert response.status_code == 400
+    assert response.json == {"error": "turns_per_chunk must be a positive integer"}
@@ -0,0 +1,106 @@
+import threading
+import time
+
+from itch7_back import ingestion
+from itch7_back.ingestion import IngestionQueue
+
+
+class RecordingMemory:
+    def __init__(self, fail=0, gate=None):
+        self.calls = []
+        self.fail = fail
+        self.gate = gate
+        self.started = threading.Event()
+
+    def add(self, messages, user_id=None):
+        self.calls.append((time.monotonic(), user_id, messages))
+        self.started.set()
+        if self.gate is not None:
+            self.gate.wait(5)
+        if self.fail:
+            self.fail -= 1
+            raise RuntimeError("vector store unavailable")
+
+
+def turn(text):
+    return [{"role": "user", "content": text}]
+
+
+def test_journal_replay_keeps_named_memory(tmp_path):
+    journal = str(tmp_path / "journal.jsonl")
+    per_user = RecordingMemory()
+    default = RecordingMemory()
+
+    # No workers, so the turns stay in the journal like after a crash
+    first = IngestionQueue(lambda user_id: per_user, named_memories={"default": lambda: default},
+                           workers=0, journal_path=journal)
+    assert first.submit("alice", turn("hi"), memory="default")
+    assert first.submit("bob", turn("hello"))
+    first.shutdown(timeout=0)
+
+    second = IngestionQueue(lambda user_id: per_user, named_memories={"default": lambda: default},
+                            workers=1, journal_path=journal)
+    second.start()
+    assert second.flush(5)
+    second.shutdown()
+
+    assert [(user_id, messages) for _, user_id, messages in default.calls] == [("alice", turn("hi"))]
+    assert [(user_id, messages) for _, user_id, messages in per_user.calls] == [("bob", turn("hello"))]
+
+
+def test_turns_of_different_memories_are_not_merged():
+    per_user, default = RecordingMemory(gate=threading.Event()), RecordingMemory()
+    queue = IngestionQueue(lambda user_id: per_user, named_memories={"default": lambda: default}, workers=1)
+    queue.submit("alice", turn("one"))
+    per_user.started.wait(5)
+    queue.submit("alice", turn("two"), memory="default")
+    queue.submit("alice", turn("three"))
+    per_user.gate.set()
+    assert queue.flush(5)
+    queue.shutdown()
+    assert [messages for _, _, messages in per_user.calls] == [turn("one"), turn("three")]
+    assert [messages for _, _, messages in default.calls] == [turn("two")]
+
+
+def test_failed_batch_is_retried_after_backoff():
+    memory = RecordingMemory(fail=1)
+    queue = IngestionQueue(lambda user_id: memory, workers=1, retry_delay=0.2)
+    queue.submit("alice", turn("hi"))
+    assert queue.flush(5)
+    queue.shutdown()
+
+    (first, _, _), (second, _, _) = memory.calls
+    assert second - first >= 0.2
+    assert queue.stats()["processed"] == 1
+
+
+def test_discard_waits_for_in_flight_batch_and_drops_it():
+    memory = RecordingMemory(fail=1, gate=threading.Event())
+    queue = IngestionQueue(lambda user_id: memory, workers=1, retry_delay=0)
+    queue.submit("alice", turn("hi"))
+    memory.started.wait(5)
+
+    discarding = threading.Thread(target=queue.discard, args=("alice",))
+    discarding.start()
+    discarding.join(0.1)
+    assert discarding.is_alive()
+
+    memory.gate.set()
+    discarding.join(5)
+    assert not discarding.is_alive()
+    assert queue.flush(5)
+    queue.shutdown()
+    # The failed batch of the discarded user is not retried
+    assert len(memory.calls) == 1
+    assert queue.stats()["failed"] == 1
+
+
+def test_store_conversation_is_synchronous_when_disabled(monkeypatch):
+    default = RecordingMemory()
+    queue = IngestionQueue(lambda user_id: None, named_memories={"default": lambda: default}, workers=0)
+    monkeypatch.setattr(ingestion, "ingestion_queue", queue)
+    monkeypatch.setitem(ingestion.INGESTION_CONFIG, "enabled", False)
+
+    assert ingestion.store_conversation("alice", turn("hi"), memory="default") is False
+    assert len(default.calls) == 1
+    assert queue.stats()["depth"] == 0
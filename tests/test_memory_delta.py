@@ -0,0 +1,79 @@
+import io
+
+import numpy as np
+import pytest
+
+from itch7_back import api
+from itch7_back.config import get_user_memory
+from itch7_back.memory_delta import export_memory_delta, import_memory_delta
+from itch7_back.memory_store import iter_user_points
+
+
+def points_by_data(user_id):
+    return {point.payload["data"]: point for batch in iter_user_points(user_id) for point in batch}
+
+
+def test_round_trip(bench, add_points, count_points):
+    add_points("alice", 20)
+
+    exported = export_memory_delta("alice", dtype="float32")
+    assert exported["count"] == 20
+    result = import_memory_delta(exported["path"], user_id="bob")
+    assert result == {"imported": 20, "verified": 20, "mismatches": []}
+
+    alice, bob = points_by_data("alice"), points_by_data("bob")
+    assert alice.keys() == bob.keys()
+    for data, point in bob.items():
+        assert point.payload["user_id"] == "bob"
+        assert point.payload["created_at"] == alice[data].payload["created_at"]
+        assert np.allclose(point.vector, alice[data].vector, atol=1e-6)
+
+
+def test_export_since_watermark_only_has_newer_memories(bench, add_points):
+    add_points("alice", 5, prefix="old", created_at="2026-01-01T00:00:00+00:00")
+    first = export_memory_delta("alice")
+    add_points("alice", 3, prefix="new", created_at="2026-02-01T00:00:00+00:00")
+
+    second = export_memory_delta("alice", since=first["watermark"])
+    assert second["count"] == 3
+    assert second["watermark"] > first["watermark"]
+    assert import_memory_delta(second["path"], user_id="bob")["imported"] == 3
+    assert sorted(points_by_data("bob")) == ["new 0", "new 1", "new 2"]
+
+
+def test_import_route_keeps_pooled_memory(bench, add_points, count_points):
+    add_points("alice", 4)
+    add_points("bob", 1, prefix="own")
+    pooled = get_user_memory("bob")
+    with open(export_memory_delta("alice")["path"], "rb") as f:
+        response = api.app.test_client().post("/api/import-memory-delta", data={"user_id": "bob", "delta": (f, "a.i7d")},
+                                              content_type="multipart/form-data")
+
+    assert response.status_code == 200, response.json
+    assert count_points("bob") == 5
+    # Upserting doesn't replace the collection, only cached search results are dropped
+    assert get_user_memory("bob") is pooled
+
+
+def test_malformed_delta_is_rejected_before_writing(bench, add_points, count_points, tmp_path):
+    add_points("alice", 10)
+    with open(export_memory_delta("alice")["path"], "rb") as f:
+        content = f.read()
+    path = tmp_path / "broken.i7d"
+    # The last payload line is cut off
+    path.write_bytes(content[:-20])
+
+    with pytest.raises(ValueError):
+        import_memory_delta(str(path), user_id="bob", batch_size=4)
+    assert count_points("bob") == 0
+
+
+def test_import_route_rejects_other_files(bench, add_points, count_points):
+    add_points("bob", 1)
+    response = api.app.test_client().post("/api/import-memory-delta",
+                                          data={"user_id": "bob", "delta": (io.BytesIO(b"{}\n"), "points.jsonl")},
+                                          content_type="multipart/form-data")
+
+    assert response.status_code == 400
+    assert response.json == {"error": "Not a memory delta file"}
+    assert count_points("bob") == 1
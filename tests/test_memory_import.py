@@ -0,0 +1,118 @@
+import hashlib
+import io
+import types
+
+import pytest
+
+from itch7_back import api, memory_store
+from itch7_back.memory_store import export_user_points, import_user_memory, import_user_memory_stream
+
+
+@pytest.fixture
+def client(bench):
+    return api.app.test_client()
+
+
+class DrainingSession:
+    """Stands in for Qdrant's snapshot upload endpoint, which reads the whole body"""
+
+    def post(self, url, data=None, **kwargs):
+        for _ in data:
+            pass
+        return types.SimpleNamespace(status_code=200, text="")
+
+
+def points_file(user_id):
+    with open(export_user_points(user_id), "rb") as f:
+        return f.read()
+
+
+def multipart(fields, filename, content, boundary="itch7boundary"):
+    body = b""
+    for name, value in fields.items():
+        body += f"--{boundary}\r\nContent-Disposition: form-data; name=\"{name}\"\r\n\r\n{value}\r\n".encode()
+    body += (f"--{boundary}\r\nContent-Disposition: form-data; name=\"snapshot\"; filename=\"{filename}\"\r\n"
+             "Content-Type: application/octet-stream\r\n\r\n").encode() + content
+    return body, f"multipart/form-data; boundary={boundary}"
+
+
+def test_points_import_replaces_memories(bench, add_points, count_points):
+    add_points("alice", 4)
+    add_points("bob", 2, prefix="old")
+    assert import_user_memory_stream([points_file("alice")], user_id="bob")
+    assert count_points("bob") == 4
+
+
+@pytest.mark.parametrize("chunks", [[], [b""]])
+def test_empty_stream_is_rejected_before_deleting(bench, add_points, count_points, chunks):
+    add_points("bob", 2)
+    with pytest.raises(ValueError):
+        import_user_memory_stream(chunks, user_id="bob")
+    assert count_points("bob") == 2
+
+
+def test_empty_file_is_rejected_before_deleting(bench, add_points, count_points, tmp_path):
+    add_points("bob", 2)
+    path = tmp_path / "empty.snapshot"
+    path.write_bytes(b"")
+    with pytest.raises(ValueError):
+        import_user_memory(str(path), user_id="bob")
+    assert count_points("bob") == 2
+
+
+def test_invalid_points_are_rejected_before_deleting(bench, add_points, count_points):
+    add_points("bob", 2)
+    with pytest.raises(ValueError):
+        import_user_memory_stream([b'{"id": "not a point"}\n'], user_id="bob")
+    with pytest.raises(ValueError):
+        import_user_memory_stream([b'{"id": 1, "vector": [0.1]\n'], user_id="bob")
+    assert count_points("bob") == 2
+
+
+def test_malformed_later_line_is_rejected_before_deleting(bench, add_points, count_points):
+    add_points("alice", 300)
+    add_points("bob", 2)
+    # The first batch (256 points) is fine, a line after it is not
+    content = points_file("alice") + b'{"id": "broken"}\n'
+    with pytest.raises(ValueError):
+        import_user_memory_stream([content], user_id="bob")
+    assert count_points("bob") == 2
+    assert not [c.name for c in memory_store.get_qdrant_client().get_collections().collections if "-import-" in c.name]
+
+
+def test_checksum_mismatch_is_rejected_before_deleting(bench, add_points, count_points):
+    add_points("alice", 3)
+    add_points("bob", 2)
+    content = points_file("alice")
+    with pytest.raises(ValueError):
+        import_user_memory_stream([content], user_id="bob", checksum=hashlib.sha256(b"other").hexdigest())
+    assert count_points("bob") == 2
+    assert import_user_memory_stream([content], user_id="bob", checksum=hashlib.sha256(content).hexdigest())
+    assert count_points("bob") == 3
+
+
+def test_empty_upload_returns_400(client, add_points, count_points):
+    add_points("bob", 2)
+    body, content_type = multipart({"user_id": "bob"}, "empty.snapshot", b"\r\n--itch7boundary--\r\n")
+    response = client.post("/api/import-memory", data=body, content_type=content_type)
+    assert response.status_code == 400
+    assert count_points("bob") == 2
+
+
+@pytest.mark.parametrize("content", [b'{"id": 1, "vector": [0.1], "payload": {}}\n', b"\x00snapshot tar data"])
+def test_truncated_upload_returns_400(client, add_points, count_points, content, monkeypatch):
+    monkeypatch.setattr(memory_store, "get_qdrant_session", lambda: DrainingSession())
+    add_points("bob", 2)
+    # The body ends inside the file part, without the closing boundary
+    body, content_type = multipart({"user_id": "bob"}, "cut.snapshot", content)
+    response = client.post("/api/import-memory", data=body, content_type=content_type)
+    assert response.status_code == 400
+    assert count_points("bob") == 2
+
+
+def test_upload_via_route(client, add_points, count_points):
+    add_points("alice", 3)
+    response = client.post("/api/import-memory", data={"user_id": "bob", "snapshot": (io.BytesIO(points_file("alice")), "a.points")},
+                           content_type="multipart/form-data")
+    assert response.status_code == 200, response.json
+    assert count_points("bob") == 3
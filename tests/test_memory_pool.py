@@ -0,0 +1,95 @@
+import threading
+
+from itch7_back.memory_pool import MemoryPool
+
+
+def test_get_reuses_instance_until_invalidated():
+    built = []
+    pool = MemoryPool(lambda user_id: built.append(user_id) or object(), max_size=4)
+
+    first = pool.get("alice")
+    assert pool.get("alice") is first
+    pool.invalidate("alice")
+    assert pool.get("alice") is not first
+    assert built == ["alice", "alice"]
+    assert pool.stats()["invalidations"] == 1
+
+
+def test_lru_eviction():
+    pool = MemoryPool(lambda user_id: object(), max_size=2)
+    alice = pool.get("alice")
+    pool.get("bob")
+    pool.get("alice")
+    pool.get("carol")  # evicts bob, the least recently used
+    assert pool.get("alice") is alice
+    assert pool.stats()["evictions"] == 1
+    assert pool.stats()["size"] == 2
+
+
+def test_invalidate_during_build_is_not_cached():
+    started, release = threading.Event(), threading.Event()
+
+    def factory(user_id):
+        started.set()
+        release.wait(5)
+        return object()
+
+    pool = MemoryPool(factory, max_size=4)
+    result = []
+    thread = threading.Thread(target=lambda: result.append(pool.get("alice")))
+    thread.start()
+    started.wait(5)
+    pool.invalidate("alice")
+    release.set()
+    thread.join(5)
+
+    assert pool.stats()["size"] == 0
+    assert pool.get("alice") is not result[0]
+
+
+def test_bookkeeping_does_not_grow_with_users():
+    pool = MemoryPool(lambda user_id: object(), max_size=2)
+    for index in range(100):
+        pool.get(f"user_{index}")
+        pool.invalidate(f"user_{index - 1}")
+    assert pool._building == {}
+    assert pool._build_locks == {}
+    assert len(pool._entries) <= 2
+
+
+def test_failed_build_releases_bookkeeping():
+    def factory(user_id):
+        raise RuntimeError("qdrant down")
+
+    pool = MemoryPool(factory)
+    try:
+        pool.get("alice")
+    except RuntimeError:
+        pass
+    assert pool._building == {}
+    assert pool._build_locks == {}
+
+
+def test_waiters_and_new_arrivals_share_one_build_lock():
+    # Unpooled, so every get builds; builds of one user must still never overlap
+    lock = threading.Lock()
+    active, overlaps = [0], []
+
+    def factory(user_id):
+        with lock:
+            active[0] += 1
+            overlaps.append(active[0] > 1)
+        threading.Event().wait(0.01)
+        with lock:
+            active[0] -= 1
+        return object()
+
+    pool = MemoryPool(factory, max_size=0)
+    threads = [threading.Thread(target=pool.get, args=("alice",)) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(5)
+
+    assert len(overlaps) == 8 and not any(overlaps)
+    assert pool._build_locks == {}
@@ -0,0 +1,31 @@
+import pytest
+
+from itch7_back import api, config
+from itch7_back.memory_store import reset_user_memories
+
+
+def test_reset_seeds_without_building_the_default_memory(bench, add_points, count_points):
+    add_points("alice", 3)
+
+    reset_user_memories("alice")
+
+    assert count_points("alice") == 1
+    assert "memory" not in config._clients
+    assert not config.get_qdrant_client().collection_exists(config.BASE_COLLECTION_NAME)
+
+
+def test_warmup_does_not_build_the_default_memory(bench):
+    config.warmup()
+
+    assert "memory" not in config._clients
+    assert not config.get_qdrant_client().collection_exists(config.BASE_COLLECTION_NAME)
+
+
+@pytest.mark.parametrize("workers", ["4", 0, -1, 1000, True, 1.5])
+def test_bulk_reset_rejects_invalid_workers(bench, add_points, count_points, workers):
+    add_points("alice", 2)
+    response = api.app.test_client().post("/api/reset-memories", json={"user_ids": ["alice"], "workers": workers})
+
+    assert response.status_code == 400
+    assert "workers" in response.json["error"]
+    assert count_points("alice") == 2
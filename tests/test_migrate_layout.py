@@ -0,0 +1,19 @@
+from itch7_back.config import SHARED_COLLECTION_CONFIG, get_collection_name, get_qdrant_client
+from itch7_back.memory_store import user_filter
+from itch7_back.migrate_layout import list_user_collections, migrate
+
+
+def test_shared_collection_name_is_not_a_user_collection():
+    assert SHARED_COLLECTION_CONFIG["collection_name"] != get_collection_name("shared", layout="per_user")
+
+
+def test_user_named_shared_is_migrated(bench, add_points, tmp_path):
+    add_points("shared", 2)
+    add_points("alice", 3)
+    assert [user_id for _, user_id in list_user_collections()] == ["alice", "shared"]
+
+    migrate(state_file=str(tmp_path / "state.json"))
+
+    shared_name = SHARED_COLLECTION_CONFIG["collection_name"]
+    for user_id, count in (("shared", 2), ("alice", 3)):
+        assert get_qdrant_client().count(collection_name=shared_name, count_filter=user_filter(user_id), exact=True).count == count
@@ -0,0 +1,84 @@
+import json
+import signal
+import socket
+import subprocess
+import sys
+import threading
+
+import requests
+
+from benchmarks.workers import REPO_ROOT, free_port, wait_until_serving
+from itch7_back.prefork import _WorkerServer, request_user_id, worker_index
+
+
+def app(environ, start_response):
+    start_response("200 OK", [("Content-Type", "text/plain"), ("Content-Length", "2")])
+    return [b"ok"]
+
+
+def test_request_user_id_from_query_json_and_form():
+    assert request_user_id(b"GET /api/memories?user_id=alice HTTP/1.1\r\nHost: x\r\n\r\n") == ("alice", True)
+    assert request_user_id(b'POST /api/chat HTTP/1.1\r\nContent-Length: 19\r\n\r\n{"user_id": "bob"}') == ("bob", True)
+    form = (b"POST /api/import HTTP/1.1\r\nContent-Length: 60\r\n\r\n--b\r\n"
+            b"Content-Disposition: form-data; name=\"user_id\"\r\n\r\ncarol\r\n")
+    assert request_user_id(form) == ("carol", True)
+    assert request_user_id(b"POST /api/chat HTTP/1.1\r\nContent-Length: 100\r\n\r\n{") == (None, False)
+
+
+def test_worker_closes_keep_alive_connections_after_one_response():
+    listener = socket.create_server(("127.0.0.1", 0))
+    server = _WorkerServer("127.0.0.1", listener.getsockname()[1], app, fd=listener.fileno())
+    client = socket.create_connection(listener.getsockname())
+    conn, address = listener.accept()
+    threading.Thread(target=server.process_request, args=(conn, address), daemon=True).start()
+    try:
+        request = b"GET /api/memories?user_id=alice HTTP/1.1\r\nHost: x\r\nConnection: keep-alive\r\n\r\n"
+        client.sendall(request + request)
+        client.settimeout(5)
+        response = b""
+        while chunk := client.recv(4096):
+            response += chunk
+    finally:
+        client.close()
+        listener.close()
+
+    # One response, then the worker closes, so the next request is routed again by the master
+    assert response.count(b"HTTP/1.1 200") == 1
+    assert response.lower().count(b"connection:") == 1 and b"connection: close" in response.lower()
+    assert server.wait_idle(5)
+
+
+def test_bulk_reset_reaches_the_worker_owning_each_user(llm):
+    port = free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    # Every worker of the benchmark server has its own in-memory Qdrant, a user's memories live in its owner
+    process = subprocess.Popen([sys.executable, "-m", "benchmarks.workers", "--serve", "--workers", "2",
+                                "--port", str(port), "--llm-url", llm.base_url], cwd=REPO_ROOT)
+    users = [next(f"user{i}" for i in range(100) if worker_index(f"user{i}", 2) == index) for index in range(2)]
+
+    def count(user_id):
+        response = requests.post(f"{base_url}/api/export-memory-delta", json={"user_id": user_id}, timeout=30)
+        response.raise_for_status()
+        return int(response.headers["X-Delta-Count"])
+
+    try:
+        wait_until_serving(base_url, process)
+        history = "".join(json.dumps({"role": "user", "content": f"fact {i}"}) + "\n" for i in range(3))
+        for user_id in users:
+            requests.post(f"{base_url}/api/ingest-history", params={"user_id": user_id, "raw": "1", "turns_per_chunk": "1"},
+                          data=history, timeout=30).raise_for_status()
+            assert count(user_id) == 3
+
+        # No top-level user_id, the master routes the request by client address to one of the workers
+        response = requests.post(f"{base_url}/api/reset-memories", json={"user_ids": users}, timeout=60)
+
+        assert response.status_code == 200
+        assert sorted(response.json()["reset"]) == sorted(users) and response.json()["failed"] == {}
+        assert [count(user_id) for user_id in users] == [1, 1]
+    finally:
+        process.send_signal(signal.SIGTERM)
+        try:
+            process.wait(timeout=60)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
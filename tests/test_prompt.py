@@ -0,0 +1,60 @@
+import numpy as np
+
+from itch7_back.embedding_cache import CachedEmbedder
+from itch7_back.prompt import PERSONAS, estimate_tokens, pack_system_prompt
+
+
+class CountingEmbedder:
+    def __init__(self, vectors):
+        self.vectors = vectors
+        self.calls = 0
+
+    def embed(self, text, memory_action=None):
+        self.calls += 1
+        return self.vectors[text]
+
+
+def vector(*values):
+    return np.asarray(values + (0.0,) * (4 - len(values)), dtype=np.float32).tolist()
+
+
+def test_near_duplicates_use_cached_embeddings_only():
+    inner = CountingEmbedder({"likes tea": vector(1, 0), "enjoys tea": vector(0.99, 0.05), "has a cat": vector(0, 1)})
+    embedder = CachedEmbedder(inner, "test", dims=4)
+    for text in ("likes tea", "enjoys tea", "has a cat"):
+        embedder.embed(text, "add")
+    calls = inner.calls
+
+    packed = pack_system_prompt(["likes tea", "Likes  tea", "enjoys tea", "has a cat", "not cached yet"],
+                                embedder=embedder, token_budget=0, dedupe_threshold=0.9)
+    assert packed.memories == ["likes tea", "has a cat", "not cached yet"]
+    assert packed.duplicates == 2
+    # Packing the prompt never embeds
+    assert inner.calls == calls
+
+
+def test_lookups_do_not_change_the_hit_rate():
+    embedder = CachedEmbedder(CountingEmbedder({"likes tea": vector(1, 0)}), "test", dims=4)
+    embedder.embed("likes tea", "add")
+    before = embedder.stats()
+
+    assert embedder.lookup_batch(["likes tea", "unknown"])[1] is None
+    after = embedder.stats()
+    assert (after["hits"], after["misses"], after["hit_rate"]) == (before["hits"], before["misses"], before["hit_rate"])
+    assert after["embed_calls"] == 1
+
+
+def test_embedder_without_cache_is_not_called():
+    inner = CountingEmbedder({})
+    packed = pack_system_prompt(["a", "b"], embedder=inner, token_budget=0)
+    assert packed.memories == ["a", "b"]
+    assert inner.calls == 0
+
+
+def test_token_budget_keeps_score_order():
+    memories = ["first memory", "a much longer second memory " * 10, "third"]
+    packed = pack_system_prompt({"results": [{"memory": text} for text in memories]}, token_budget=10)
+    assert packed.memories == ["first memory", "third"]
+    assert packed.over_budget == 1
+    assert packed.prompt.startswith(PERSONAS["loving"])
+    assert packed.tokens == estimate_tokens(packed.prompt)
@@ -0,0 +1,104 @@
+import threading
+import types
+
+from itch7_back.search_cache import CachedSearchMemory, SearchCache
+
+
+def test_hit_until_invalidated():
+    cache = SearchCache()
+    calls = []
+
+    def search():
+        calls.append(1)
+        return {"results": [len(calls)]}
+
+    assert cache.search("alice", " hello  ", 5, search) == {"results": [1]}
+    assert cache.search("alice", "hello", 5, search) == {"results": [1]}
+    cache.invalidate("alice")
+    assert cache.search("alice", "hello", 5, search) == {"results": [2]}
+    assert cache.stats()["hits"] == 1
+
+
+def test_result_is_a_copy():
+    cache = SearchCache()
+    cache.search("alice", "q", 5, lambda: {"results": []})["results"].append("changed")
+    assert cache.search("alice", "q", 5, lambda: None) == {"results": []}
+
+
+def test_search_racing_a_write_is_not_cached():
+    cache = SearchCache()
+    started, release = threading.Event(), threading.Event()
+
+    def slow_search():
+        started.set()
+        release.wait(5)
+        return {"results": ["stale"]}
+
+    thread = threading.Thread(target=cache.search, args=("alice", "q", 5, slow_search))
+    thread.start()
+    started.wait(5)
+    cache.invalidate("alice")
+    release.set()
+    thread.join(5)
+
+    assert cache.stats()["entries"] == 0
+    assert cache.search("alice", "q", 5, lambda: {"results": ["fresh"]}) == {"results": ["fresh"]}
+
+
+def test_concurrent_identical_searches_are_coalesced():
+    cache = SearchCache()
+    started, release = threading.Event(), threading.Event()
+    calls = []
+
+    def slow_search():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        return {"results": []}
+
+    owner = threading.Thread(target=cache.search, args=("alice", "q", 5, slow_search))
+    owner.start()
+    started.wait(5)
+    waiter = threading.Thread(target=cache.search, args=("alice", "q", 5, slow_search))
+    waiter.start()
+    release.set()
+    owner.join(5)
+    waiter.join(5)
+    assert len(calls) == 1
+
+
+def test_bookkeeping_does_not_grow_with_users():
+    cache = SearchCache(max_entries=4)
+    for index in range(100):
+        cache.search(f"user_{index}", "q", 5, lambda: {"results": []})
+        cache.invalidate(f"user_{index}")
+        cache.invalidate(f"never_searched_{index}")
+    cache.clear()
+    assert cache._generations == {}
+    assert cache._searching == {}
+    assert cache._user_keys == {}
+
+
+def test_failed_search_releases_bookkeeping():
+    cache = SearchCache()
+
+    def failing():
+        raise RuntimeError("qdrant down")
+
+    try:
+        cache.search("alice", "q", 5, failing)
+    except RuntimeError:
+        pass
+    assert cache._searching == {}
+    assert cache._inflight == {}
+
+
+def test_collections_do_not_share_results():
+    cache = SearchCache()
+    default = CachedSearchMemory(types.SimpleNamespace(search=lambda query, user_id, limit: {"results": ["default"]}),
+                                 cache, collection="itch7_memory")
+    own = CachedSearchMemory(types.SimpleNamespace(search=lambda query, user_id, limit: {"results": ["own"]}),
+                             cache, user_id="alice", collection="itch7_memory_alice")
+
+    assert default.search("q", user_id="alice", limit=5) == {"results": ["default"]}
+    assert own.search("q", user_id="alice", limit=5) == {"results": ["own"]}